@@ -1,9 +1,29 @@
 """Audio processing endpoints"""
 
-from fastapi import APIRouter, HTTPException
+import asyncio
 
-from app.api.schemas.audio import SeparationRequest, TransposeRequest, TempoRequest
-from app.services.demucs_service import demucs_service
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import Literal
+
+from app.api.schemas.audio import (
+    AnalysisRequest,
+    PreviewParams,
+    RemixRequest,
+    SeparationRequest,
+    TransposeRequest,
+    TempoRequest,
+)
+from app.core.executors import executors
+from app.core.metrics import PREVIEW_STREAMS
+from app.core.tracing import tracer
+from app.services.analysis_service import analysis_service, transposed_key
+from app.services.bundle_service import bundle_service, parse_range
+from app.services.pitch_tempo_service import pitch_tempo_service
+from app.services.prefetcher import prefetcher
+from app.services.preview_service import PreviewSession, preview_service
+from app.services.remix_service import remix_service
+from app.services.stem_store import ENCODE_FORMATS, stem_store
 from app.services.task_manager import task_manager
 from app.services.storage_service import storage_service
 
@@ -16,6 +36,9 @@ async def separate_audio(request: SeparationRequest):
     """
     Start audio source separation task
 
+    A speculative separation of the same upload, running or finished,
+    is taken over instead of starting again.
+
     Args:
         request: Separation parameters
 
@@ -23,19 +46,21 @@ async def separate_audio(request: SeparationRequest):
         Task ID for tracking progress
     """
     # Validate file exists
-    if not storage_service.file_exists(request.file_id, directory="upload"):
+    if not await storage_service.file_exists(request.file_id, directory="upload"):
         raise HTTPException(status_code=404, detail="File not found")
 
     # Create task
-    task_id = task_manager.create_task()
+    task_id = await task_manager.create_task()
+    tracer.start_trace(task_id)
 
     # Start separation in background
-    task_manager.start_background_task(
-        task_id,
-        demucs_service.separate_audio,
-        file_id=request.file_id,
-        model_name=request.model,
-    )
+    with tracer.span("route.separate", file_id=request.file_id, model=request.model):
+        task_manager.start_background_task(
+            task_id,
+            prefetcher.separate,
+            file_id=request.file_id,
+            model_name=request.model,
+        )
 
     return {"task_id": task_id, "message": "Separation task started"}
 
@@ -52,15 +77,34 @@ async def transpose_audio(request: TransposeRequest):
         Task ID for tracking progress
     """
     # Validate file exists
-    if not storage_service.file_exists(request.file_id, directory="upload"):
+    if not await storage_service.file_exists(request.file_id, directory="upload"):
         raise HTTPException(status_code=404, detail="File not found")
 
-    # TODO: Implement pitch transposition service
-    # For now, return placeholder
-    raise HTTPException(
-        status_code=501,
-        detail="Pitch transposition coming in Phase 3"
-    )
+    # Create task
+    task_id = await task_manager.create_task()
+    tracer.start_trace(task_id)
+
+    # Start transposition in background
+    with tracer.span("route.transpose", file_id=request.file_id, semitones=request.semitones):
+        task_manager.start_background_task(
+            task_id,
+            pitch_tempo_service.transpose_audio,
+            file_id=request.file_id,
+            semitones=request.semitones,
+        )
+
+    response = {"task_id": task_id, "message": "Transposition task started"}
+
+    # Suggest targets from a previous analysis, never analyse here
+    analysis = await analysis_service.get_cached(request.file_id)
+    if analysis and analysis["key"]:
+        response["key"] = {
+            "from": analysis["key"]["name"],
+            "to": transposed_key(analysis["key"], request.semitones),
+        }
+        response["suggestions"] = analysis["suggestions"]["semitones"]
+
+    return response
 
 
 @router.post("/tempo")
@@ -75,38 +119,290 @@ async def change_tempo(request: TempoRequest):
         Task ID for tracking progress
     """
     # Validate file exists
-    if not storage_service.file_exists(request.file_id, directory="upload"):
+    if not await storage_service.file_exists(request.file_id, directory="upload"):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Create task
+    task_id = await task_manager.create_task()
+    tracer.start_trace(task_id)
+
+    # Start tempo change in background
+    with tracer.span("route.tempo", file_id=request.file_id, tempo_factor=request.tempo_factor):
+        task_manager.start_background_task(
+            task_id,
+            pitch_tempo_service.change_tempo,
+            file_id=request.file_id,
+            tempo_factor=request.tempo_factor,
+        )
+
+    response = {"task_id": task_id, "message": "Tempo change task started"}
+
+    # Suggest targets from a previous analysis, never analyse here
+    analysis = await analysis_service.get_cached(request.file_id)
+    if analysis and analysis["tempo"]["bpm"]:
+        bpm = analysis["tempo"]["bpm"]
+        response["bpm"] = {"from": bpm, "to": round(bpm * request.tempo_factor, 2)}
+        response["suggestions"] = analysis["suggestions"]["tempo_factors"]
+
+    return response
+
+
+@router.post("/analyze")
+async def analyze_audio(request: AnalysisRequest):
+    """
+    Start tempo, key and loudness analysis
+
+    Files with the same content are analysed only once, the task then
+    completes with the cached result.
+
+    Args:
+        request: Analysis parameters
+
+    Returns:
+        Task ID for tracking progress
+    """
+    # Validate file exists
+    if not await storage_service.file_exists(request.file_id, directory="upload"):
         raise HTTPException(status_code=404, detail="File not found")
 
-    # TODO: Implement tempo change service
-    # For now, return placeholder
-    raise HTTPException(
-        status_code=501,
-        detail="Tempo modification coming in Phase 3"
+    # Create task
+    task_id = await task_manager.create_task()
+    tracer.start_trace(task_id)
+
+    # Start analysis in background
+    with tracer.span("route.analyze", file_id=request.file_id):
+        task_manager.start_background_task(
+            task_id,
+            prefetcher.analyze,
+            file_id=request.file_id,
+        )
+
+    return {"task_id": task_id, "message": "Analysis task started"}
+
+
+@router.websocket("/preview/{file_id}")
+async def preview_stream(
+    websocket: WebSocket,
+    file_id: str,
+    position: float = 0.0,
+    semitones: float = 0.0,
+    tempo: float = 1.0,
+):
+    """
+    Stream a real-time pitch/tempo preview of an upload
+
+    The server first sends a JSON {"type": "format"} message with
+    sample_rate, channels and block_frames. Binary blocks follow: a
+    12-byte little-endian header (float64 track position in seconds,
+    uint32 seek generation), then interleaved int16 PCM. The client can
+    send JSON messages at any time, and they apply from the next block:
+
+        {"type": "params", "semitones": 3, "tempo": 1.1}
+        {"type": "seek", "position": 42.0}
+
+    A seek increments the generation, so blocks of the old position that
+    are still in flight can be dropped. {"type": "end"} follows the last
+    block of the track.
+
+    Args:
+        websocket: The connection
+        file_id: ID of the uploaded audio file
+        position: Start position in seconds
+        semitones: Initial pitch shift (-12 to +12)
+        tempo: Initial tempo factor (0.5x to 2.0x)
+    """
+    try:
+        params = PreviewParams(semitones=semitones, tempo=tempo)
+        stream = await preview_service.open(file_id, max(0.0, position), params.semitones, params.tempo)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e)[:120])
+        return
+    except FileNotFoundError:
+        await websocket.close(code=1008, reason="File not found")
+        return
+
+    await websocket.accept()
+    frames, _ = preview_service.block_frames()
+    await websocket.send_json({
+        "type": "format",
+        "sample_rate": stream.sample_rate,
+        "channels": stream.channels,
+        "block_frames": frames,
+        "encoding": "s16le",
+    })
+
+    session = PreviewSession(stream)
+
+    async def receive():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            text = message.get("text")
+            if text is None:
+                await websocket.send_json(
+                    {"type": "error", "detail": "Only text messages are accepted"}
+                )
+                continue
+            try:
+                session.handle(text)
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+
+    with PREVIEW_STREAMS.track_inprogress():
+        tasks = [
+            asyncio.create_task(session.run(websocket.send_bytes, websocket.send_json)),
+            asyncio.create_task(receive()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is not None and not isinstance(error, WebSocketDisconnect):
+                    print(f"Preview stream of {file_id} failed: {error}")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+@router.get("/analysis/{file_id}")
+async def get_analysis(file_id: str):
+    """
+    Get the analysis of a file
+
+    Args:
+        file_id: ID of the uploaded audio file
+
+    Returns:
+        Tempo, beat grid, key, loudness, section energy and suggested
+        transpose / tempo targets
+    """
+    analysis = await analysis_service.get_cached(file_id)
+    if not analysis:
+        raise HTTPException(status_code=404, detail="File has not been analysed")
+    return analysis
+
+
+@router.post("/remix")
+async def remix_stems(request: RemixRequest):
+    """
+    Mix separated stems with per-stem gains and stream the result
+
+    Args:
+        request: Remix parameters
+
+    Returns:
+        Streaming audio response
+    """
+    try:
+        gains = await executors.run("fs", remix_service.resolve_gains, request.file_id, request.gains)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="No separated stems for this file")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Opens the stems (or a cached remix), the encoding itself is streamed
+    stream = await executors.run("fs", remix_service.stream_remix, request.file_id, gains, request.format)
+
+    return StreamingResponse(
+        stream,
+        media_type=ENCODE_FORMATS[request.format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{request.file_id}_remix.{request.format}"',
+        },
     )
 
 
 @router.get("/download/{file_id}")
-async def download_processed(file_id: str):
+async def download_processed(file_id: str, format: Literal["mp3", "wav", "flac"] = "mp3"):
     """
     Download a processed audio file
 
+    Separated stems are encoded to the requested format on first download.
+
     Args:
         file_id: The file ID (can include stem name like "original_vocals")
+        format: Output format for stems ("mp3", "wav" or "flac")
 
     Returns:
         File download
     """
-    from fastapi.responses import FileResponse
+    # Stems are stored raw and encoded lazily, other outputs are final files
+    file_path = await stem_store.get_encoded(file_id, format)
 
-    # Check in processed directory
-    file_path = storage_service.get_file_path(file_id, directory="processed")
+    if not file_path:
+        file_path = await storage_service.get_file_path(file_id, directory="processed")
 
     if not file_path:
         raise HTTPException(status_code=404, detail="Processed file not found")
 
     return FileResponse(
         path=file_path,
-        media_type="audio/mpeg",
+        media_type=ENCODE_FORMATS.get(file_path.suffix.lstrip("."), "audio/mpeg"),
         filename=file_path.name,
     )
+
+
+@router.get("/download/{file_id}/bundle")
+async def download_bundle(
+    file_id: str,
+    request: Request,
+    format: Literal["mp3", "wav", "flac"] = "mp3",
+):
+    """
+    Download all stems of a file as one ZIP archive
+
+    The archive is streamed in store mode and supports single byte ranges,
+    so interrupted downloads can be resumed.
+
+    Args:
+        file_id: ID of the original upload
+        request: Incoming request (for Range / If-Range headers)
+        format: Stem format inside the archive
+
+    Returns:
+        Streaming ZIP response
+    """
+    try:
+        bundle = await bundle_service.build(file_id, format)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    if not bundle:
+        raise HTTPException(status_code=404, detail="No separated stems for this file")
+
+    etag = f'"{bundle.etag}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{file_id}_stems.zip"',
+    }
+
+    # A stale If-Range means the client holds a different bundle: send it all
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, bundle.size)
+    except ValueError:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{bundle.size}"},
+        )
+
+    if byte_range is None:
+        headers["Content-Length"] = str(bundle.size)
+        return StreamingResponse(bundle.iter_range(), media_type="application/zip", headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{bundle.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        bundle.iter_range(start, end),
+        status_code=206,
+        media_type="application/zip",
+        headers=headers,
+    )
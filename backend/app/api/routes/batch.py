@@ -0,0 +1,97 @@
+"""Batch job endpoints"""
+
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+
+from app.api.schemas.batch import BatchManifest, BatchRequest, BatchResponse
+from app.services.batch_service import batch_service
+from app.services.storage_service import storage_service
+
+
+router = APIRouter()
+
+
+@router.post("", response_model=BatchResponse)
+async def create_batch(request: BatchRequest):
+    """
+    Submit many file operations as one batch
+
+    Args:
+        request: Batch items (file_id, operation, params)
+
+    Returns:
+        BatchResponse with batch ID and per-item task IDs
+    """
+    # Validate files exist
+    file_ids = sorted({item.file_id for item in request.items})
+    found = await asyncio.gather(
+        *(storage_service.file_exists(file_id, directory="upload") for file_id in file_ids)
+    )
+    missing = [file_id for file_id, exists in zip(file_ids, found) if not exists]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Files not found: {', '.join(missing)}")
+
+    try:
+        batch_id = await batch_service.create_batch(request.items)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return await batch_service.get_batch(batch_id)
+
+
+@router.get("/{batch_id}", response_model=BatchResponse)
+async def get_batch_status(batch_id: str):
+    """
+    Get aggregate batch status and progress
+
+    Args:
+        batch_id: The batch ID
+
+    Returns:
+        BatchResponse with per-item status
+    """
+    batch = await batch_service.get_batch(batch_id)
+
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    return batch
+
+
+@router.get("/{batch_id}/manifest", response_model=BatchManifest)
+async def get_batch_manifest(batch_id: str):
+    """
+    Get all batch outputs as one manifest
+
+    Args:
+        batch_id: The batch ID
+
+    Returns:
+        BatchManifest with download URLs of every output
+    """
+    manifest = await batch_service.get_manifest(batch_id)
+
+    if not manifest:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    return manifest
+
+
+@router.delete("/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """
+    Cancel all unfinished items of a batch
+
+    Args:
+        batch_id: The batch ID
+
+    Returns:
+        Success message
+    """
+    cancelled = await batch_service.cancel_batch(batch_id)
+
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    return {"message": "Batch cancelled successfully"}
@@ -0,0 +1,66 @@
+"""AI metadata endpoints"""
+
+from fastapi import APIRouter, HTTPException
+
+from app.api.schemas.metadata import MetadataRequest
+from app.config import settings
+from app.core.tracing import tracer
+from app.services.gemini_service import gemini_service
+from app.services.task_manager import task_manager
+from app.services.storage_service import storage_service
+
+
+router = APIRouter()
+
+
+@router.post("/analyze")
+async def analyze_metadata(request: MetadataRequest):
+    """
+    Start describing a track with Gemini (genre, mood, instruments)
+
+    Only the local analysis and a short excerpt are sent, and a track is
+    described once per prompt version.
+
+    Args:
+        request: Metadata parameters
+
+    Returns:
+        Task ID for tracking progress
+    """
+    # Validate file exists
+    if not await storage_service.file_exists(request.file_id, directory="upload"):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if not settings.google_api_key and not await gemini_service.get_cached(request.file_id):
+        raise HTTPException(status_code=503, detail="Gemini is not configured")
+
+    # Create task
+    task_id = await task_manager.create_task()
+    tracer.start_trace(task_id)
+
+    # Start description in background
+    with tracer.span("route.metadata", file_id=request.file_id):
+        task_manager.start_background_task(
+            task_id,
+            gemini_service.describe,
+            file_id=request.file_id,
+        )
+
+    return {"task_id": task_id, "message": "Metadata analysis task started"}
+
+
+@router.get("/{file_id}")
+async def get_metadata(file_id: str):
+    """
+    Get the Gemini description of a track
+
+    Args:
+        file_id: ID of the uploaded audio file
+
+    Returns:
+        Description and the features it was based on
+    """
+    metadata = await gemini_service.get_cached(file_id)
+    if not metadata:
+        raise HTTPException(status_code=404, detail="File has not been described")
+    return metadata
@@ -1,14 +1,38 @@
 """Task status endpoints"""
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Literal, Optional
 
-from app.api.schemas.task import TaskResponse
+from app.api.schemas.task import TaskListResponse, TaskResponse, TaskStatus
+from app.core.tracing import tracer
 from app.services.task_manager import task_manager
 
 
 router = APIRouter()
 
 
+@router.get("", response_model=TaskListResponse)
+async def list_tasks(
+    status: Optional[TaskStatus] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    offset: int = Query(default=0, ge=0),
+):
+    """
+    List tasks, newest first
+
+    Args:
+        status: Only tasks with this status
+        limit: Page size
+        offset: Number of tasks to skip
+
+    Returns:
+        One page of tasks and the total count
+    """
+    items, total = await task_manager.list_tasks(status, limit, offset)
+    return TaskListResponse(items=items, total=total, limit=limit, offset=offset)
+
+
 @router.get("/{task_id}", response_model=TaskResponse)
 async def get_task_status(task_id: str):
     """
@@ -20,7 +44,7 @@ async def get_task_status(task_id: str):
     Returns:
         TaskResponse with current status
     """
-    task = task_manager.get_task(task_id)
+    task = await task_manager.get_task(task_id)
 
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -28,6 +52,35 @@ async def get_task_status(task_id: str):
     return task
 
 
+@router.get("/{task_id}/trace")
+async def get_task_trace(task_id: str, format: Literal["chrome", "collapsed"] = "chrome"):
+    """
+    Download the recorded trace of a task
+
+    Args:
+        task_id: The task ID
+        format: "chrome" for Chrome trace JSON, "collapsed" for flamegraph stacks
+
+    Returns:
+        Trace file download
+    """
+    trace = tracer.get_trace(task_id)
+
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found (task was not sampled)")
+
+    if format == "collapsed":
+        return PlainTextResponse(
+            trace.to_collapsed(),
+            headers={"Content-Disposition": f'attachment; filename="{task_id}.folded"'},
+        )
+
+    return JSONResponse(
+        trace.to_chrome_trace(),
+        headers={"Content-Disposition": f'attachment; filename="{task_id}.trace.json"'},
+    )
+
+
 @router.delete("/{task_id}")
 async def cancel_task(task_id: str):
     """
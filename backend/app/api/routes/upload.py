@@ -1,12 +1,16 @@
 """Upload endpoint for audio files"""
 
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from fastapi.responses import FileResponse, JSONResponse
 from pathlib import Path
 
-from app.api.schemas.audio import AudioResponse
+from app.api.schemas.audio import AudioResponse, UploadSessionCreate, UploadSessionResponse
+from app.core.metrics import UPLOAD_SECONDS, UPLOAD_SIZE_BYTES
 from app.core.security import validate_audio_file, sanitize_filename
+from app.services.prefetcher import prefetcher
+from app.services.stem_store import stem_store
 from app.services.storage_service import storage_service
+from app.services.upload_session_service import UploadSession, upload_session_service
 from app.core.exceptions import FileNotFoundError as AppFileNotFoundError
 
 
@@ -24,20 +28,25 @@ async def upload_audio(file: UploadFile = File(...)):
     Returns:
         AudioResponse with file_id and metadata
     """
-    # Validate file
-    await validate_audio_file(file)
+    with UPLOAD_SECONDS.time():
+        # Validate file
+        await validate_audio_file(file)
 
-    # Sanitize filename
-    safe_filename = sanitize_filename(file.filename or "unnamed.mp3")
+        # Sanitize filename
+        safe_filename = sanitize_filename(file.filename or "unnamed.mp3")
 
-    # Read file content
-    file_content = await file.read()
+        # Read file content
+        file_content = await file.read()
+        UPLOAD_SIZE_BYTES.observe(len(file_content))
 
-    # Save file
-    file_id, file_path = await storage_service.save_upload(file_content, safe_filename)
+        # Save file
+        file_id, file_path = await storage_service.save_upload(file_content, safe_filename)
 
-    # Extract audio metadata
-    metadata = await storage_service.get_audio_metadata(file_path)
+        # Extract audio metadata
+        metadata = await storage_service.get_audio_metadata(file_path)
+
+    # A separation request usually follows, start on it while idle
+    prefetcher.submit(file_id)
 
     return AudioResponse(
         file_id=file_id,
@@ -46,9 +55,153 @@ async def upload_audio(file: UploadFile = File(...)):
         sample_rate=metadata.get("sample_rate"),
         channels=metadata.get("channels"),
         file_size=metadata.get("file_size", len(file_content)),
+        content_hash=await storage_service.get_content_hash(file_id),
+    )
+
+
+def _session_response(session: UploadSession) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        upload_id=session.upload_id,
+        filename=session.filename,
+        file_size=session.file_size,
+        chunk_size=session.chunk_size,
+        num_chunks=session.num_chunks,
+        received=session.received,
+        missing=session.missing,
+    )
+
+
+@router.post("/uploads", response_model=UploadSessionResponse)
+async def create_upload_session(request: UploadSessionCreate):
+    """
+    Start a resumable chunked upload
+
+    Args:
+        request: Filename, total size and optional chunk size
+
+    Returns:
+        UploadSessionResponse with upload_id and chunk layout
+    """
+    try:
+        session = await upload_session_service.create_session(
+            sanitize_filename(request.filename),
+            request.file_size,
+            request.chunk_size,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return _session_response(session)
+
+
+@router.put("/uploads/{upload_id}/chunks/{index}", response_model=UploadSessionResponse)
+async def upload_chunk(upload_id: str, index: int, request: Request):
+    """
+    Upload one chunk (raw bytes in the request body)
+
+    Chunks can be sent in parallel and in any order, re-sending a chunk
+    overwrites it.
+
+    Args:
+        upload_id: Upload session ID
+        index: Chunk number, starting at 0
+
+    Returns:
+        UploadSessionResponse with received and missing chunks
+    """
+    if not upload_session_service.get_session(upload_id):
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+    data = await request.body()
+
+    try:
+        session = await upload_session_service.write_chunk(upload_id, index, data)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return _session_response(session)
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(upload_id: str):
+    """
+    Get which chunks of an upload have been received
+
+    Args:
+        upload_id: Upload session ID
+
+    Returns:
+        UploadSessionResponse with received and missing chunks
+    """
+    session = upload_session_service.get_session(upload_id)
+
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+    return _session_response(session)
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=AudioResponse)
+async def complete_upload(upload_id: str):
+    """
+    Finalize a chunked upload once all chunks are received
+
+    Args:
+        upload_id: Upload session ID
+
+    Returns:
+        AudioResponse with file_id and metadata
+    """
+    session = upload_session_service.get_session(upload_id)
+
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+    try:
+        file_id, file_path, digest = await upload_session_service.finalize(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    metadata = await storage_service.get_audio_metadata(file_path)
+    prefetcher.submit(file_id)
+
+    return AudioResponse(
+        file_id=file_id,
+        filename=session.filename,
+        duration=metadata.get("duration"),
+        sample_rate=metadata.get("sample_rate"),
+        channels=metadata.get("channels"),
+        file_size=metadata.get("file_size", session.file_size),
+        content_hash=digest,
     )
 
 
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    """
+    Abort a chunked upload and delete received data
+
+    Args:
+        upload_id: Upload session ID
+
+    Returns:
+        Success message
+    """
+    try:
+        aborted = await upload_session_service.abort(upload_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if not aborted:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+    return {"message": "Upload aborted"}
+
+
 @router.get("/files/{file_id}", response_model=AudioResponse)
 async def get_file_info(file_id: str):
     """
@@ -60,7 +213,7 @@ async def get_file_info(file_id: str):
     Returns:
         AudioResponse with file metadata
     """
-    file_path = storage_service.get_file_path(file_id, directory="upload")
+    file_path = await storage_service.get_file_path(file_id, directory="upload", fetch=False)
 
     if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
@@ -89,7 +242,12 @@ async def download_file(file_id: str, directory: str = "upload"):
     Returns:
         File download response
     """
-    file_path = storage_service.get_file_path(file_id, directory=directory)
+    file_path = None
+    if directory == "processed":
+        # Stems are stored raw and encoded on their first download
+        file_path = await stem_store.get_encoded(file_id, "mp3")
+    if not file_path:
+        file_path = await storage_service.get_file_path(file_id, directory=directory)
 
     if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
@@ -1,6 +1,6 @@
 """Pydantic schemas for audio operations"""
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import Literal, Optional
 
 
@@ -12,6 +12,27 @@ class AudioResponse(BaseModel):
     sample_rate: Optional[int] = None
     channels: Optional[int] = None
     file_size: int
+    content_hash: Optional[str] = None
+
+
+class UploadSessionCreate(BaseModel):
+    """Request to start a resumable chunked upload"""
+    filename: str
+    file_size: int = Field(gt=0, description="Total file size in bytes")
+    chunk_size: Optional[int] = Field(
+        default=None, gt=0, description="Chunk size in bytes, a multiple of 1 MiB"
+    )
+
+
+class UploadSessionResponse(BaseModel):
+    """State of a resumable chunked upload"""
+    upload_id: str
+    filename: str
+    file_size: int
+    chunk_size: int
+    num_chunks: int
+    received: list[int]
+    missing: list[int]
 
 
 class SeparationRequest(BaseModel):
@@ -31,3 +52,32 @@ class TempoRequest(BaseModel):
     """Request to change audio tempo"""
     file_id: str
     tempo_factor: float = Field(gt=0.5, lt=2.0, description="Tempo factor (0.5x to 2.0x)")
+
+
+class PreviewParams(BaseModel):
+    """Pitch and tempo of a real-time preview stream"""
+    semitones: float = Field(default=0.0, ge=-12, le=12, description="Pitch shift in semitones")
+    tempo: float = Field(default=1.0, ge=0.5, le=2.0, description="Tempo factor (0.5x to 2.0x)")
+
+
+class AnalysisRequest(BaseModel):
+    """Request to analyse tempo, key and loudness of a file"""
+    file_id: str
+
+
+class RemixRequest(BaseModel):
+    """Request to mix separated stems with custom gains"""
+    file_id: str
+    gains: dict[str, float] = Field(
+        default_factory=dict,
+        description="Gain per stem (0.0 to 2.0), stems not listed keep gain 1.0",
+    )
+    format: Literal["mp3", "wav", "flac"] = "mp3"
+
+    @field_validator("gains")
+    @classmethod
+    def check_gains(cls, gains: dict[str, float]) -> dict[str, float]:
+        for stem, gain in gains.items():
+            if not 0.0 <= gain <= 2.0:
+                raise ValueError(f"Gain for {stem} must be between 0.0 and 2.0")
+        return gains
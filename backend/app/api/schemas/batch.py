@@ -0,0 +1,74 @@
+"""Pydantic schemas for batch job submission"""
+
+from pydantic import BaseModel, Field
+from typing import Any, Literal, Optional
+from datetime import datetime
+
+from app.api.schemas.task import TaskStatus
+
+
+BatchOperation = Literal["separate", "transpose", "tempo"]
+
+
+class BatchItem(BaseModel):
+    """One operation on one uploaded file"""
+    file_id: str
+    operation: BatchOperation
+    params: dict[str, Any] = Field(
+        default_factory=dict,
+        description="Fields of the matching single-file request, e.g. {\"model\": \"htdemucs\"}",
+    )
+
+
+class BatchRequest(BaseModel):
+    """Request to run many operations as one batch"""
+    items: list[BatchItem] = Field(min_length=1, max_length=500)
+
+
+class BatchItemStatus(BaseModel):
+    """Status of a single batch item"""
+    index: int
+    file_id: str
+    operation: BatchOperation
+    params: dict[str, Any]
+    task_id: str
+    status: TaskStatus
+    progress: float
+    error: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    """Aggregate status of a batch"""
+    batch_id: str
+    status: TaskStatus
+    progress: float = Field(ge=0.0, le=1.0, description="Mean progress of all items")
+    total: int
+    completed: int
+    failed: int
+    items: list[BatchItemStatus]
+    created_at: datetime
+
+
+class BatchOutput(BaseModel):
+    """A file produced by a batch item"""
+    file_id: str
+    url: str
+
+
+class BatchManifestItem(BaseModel):
+    """Outputs of a single batch item"""
+    index: int
+    file_id: str
+    operation: BatchOperation
+    params: dict[str, Any]
+    task_id: str
+    status: TaskStatus
+    error: Optional[str] = None
+    outputs: dict[str, BatchOutput] = {}
+
+
+class BatchManifest(BaseModel):
+    """All results of a batch in one document"""
+    batch_id: str
+    status: TaskStatus
+    items: list[BatchManifestItem]
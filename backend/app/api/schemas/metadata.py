@@ -0,0 +1,8 @@
+"""Pydantic schemas for AI metadata"""
+
+from pydantic import BaseModel
+
+
+class MetadataRequest(BaseModel):
+    """Request to describe a track with Gemini"""
+    file_id: str
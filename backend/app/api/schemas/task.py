@@ -27,6 +27,14 @@ class TaskResponse(BaseModel):
     updated_at: datetime
 
 
+class TaskListResponse(BaseModel):
+    """One page of tasks"""
+    items: list[TaskResponse]
+    total: int
+    limit: int
+    offset: int
+
+
 class TaskCreate(BaseModel):
     """Model for creating a new task"""
     task_id: str
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional
 
 
 class Settings(BaseSettings):
@@ -8,17 +8,107 @@ class Settings(BaseSettings):
 
     # Google AI Studio
     google_api_key: str = ""
+    gemini_api_base: str = "https://generativelanguage.googleapis.com"
+    gemini_model: str = "gemini-1.5-flash"
+    gemini_max_concurrency: int = 4
+    gemini_timeout_seconds: float = 30.0
+    gemini_max_retries: int = 2
+    gemini_excerpt_seconds: float = 20.0  # 0 sends features only
 
     # Storage
     upload_dir: Path = Path("./uploads")
     processed_dir: Path = Path("./processed")
+    # "s3" shares files through a bucket, the directories above become local caches
+    storage_backend: Literal["local", "s3"] = "local"
+    s3_endpoint_url: Optional[str] = None  # Default: AWS in s3_region
+    s3_bucket: str = ""
+    s3_region: str = "us-east-1"
+    s3_access_key: str = ""
+    s3_secret_key: str = ""
+    s3_prefix: str = ""  # Prepended to every object key
+    s3_part_size_mb: int = 8  # Multipart upload part and ranged download size
+    s3_max_connections: int = 16  # Pooled connections, also parts moved in parallel
+    s3_url_expiry_seconds: int = 3600  # Presigned URLs handed to decoders
 
     # File limits
     max_file_size_mb: int = 100
 
+    # Chunked uploads
+    upload_chunk_size_mb: int = 8
+    upload_session_ttl_hours: int = 24
+
+    # Demucs models
+    warmup_models: list[str] = []  # Preloaded in the background at startup
+    max_cached_models: int = 2
+    # Pre-converted models (python -m app.tools.import_model), mapped instead of downloaded
+    demucs_repo_dir: Optional[Path] = None
+    demucs_repo_offline: bool = False  # Never download, fail on models missing from the repository
+    demucs_repo_verify: bool = True  # Check weight checksums on every load
+    # "thread", or "process" for worker processes killed on cancellation
+    separation_executor: Literal["thread", "process"] = "thread"
+    # Quiet stretches are not sent through the model
+    separation_skip_silence: bool = True
+    silence_threshold_db: float = -60.0  # dBFS, frames below this are silent
+    silence_min_seconds: float = 2.0  # Shorter gaps are separated anyway
+    silence_padding_seconds: float = 0.5  # Context kept around active audio, crossfaded
+    # Separated segments reused across uploads sharing audio (0 disables)
+    segment_cache_max_mb: int = 2048
+
+    # Speculative work on fresh uploads while no real job runs
+    prefetch_enabled: bool = True
+    prefetch_separation: bool = True  # Separate too, not only analyse
+    prefetch_model: str = "htdemucs"
+    prefetch_queue_size: int = 8  # Newest uploads waiting for idle time
+
+    # Rubber Band renders at this rate, decoded or resampled through the shared resampler
+    pitch_tempo_sample_rate: int = 44100
+
+    # Real-time pitch/tempo preview over WebSocket
+    preview_sample_rate: int = 44100
+    preview_block_ms: float = 40.0  # Audio per streamed block
+    preview_lead_ms: float = 150.0  # How far streaming runs ahead of playback
+    preview_cache_mb: int = 512  # Decoded PCM kept in memory for previews
+
+    # Threads for blocking work, per kind (see app/core/executors.py)
+    fs_workers: int = 8
+    decode_workers: int = 4
+    render_workers: int = 2
+    inference_workers: int = 2  # Separations at once to start with
+    realtime_workers: int = 2
+    loop_stall_threshold_ms: float = 100.0  # Log event loop stalls longer than this (0 disables)
+
+    # CPU/memory budget of concurrent separations (see app/core/resources.py)
+    adaptive_concurrency: bool = True  # Tune the number of separations to measured throughput
+    inference_workers_max: int = 0  # Upper bound when adapting (0: half the usable cores)
+    inference_job_memory_mb: int = 1500  # Memory estimate of one separation until measured
+    memory_headroom_mb: int = 1024  # Keep this much memory free before starting another
+    resource_interval_seconds: float = 5.0  # Memory sampling interval
+
+    # Job deadlines: overhead + duration * measured real-time factor * factor
+    job_default_realtime_factor: float = 1.0  # Until a preset has been measured
+    job_deadline_factor: float = 3.0
+    job_deadline_overhead_seconds: float = 120.0
+    job_deadline_max_seconds: float = 3 * 3600.0
+    job_stall_timeout_seconds: float = 300.0  # Fail jobs without progress for this long
+    job_kill_grace_seconds: float = 10.0  # Report threads that ignore cancellation
+
+    # Remix presets requested this many times are cached (0 disables)
+    remix_cache_min_requests: int = 2
+
+    # Task store ("sqlite" is shared by all uvicorn workers, "memory" is per process)
+    task_store: Literal["memory", "sqlite"] = "sqlite"
+    task_db_path: Path = Path("./data/tasks.db")
+    task_flush_interval_ms: int = 500  # Progress updates are written in batches
+
     # Redis (optional)
     redis_url: Optional[str] = None
 
+    # Tracing (fraction of tasks traced, 0 disables tracing)
+    trace_sample_rate: float = 0.0
+    trace_max_traces: int = 100
+    trace_profile: bool = False
+    trace_profile_interval_ms: float = 5.0
+
     # Server
     host: str = "0.0.0.0"
     port: int = 8000
@@ -24,3 +24,23 @@ class TaskNotFoundError(AudioProcessingError):
 class ProcessingTimeoutError(AudioProcessingError):
     """Raised when processing takes too long"""
     pass
+
+
+class TaskCancelledError(AudioProcessingError):
+    """Raised inside a job when its task has been cancelled"""
+    pass
+
+
+class ExternalServiceError(AudioProcessingError):
+    """Raised when an external API is unavailable or fails"""
+    pass
+
+
+class ModelRepositoryError(AudioProcessingError):
+    """Raised when a local model is missing, corrupted or cannot be loaded"""
+    pass
+
+
+class ObjectStoreError(AudioProcessingError):
+    """Raised when the object store rejects a request or a transfer fails"""
+    pass
@@ -0,0 +1,110 @@
+"""Bounded thread pools for blocking work, one per kind of work
+
+Nothing that blocks may run on the event loop: one slow disk access or
+decode there stalls every request in flight. Blocking calls go to the
+pool of their kind instead, sized in settings, so that one kind of work
+cannot take all threads from another:
+
+    fs         short filesystem calls: stat, exists, unlink, small reads
+    decode     short CPU-bound work a request waits on: hashing uploads,
+               metadata, decoding for previews, encoding downloads
+    render     long CPU-bound background jobs: Rubber Band renders,
+               analysis passes, Gemini excerpts. Kept apart so that
+               uploads never queue behind them
+    inference  model inference, few threads that each hold a lot of memory.
+               Sized at the most separations app/core/resources.py may
+               allow, which admits them and splits the cores among them
+    realtime   per-block work with a latency budget, e.g. preview streams
+
+The trace context of the caller is carried over to the worker thread.
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from app.config import settings
+from app.core.metrics import EXECUTOR_QUEUE_DEPTH
+from app.core.resources import resources
+
+
+KINDS = ("fs", "decode", "render", "inference", "realtime")
+
+
+class Executors:
+    """Lazily created thread pool per kind of blocking work"""
+
+    def __init__(self):
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self._lock = threading.Lock()
+
+    def size(self, kind: str) -> int:
+        """Configured number of threads for a kind of work"""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown executor kind: {kind}")
+        if kind == "inference":
+            return resources.inference.maximum
+        return max(1, getattr(settings, f"{kind}_workers"))
+
+    def get(self, kind: str) -> ThreadPoolExecutor:
+        """
+        Pool for a kind of work
+
+        Args:
+            kind: One of KINDS
+
+        Returns:
+            The pool, created on first use
+        """
+        pool = self._pools.get(kind)
+        if pool is not None:
+            return pool
+
+        with self._lock:
+            pool = self._pools.get(kind)
+            if pool is None:
+                pool = ThreadPoolExecutor(
+                    max_workers=self.size(kind), thread_name_prefix=f"{kind}-worker"
+                )
+                self._pools[kind] = pool
+                EXECUTOR_QUEUE_DEPTH.labels(kind=kind).set_function(
+                    functools.partial(self.queue_depth, kind)
+                )
+        return pool
+
+    def queue_depth(self, kind: str) -> int:
+        """Jobs submitted but not yet picked up by a worker thread"""
+        pool = self._pools.get(kind)
+        return pool._work_queue.qsize() if pool is not None else 0
+
+    async def run(self, kind: str, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking call in the pool of its kind
+
+        Args:
+            kind: One of KINDS
+            fn: Blocking callable
+            args: Positional arguments
+            kwargs: Keyword arguments
+
+        Returns:
+            Whatever fn returns
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, fn, *args, **kwargs)
+        return await loop.run_in_executor(self.get(kind), call)
+
+    def shutdown(self):
+        """Stop accepting work, running jobs finish in the background"""
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.shutdown(wait=False)
+
+
+# Global instance
+executors = Executors()
@@ -0,0 +1,61 @@
+"""Content hashing that does not depend on how a file was uploaded
+
+The content hash is the SHA-256 of the concatenated SHA-256 digests of
+consecutive 1 MiB blocks. Blocks can be hashed in any order as they
+arrive (e.g. parallel upload chunks aligned to the block size), and the
+result is the same as hashing the finished file front to back.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Iterable, List
+
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def block_digests(data: bytes) -> List[bytes]:
+    """
+    Hash data block by block
+
+    Args:
+        data: Bytes starting at a block boundary
+
+    Returns:
+        SHA-256 digest of every HASH_BLOCK_SIZE block (the last may be short)
+    """
+    view = memoryview(data)
+    return [
+        hashlib.sha256(view[start:start + HASH_BLOCK_SIZE]).digest()
+        for start in range(0, len(data), HASH_BLOCK_SIZE)
+    ]
+
+
+def combine_digests(digests: Iterable[bytes]) -> str:
+    """
+    Combine block digests, in file order, into the content hash
+
+    Args:
+        digests: Block digests in file order
+
+    Returns:
+        Hex content hash
+    """
+    return hashlib.sha256(b"".join(digests)).hexdigest()
+
+
+def content_hash(data: bytes) -> str:
+    """Content hash of bytes held in memory"""
+    return combine_digests(block_digests(data))
+
+
+def file_content_hash(path: Path) -> str:
+    """Content hash of a file, read block by block"""
+    digests = []
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digests.append(hashlib.sha256(block).digest())
+    return combine_digests(digests)
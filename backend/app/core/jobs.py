@@ -0,0 +1,122 @@
+"""Cooperative cancellation and progress reporting for blocking jobs
+
+Blocking work runs in executor threads or worker processes, out of reach
+of asyncio cancellation. Jobs get a JobContext instead. It reports
+progress and stage timings through callbacks. It raises when the task's
+CancelToken fires, which jobs check between units of work (inference
+segments, stem writes). The same job code therefore runs unchanged in a
+thread, where the callbacks update the task directly, and in a worker
+process, where they send messages to the parent.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from app.core.exceptions import TaskCancelledError
+from app.core.tracing import tracer
+
+
+class CancelToken:
+    """Thread-safe cancellation flag with an optional reason"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.error: Optional[BaseException] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, error: Optional[BaseException] = None):
+        """
+        Request cancellation
+
+        Args:
+            error: Exception raised by check(), TaskCancelledError by default
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.error = error or TaskCancelledError("Task was cancelled")
+            self._event.set()
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            callback()
+
+    def check(self):
+        """Raise the cancellation error if cancellation was requested"""
+        if self._event.is_set():
+            raise self.error
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Call callback on cancellation (immediately if already cancelled)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class JobContext:
+    """Handle a running job uses to report progress and notice cancellation"""
+
+    def __init__(
+        self,
+        token: Optional[CancelToken] = None,
+        on_progress: Optional[Callable[[float, str], None]] = None,
+        on_stage: Optional[Callable[[str, float], None]] = None,
+        on_start: Optional[Callable[[], None]] = None,
+    ):
+        self.token = token
+        self.on_progress = on_progress
+        self.on_stage = on_stage
+        self.on_start = on_start
+
+    def start(self):
+        """Mark the moment a worker picks the job up"""
+        if self.on_start is not None:
+            self.on_start()
+
+    def check(self):
+        """Raise if the job was cancelled"""
+        if self.token is not None:
+            self.token.check()
+
+    def progress(self, progress: float, message: str):
+        """
+        Report progress, raising first if the job was cancelled
+
+        Args:
+            progress: Progress (0.0 to 1.0)
+            message: Status message
+        """
+        self.check()
+        if self.on_progress is not None:
+            self.on_progress(progress, message)
+
+    @contextmanager
+    def stage(self, name: str, span: Optional[str] = None):
+        """
+        Time a stage of the job
+
+        Args:
+            name: Stage name passed to on_stage
+            span: Trace span name (default: name)
+        """
+        start = time.perf_counter()
+        try:
+            with tracer.span(span or name):
+                yield
+        finally:
+            if self.on_stage is not None:
+                self.on_stage(name, time.perf_counter() - start)
@@ -0,0 +1,111 @@
+"""Event-loop lag monitor
+
+A heartbeat coroutine sleeps for a short interval and measures how late
+it wakes up. Every lag sample goes into a histogram. A stalled loop
+cannot report who is blocking it, so a watcher thread checks the
+heartbeat from outside. Once the loop is overdue by more than the
+threshold, the watcher records the task the loop is running and the loop
+thread's stack. When the loop comes back, the stall is logged with that
+culprit, counted per coroutine and kept in a short history.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from app.config import settings
+from app.core.metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS
+
+
+# Frames of the blocked loop's stack kept per stall
+STACK_DEPTH = 12
+
+
+class LoopMonitor:
+    """Measures event-loop lag and names the coroutines that cause stalls"""
+
+    def __init__(self, threshold: float, interval: float = 0.05, keep: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        # When the heartbeat should wake up next, None while not running
+        self._due: Optional[float] = None
+        self._culprit: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+
+    def _describe_blocker(self) -> Dict[str, Any]:
+        """Task and stack the loop thread is stuck in (called from the watcher)"""
+        task = asyncio.current_task(self._loop)
+        coroutine = "callback"
+        if task is not None:
+            coro = task.get_coro()
+            coroutine = getattr(coro, "__qualname__", repr(coro))
+
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame)[-STACK_DEPTH:] if frame is not None else []
+        return {
+            "task": task.get_name() if task is not None else None,
+            "coroutine": coroutine,
+            "stack": [line.rstrip() for line in stack],
+        }
+
+    def _watch(self):
+        """Watcher thread: catch the loop while it is blocked"""
+        while not self._stop.wait(self.threshold / 2):
+            due = self._due
+            if due is None or self._culprit is not None:
+                continue
+            if time.monotonic() - due > self.threshold:
+                try:
+                    self._culprit = self._describe_blocker()
+                except Exception as e:
+                    self._culprit = {"task": None, "coroutine": "unknown", "stack": [str(e)]}
+
+    def _record(self, lag: float):
+        culprit = self._culprit or {"task": None, "coroutine": "unknown", "stack": []}
+        stall = {
+            "at": datetime.now().isoformat(),
+            "seconds": round(lag, 4),
+            **culprit,
+        }
+        self.stalls.append(stall)
+        EVENT_LOOP_STALLS.labels(coroutine=stall["coroutine"]).inc()
+
+        where = stall["stack"][-1].strip().splitlines()[0] if stall["stack"] else "unknown"
+        print(f"Event loop blocked for {lag * 1000:.0f} ms by {stall['coroutine']} ({where})")
+
+    async def run(self):
+        """Heartbeat, runs until cancelled"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        watcher = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        watcher.start()
+
+        try:
+            while True:
+                self._culprit = None
+                self._due = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.monotonic() - self._due)
+                EVENT_LOOP_LAG_SECONDS.observe(lag)
+                if lag > self.threshold:
+                    self._record(lag)
+        finally:
+            self._due = None
+            self._stop.set()
+
+    def recent(self) -> List[Dict[str, Any]]:
+        """Recorded stalls, newest first"""
+        return list(reversed(self.stalls))
+
+
+# Global instance
+loop_monitor = LoopMonitor(settings.loop_stall_threshold_ms / 1000)
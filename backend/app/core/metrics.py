@@ -0,0 +1,184 @@
+"""Prometheus metrics for the audio processing pipeline
+
+All collectors live in the default registry and are exposed by the
+``/metrics`` endpoint. Recording a sample is a lock and a few arithmetic
+operations, so instrumenting the hot path costs microseconds per job.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# Buckets for long running stages (seconds), from tens of ms up to 20 min
+STAGE_BUCKETS = (
+    0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0, 120.0, 300.0, 600.0, 1200.0,
+)
+
+# Buckets for event loop lag (seconds), 1 ms up to 5 s
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Buckets for upload sizes (bytes), 64 KB up to 256 MB
+SIZE_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(8))
+
+
+SEPARATION_STAGE_SECONDS = Histogram(
+    "audio_separation_stage_seconds",
+    "Time spent in each stage of a Demucs separation job",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+SEPARATION_ENCODE_SECONDS = Histogram(
+    "audio_separation_encode_seconds",
+    "Time spent encoding a single separated stem",
+    ["stem"],
+    buckets=STAGE_BUCKETS,
+)
+
+SEPARATION_SKIPPED_SECONDS = Counter(
+    "audio_separation_skipped_seconds_total",
+    "Seconds of silent audio not sent through the model",
+)
+
+SEPARATION_SAVED_SECONDS = Counter(
+    "audio_separation_saved_seconds_total",
+    "Estimated inference time saved by skipped silence and reused segments",
+)
+
+SEGMENT_CACHE_REQUESTS = Counter(
+    "audio_segment_cache_requests_total",
+    "Separated segment lookups by cache result",
+    ["result"],
+)
+
+SEGMENT_CACHE_BYTES = Gauge(
+    "audio_segment_cache_bytes",
+    "Size of the separated segment cache",
+)
+
+UPLOAD_SIZE_BYTES = Histogram(
+    "audio_upload_size_bytes",
+    "Size of uploaded audio files",
+    buckets=SIZE_BUCKETS,
+)
+
+UPLOAD_SECONDS = Histogram(
+    "audio_upload_seconds",
+    "Time to receive, validate and store an upload",
+    buckets=STAGE_BUCKETS,
+)
+
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "audio_executor_queue_depth",
+    "Jobs waiting for a free worker, by kind of work",
+    ["kind"],
+)
+
+EXECUTOR_ACTIVE_WORKERS = Gauge(
+    "audio_executor_active_workers",
+    "Workers currently running a job",
+)
+
+MODEL_CACHE_REQUESTS = Counter(
+    "audio_model_cache_requests_total",
+    "Demucs model lookups by cache result",
+    ["result"],
+)
+
+TASKS_TOTAL = Counter(
+    "audio_tasks_total",
+    "Finished background tasks by final status",
+    ["status"],
+)
+
+JOB_REALTIME_FACTOR = Gauge(
+    "audio_job_realtime_factor",
+    "Measured processing seconds per audio second",
+    ["preset"],
+)
+
+JOB_TIMEOUTS = Counter(
+    "audio_job_timeouts_total",
+    "Jobs failed by the watchdog",
+    ["kind"],
+)
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "audio_event_loop_lag_seconds",
+    "How late the event loop runs a scheduled wake-up",
+    buckets=LAG_BUCKETS,
+)
+
+EVENT_LOOP_STALLS = Counter(
+    "audio_event_loop_stalls_total",
+    "Event loop stalls over the threshold, by the coroutine that blocked",
+    ["coroutine"],
+)
+
+PREVIEW_BLOCK_SECONDS = Histogram(
+    "audio_preview_block_seconds",
+    "Processing time of one real-time preview block",
+    buckets=LAG_BUCKETS,
+)
+
+PREVIEW_STREAMS = Gauge(
+    "audio_preview_streams",
+    "Open real-time preview streams",
+)
+
+PREFETCH_JOBS = Counter(
+    "audio_prefetch_jobs_total",
+    "Speculative jobs on fresh uploads, by outcome",
+    ["kind", "outcome"],
+)
+
+PREFETCH_ADOPTIONS = Counter(
+    "audio_prefetch_adoptions_total",
+    "Requests served by speculative work, running or finished",
+    ["kind", "state"],
+)
+
+STORAGE_BYTES = Gauge(
+    "audio_storage_bytes",
+    "Total size of files in a storage directory",
+    ["directory"],
+)
+
+OBJECT_STORE_BYTES = Counter(
+    "audio_object_store_bytes_total",
+    "Bytes moved to and from the object store",
+    ["direction"],
+)
+
+OBJECT_STORE_SECONDS = Histogram(
+    "audio_object_store_transfer_seconds",
+    "Duration of whole-object uploads and downloads",
+    ["operation"],
+    buckets=STAGE_BUCKETS,
+)
+
+RESOURCE_CPU_CORES = Gauge(
+    "audio_resource_cpu_cores",
+    "Cores usable by the process (affinity and cgroup quota)",
+)
+
+RESOURCE_MEMORY_AVAILABLE_BYTES = Gauge(
+    "audio_resource_memory_available_bytes",
+    "Memory still available to the process (cgroup limit or machine)",
+)
+
+INFERENCE_CONCURRENCY_LIMIT = Gauge(
+    "audio_inference_concurrency_limit",
+    "Separations allowed to run at once",
+)
+
+INFERENCE_JOB_MEMORY_BYTES = Gauge(
+    "audio_inference_job_memory_bytes",
+    "Estimated memory of one running separation",
+)
+
+INFERENCE_THROUGHPUT = Gauge(
+    "audio_inference_throughput",
+    "Audio seconds separated per second, by number of concurrent jobs",
+    ["concurrency"],
+)
@@ -0,0 +1,414 @@
+"""Decode-free MP3 parser for metadata and validation
+
+Reads only the ID3v2 tag header, the first frames and the end of the
+file: the frame header gives sample rate, channels and bitrate, the
+Xing/Info or VBRI header gives the exact frame count of VBR files (and
+the LAME tag the encoder delay and padding), and a chain of consecutive
+frame headers proves the content really is MPEG audio. The cost does not
+depend on file size.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
+
+from app.core.exceptions import InvalidAudioFileError
+
+
+# Bytes after the ID3v2 tag searched for the first frame
+HEAD_SCAN = 64 * 1024
+# Bytes at the end of the audio searched for the last frame
+TAIL_SCAN = 16 * 1024
+# Consecutive consistent frames required to accept a sync point
+SYNC_FRAMES = 4
+
+_BITRATES = {
+    # (MPEG-1, layer) -> kbps by index
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Version bits -> sample rates by index
+_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),   # MPEG-2.5
+}
+
+_VERSION_NAMES = {3: "1", 2: "2", 0: "2.5"}
+
+MONO = 3
+
+
+@dataclass(frozen=True)
+class FrameHeader:
+    """Fields of a 4 byte MPEG audio frame header"""
+    version_bits: int
+    layer: int
+    protected: bool
+    bitrate: int
+    sample_rate: int
+    padding: int
+    channel_mode: int
+
+    @property
+    def channels(self) -> int:
+        return 1 if self.channel_mode == MONO else 2
+
+    @property
+    def samples_per_frame(self) -> int:
+        if self.layer == 1:
+            return 384
+        if self.layer == 3 and self.version_bits != 3:
+            return 576
+        return 1152
+
+    @property
+    def length(self) -> int:
+        """Frame length in bytes, header included"""
+        if self.layer == 1:
+            return (12 * self.bitrate * 1000 // self.sample_rate + self.padding) * 4
+        return self.samples_per_frame // 8 * self.bitrate * 1000 // self.sample_rate + self.padding
+
+    def same_stream(self, other: "FrameHeader") -> bool:
+        """Check if two frames can belong to the same stream"""
+        return (
+            self.version_bits == other.version_bits
+            and self.layer == other.layer
+            and self.sample_rate == other.sample_rate
+            and self.channel_mode == other.channel_mode
+        )
+
+
+@dataclass(frozen=True)
+class Mp3Info:
+    """Stream properties derived from headers"""
+    version: str
+    layer: int
+    sample_rate: int
+    channels: int
+    bitrate: int
+    vbr: bool
+    frame_count: int
+    duration: float
+    audio_offset: int
+    audio_size: int
+    encoder_delay: int = 0
+    encoder_padding: int = 0
+
+
+def parse_frame_header(data: bytes, offset: int = 0) -> Optional[FrameHeader]:
+    """
+    Parse a frame header
+
+    Args:
+        data: Buffer
+        offset: Position of the header in the buffer
+
+    Returns:
+        FrameHeader, or None if the bytes are not a valid header
+    """
+    if offset + 4 > len(data):
+        return None
+
+    bits = int.from_bytes(data[offset:offset + 4], "big")
+    if bits >> 21 != 0x7FF:
+        return None
+
+    version_bits = (bits >> 19) & 3
+    layer_bits = (bits >> 17) & 3
+    bitrate_index = (bits >> 12) & 0xF
+    sample_rate_index = (bits >> 10) & 3
+    # Reserved values (free-format bitrate is not supported)
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) \
+            or sample_rate_index == 3 or bits & 3 == 2:
+        return None
+
+    layer = 4 - layer_bits
+    return FrameHeader(
+        version_bits=version_bits,
+        layer=layer,
+        protected=not (bits >> 16) & 1,
+        bitrate=_BITRATES[(version_bits == 3, layer)][bitrate_index],
+        sample_rate=_SAMPLE_RATES[version_bits][sample_rate_index],
+        padding=(bits >> 9) & 1,
+        channel_mode=(bits >> 6) & 3,
+    )
+
+
+def _follow_chain(data: bytes, offset: int, first: FrameHeader) -> Tuple[int, int]:
+    """
+    Walk consecutive frames consistent with first
+
+    Returns:
+        Tuple of (number of frames, offset after the last frame)
+    """
+    count = 0
+    header = first
+    while header is not None and header.same_stream(first):
+        count += 1
+        offset += header.length
+        header = parse_frame_header(data, offset)
+    return count, offset
+
+
+def find_sync(
+    data: bytes, start: int = 0, to_end: bool = False
+) -> Optional[Tuple[int, FrameHeader]]:
+    """
+    Find the first position where a chain of frames starts
+
+    A chain counts if it has SYNC_FRAMES consistent frames, or with to_end
+    if it runs up to the end of the buffer. A single random "frame" near
+    the end of any buffer would pass the latter, so it is only meant for
+    buffers holding the whole rest of the file or a prefix checked in
+    full later.
+
+    Args:
+        data: Buffer
+        start: Where to start searching
+        to_end: Accept a shorter chain that reaches the end of data
+
+    Returns:
+        Tuple of (offset, first frame header), or None
+    """
+    pos = data.find(b"\xff", start)
+    while pos != -1:
+        header = parse_frame_header(data, pos)
+        if header is not None:
+            count, end = _follow_chain(data, pos, header)
+            if count >= SYNC_FRAMES or (to_end and end + 4 > len(data)):
+                return pos, header
+        pos = data.find(b"\xff", pos + 1)
+    return None
+
+
+def id3v2_size(data: bytes) -> int:
+    """
+    Size of an ID3v2 tag at the start of data
+
+    Args:
+        data: At least the first 10 bytes of the file
+
+    Returns:
+        Tag size in bytes including its header, 0 if there is no tag
+
+    Raises:
+        InvalidAudioFileError: If the tag header is malformed
+    """
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    if data[3] == 0xFF or data[4] == 0xFF or any(b & 0x80 for b in data[6:10]):
+        raise InvalidAudioFileError("Malformed ID3v2 tag")
+
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def check_prefix(data: bytes):
+    """
+    Check that the beginning of a file looks like an MP3
+
+    Used on partial content (e.g. the first chunk of an upload). An ID3v2
+    tag longer than data is accepted; the full check happens later.
+
+    Args:
+        data: First bytes of the file
+
+    Raises:
+        InvalidAudioFileError: If no MP3 frames or ID3 tag are found
+    """
+    start = id3v2_size(data)
+    if start >= len(data) > 0:
+        return
+
+    # A prefix may end after fewer than SYNC_FRAMES frames
+    found = find_sync(data, start, to_end=True)
+    if found is None:
+        raise InvalidAudioFileError("No MPEG audio frames found")
+    if found[1].layer != 3:
+        raise InvalidAudioFileError(f"MPEG layer {found[1].layer} audio is not MP3")
+
+
+def _trailing_tags_size(f: BinaryIO, size: int) -> int:
+    """Size of ID3v1 and APEv2 tags at the end of the file"""
+    trailing = 0
+    if size >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b"TAG":
+            trailing = 128
+
+    if size - trailing >= 32:
+        f.seek(size - trailing - 32)
+        footer = f.read(32)
+        if footer[:8] == b"APETAGEX":
+            # Tag size excludes the 32 byte header if present
+            tag_size = int.from_bytes(footer[12:16], "little")
+            has_header = int.from_bytes(footer[20:24], "little") & 0x80000000
+            trailing += tag_size + (32 if has_header else 0)
+
+    return min(trailing, size)
+
+
+def _parse_vbr_header(frame: bytes, header: FrameHeader) -> Optional[dict]:
+    """Parse a Xing/Info (with LAME extension) or VBRI header in the first frame"""
+    if header.version_bits == 3:
+        side_info = 17 if header.channel_mode == MONO else 32
+    else:
+        side_info = 9 if header.channel_mode == MONO else 17
+
+    for offset in (4 + side_info, 6 + side_info):
+        tag = frame[offset:offset + 4]
+        if tag not in (b"Xing", b"Info"):
+            continue
+
+        flags = int.from_bytes(frame[offset + 4:offset + 8], "big")
+        pos = offset + 8
+        result = {"vbr": tag == b"Xing", "frames": None, "bytes": None}
+        if flags & 1:
+            result["frames"] = int.from_bytes(frame[pos:pos + 4], "big")
+            pos += 4
+        if flags & 2:
+            result["bytes"] = int.from_bytes(frame[pos:pos + 4], "big")
+            pos += 4
+        if flags & 4:
+            pos += 100
+        if flags & 8:
+            pos += 4
+
+        # LAME (or FFmpeg's LAME-compatible) tag with encoder delay/padding
+        if frame[pos:pos + 4] in (b"LAME", b"Lavc", b"Lavf", b"L3.9") and len(frame) >= pos + 24:
+            b0, b1, b2 = frame[pos + 21:pos + 24]
+            result["delay"] = (b0 << 4) | (b1 >> 4)
+            result["padding"] = ((b1 & 0x0F) << 8) | b2
+        return result
+
+    if frame[36:40] == b"VBRI":
+        return {
+            "vbr": True,
+            "delay": int.from_bytes(frame[42:44], "big"),
+            "bytes": int.from_bytes(frame[46:50], "big"),
+            "frames": int.from_bytes(frame[50:54], "big"),
+        }
+
+    return None
+
+
+def _last_frame_truncated(f: BinaryIO, first: FrameHeader, audio_offset: int, audio_end: int) -> bool:
+    """Check if the frame chain at the end of the audio runs past it"""
+    window_start = max(audio_offset, audio_end - TAIL_SCAN)
+    f.seek(window_start)
+    tail = f.read(audio_end - window_start)
+
+    pos = tail.find(b"\xff")
+    while pos != -1:
+        header = parse_frame_header(tail, pos)
+        if header is not None and header.same_stream(first):
+            count, end = _follow_chain(tail, pos, header)
+            if count >= 2 or end >= len(tail):
+                # Trailing bytes that are not a frame are tolerated,
+                # a frame extending past the end is not
+                return end > len(tail)
+        pos = tail.find(b"\xff", pos + 1)
+
+    return False
+
+
+def parse_stream(f: BinaryIO, size: int) -> Mp3Info:
+    """
+    Parse MP3 headers from a seekable binary stream
+
+    Args:
+        f: Stream positioned anywhere
+        size: Total size of the stream in bytes
+
+    Returns:
+        Mp3Info
+
+    Raises:
+        InvalidAudioFileError: If the content is not MPEG audio or is truncated
+    """
+    f.seek(0)
+    start = id3v2_size(f.read(10))
+    if start >= size:
+        raise InvalidAudioFileError("File ends inside the ID3v2 tag")
+
+    f.seek(start)
+    head = f.read(HEAD_SCAN)
+    # Short chains only count in files too short for SYNC_FRAMES frames
+    found = find_sync(head, to_end=start + len(head) >= size)
+    if found is None:
+        raise InvalidAudioFileError("No MPEG audio frames found")
+
+    sync, first = found
+    audio_offset = start + sync
+    audio_end = size - _trailing_tags_size(f, size)
+    if audio_end <= audio_offset:
+        raise InvalidAudioFileError("No audio data after tags")
+
+    audio_size = audio_end - audio_offset
+    spf = first.samples_per_frame
+    delay = padding = 0
+
+    vbr_header = _parse_vbr_header(head[sync:sync + first.length], first)
+    if vbr_header and vbr_header.get("frames"):
+        frame_count = vbr_header["frames"]
+        delay = vbr_header.get("delay", 0)
+        padding = vbr_header.get("padding", 0)
+
+        declared = vbr_header.get("bytes")
+        if declared and audio_size + first.length < declared:
+            raise InvalidAudioFileError(
+                f"File is truncated: {audio_size} of {declared} audio bytes present"
+            )
+        vbr = vbr_header["vbr"]
+    else:
+        # Constant bitrate: every frame has the first frame's average length
+        frame_count = round(audio_size * first.sample_rate / (spf / 8 * first.bitrate * 1000))
+        vbr = False
+
+    if frame_count <= 0:
+        raise InvalidAudioFileError("No audio frames")
+    if _last_frame_truncated(f, first, audio_offset, audio_end):
+        raise InvalidAudioFileError("File is truncated: last frame is incomplete")
+
+    samples = max(0, frame_count * spf - delay - padding)
+    duration = samples / first.sample_rate
+    bitrate = round(audio_size * 8 / (frame_count * spf / first.sample_rate) / 1000) if vbr else first.bitrate
+
+    return Mp3Info(
+        version=_VERSION_NAMES[first.version_bits],
+        layer=first.layer,
+        sample_rate=first.sample_rate,
+        channels=first.channels,
+        bitrate=bitrate,
+        vbr=vbr,
+        frame_count=frame_count,
+        duration=duration,
+        audio_offset=audio_offset,
+        audio_size=audio_size,
+        encoder_delay=delay,
+        encoder_padding=padding,
+    )
+
+
+def parse_file(path: Path) -> Mp3Info:
+    """
+    Parse MP3 headers of a file
+
+    Args:
+        path: Path to the file
+
+    Returns:
+        Mp3Info
+
+    Raises:
+        InvalidAudioFileError: If the file is not valid MPEG audio
+    """
+    with open(path, "rb") as f:
+        return parse_stream(f, path.stat().st_size)
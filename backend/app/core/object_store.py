@@ -0,0 +1,472 @@
+"""Object storage backends behind the upload and processed directories
+
+StorageService keeps working copies of files in settings.upload_dir and
+settings.processed_dir. Behind them sits an object store, chosen with
+settings.storage_backend:
+
+    local   the directories themselves, publishing and fetching are no-ops
+    s3      an S3-compatible bucket shared by API nodes and workers. Files
+            are published once written and fetched on a local miss, so a
+            worker on another machine finds what an API node stored.
+
+Objects are named "{directory}/{filename}", e.g. "upload/{file_id}.mp3".
+
+The S3 client signs its own requests (AWS Signature V4) and sends them
+over one pooled httpx client. Files larger than a part are uploaded as a
+multipart upload and downloaded as ranged GETs, with the parts moved in
+parallel and streamed to and from disk. Readers that need no local copy
+use source(), a presigned URL that FFmpeg streams with range requests,
+or open(), a seekable file object whose reads are ranged GETs.
+
+python -m app.tools.s3_stub runs an S3-compatible stand-in locally.
+"""
+
+import hashlib
+import hmac
+import io
+import re
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote, urlsplit
+from xml.sax.saxutils import escape
+
+from app.config import settings
+from app.core.exceptions import ObjectStoreError
+from app.core.metrics import OBJECT_STORE_BYTES, OBJECT_STORE_SECONDS
+
+
+# Payload hash sent instead of hashing every body twice
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+# Bytes written to disk per chunk of a streamed download
+STREAM_CHUNK = 256 * 1024
+
+# Buffer of open() readers, every refill is one ranged GET
+READ_BUFFER = 256 * 1024
+
+
+class ObjectStore(ABC):
+    """Interface of an object store, keys are "{directory}/{filename}" """
+
+    # Objects live somewhere other than the local directories
+    remote = False
+
+    @abstractmethod
+    def put(self, key: str, path: Path):
+        """Store a local file as an object"""
+
+    @abstractmethod
+    def get(self, key: str, path: Path) -> bool:
+        """Copy an object to a local file, False if there is no such object"""
+
+    @abstractmethod
+    def size(self, key: str) -> Optional[int]:
+        """Size of an object in bytes, None if it does not exist"""
+
+    def exists(self, key: str) -> bool:
+        return self.size(key) is not None
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Delete an object, missing objects are ignored"""
+
+    @abstractmethod
+    def list(self, prefix: str) -> List[str]:
+        """Keys of the objects starting with prefix"""
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Seekable binary reader of an object"""
+
+    @abstractmethod
+    def source(self, key: str) -> Union[Path, str]:
+        """Path or URL that FFmpeg can read the object from"""
+
+
+class LocalObjectStore(ObjectStore):
+    """Objects as files in local directories, one per key prefix"""
+
+    def __init__(self, directories: Dict[str, Path]):
+        self.directories = directories
+
+    def path(self, key: str) -> Path:
+        directory, _, name = key.partition("/")
+        if directory not in self.directories or not name or "/" in name:
+            raise ObjectStoreError(f"Invalid object key: {key}")
+        return self.directories[directory] / name
+
+    def _copy(self, source: Path, target: Path):
+        tmp_path = target.with_name(f"{target.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            shutil.copyfile(source, tmp_path)
+            tmp_path.replace(target)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def put(self, key: str, path: Path):
+        target = self.path(key)
+        if target.resolve() != path.resolve():
+            self._copy(path, target)
+
+    def get(self, key: str, path: Path) -> bool:
+        source = self.path(key)
+        if source.resolve() == path.resolve():
+            return source.exists()
+        try:
+            self._copy(source, path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self.path(key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str):
+        self.path(key).unlink(missing_ok=True)
+
+    def list(self, prefix: str) -> List[str]:
+        directory, _, name = prefix.partition("/")
+        base = self.directories.get(directory)
+        if base is None:
+            return []
+        return sorted(f"{directory}/{p.name}" for p in base.glob(f"{name}*") if p.is_file())
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    def source(self, key: str) -> Path:
+        return self.path(key)
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable read-only view of a remote object, each read is a ranged GET"""
+
+    def __init__(self, store: "S3ObjectStore", key: str, size: int):
+        self.store = store
+        self.key = key
+        self.length = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.length}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        end = min(self.position + len(buffer), self.length)
+        if end <= self.position:
+            return 0
+        data = self.store.read_range(self.key, self.position, end)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def _xml_values(content: bytes, tag: str) -> List[str]:
+    return re.findall(rf"<{tag}>(.*?)</{tag}>", content.decode("utf-8", "replace"), re.S)
+
+
+class S3ObjectStore(ObjectStore):
+    """Objects in an S3-compatible bucket, addressed path-style"""
+
+    remote = True
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        region: str,
+        access_key: str,
+        secret_key: str,
+        prefix: str = "",
+        part_size: int = 8 * 1024 * 1024,
+        connections: int = 16,
+        url_expiry: int = 3600,
+    ):
+        import httpx
+
+        self.endpoint = endpoint_url.rstrip("/")
+        self.host = urlsplit(self.endpoint).netloc
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix
+        self.part_size = max(5 * 1024 * 1024, part_size)  # S3's minimum part size
+        self.url_expiry = url_expiry
+
+        # One connection per part in flight, kept alive between transfers
+        self.client = httpx.Client(
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+        self._parts = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="s3-transfer")
+
+    # Signing
+
+    def _path(self, key: str) -> str:
+        return "/" + quote(f"{self.bucket}/{self.prefix}{key}", safe="/~")
+
+    @staticmethod
+    def _query(query: Dict[str, str]) -> str:
+        return "&".join(
+            f"{quote(k, safe='~')}={quote(v, safe='~')}" for k, v in sorted(query.items())
+        )
+
+    def _signature(
+        self,
+        method: str,
+        path: str,
+        query: Dict[str, str],
+        headers: Dict[str, str],
+        amz_date: str,
+    ) -> Tuple[str, str, str]:
+        """Signature V4 of a request, with its credential scope and signed headers"""
+        names = sorted(headers)
+        signed = ";".join(names)
+        canonical = "\n".join([
+            method,
+            path,
+            self._query(query),
+            "".join(f"{name}:{headers[name]}\n" for name in names),
+            signed,
+            UNSIGNED_PAYLOAD,
+        ])
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical.encode()).hexdigest(),
+        ])
+
+        key = f"AWS4{self.secret_key}".encode()
+        for part in (amz_date[:8], self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        return signature, scope, signed
+
+    def _prepare(
+        self,
+        method: str,
+        path: str,
+        query: Optional[Dict[str, str]],
+        headers: Optional[Dict[str, str]],
+    ) -> Tuple[str, Dict[str, str]]:
+        """URL and signed headers of a request"""
+        query = query or {}
+        amz_date = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        signed_headers = {
+            "host": self.host,
+            "x-amz-content-sha256": UNSIGNED_PAYLOAD,
+            "x-amz-date": amz_date,
+        }
+        signature, scope, signed = self._signature(method, path, query, signed_headers, amz_date)
+        signed_headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed}, Signature={signature}"
+        )
+
+        url = f"{self.endpoint}{path}"
+        if query:
+            url = f"{url}?{self._query(query)}"
+        return url, {**signed_headers, **(headers or {})}
+
+    def _check(self, response, method: str, key: str):
+        if response.status_code >= 300:
+            codes = _xml_values(response.content, "Code")
+            reason = codes[0] if codes else f"HTTP {response.status_code}"
+            raise ObjectStoreError(f"{method} {key} failed: {reason}")
+
+    def _request(
+        self,
+        method: str,
+        key: str,
+        query: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        content: Optional[bytes] = None,
+    ):
+        url, headers = self._prepare(method, self._path(key), query, headers)
+        response = self.client.request(method, url, headers=headers, content=content)
+        self._check(response, method, key)
+        return response
+
+    @contextmanager
+    def _stream(self, key: str, headers: Optional[Dict[str, str]] = None) -> Iterator:
+        url, headers = self._prepare("GET", self._path(key), None, headers)
+        with self.client.stream("GET", url, headers=headers) as response:
+            if response.status_code >= 300:
+                response.read()
+                self._check(response, "GET", key)
+            yield response
+
+    # Transfers
+
+    def put(self, key: str, path: Path):
+        start = time.perf_counter()
+        size = path.stat().st_size
+        if size <= self.part_size:
+            with open(path, "rb") as f:
+                self._request("PUT", key, content=f.read())
+        else:
+            self._put_multipart(key, path, size)
+        OBJECT_STORE_BYTES.labels(direction="upload").inc(size)
+        OBJECT_STORE_SECONDS.labels(operation="put").observe(time.perf_counter() - start)
+
+    def _put_multipart(self, key: str, path: Path, size: int):
+        response = self._request("POST", key, {"uploads": ""})
+        upload_id = _xml_values(response.content, "UploadId")[0]
+
+        def upload_part(number: int) -> str:
+            with open(path, "rb") as f:
+                f.seek((number - 1) * self.part_size)
+                data = f.read(self.part_size)
+            response = self._request(
+                "PUT", key, {"partNumber": str(number), "uploadId": upload_id}, content=data
+            )
+            return response.headers["ETag"]
+
+        numbers = range(1, (size + self.part_size - 1) // self.part_size + 1)
+        try:
+            etags = list(self._parts.map(upload_part, numbers))
+            body = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{n}</PartNumber><ETag>{escape(etag)}</ETag></Part>"
+                for n, etag in zip(numbers, etags)
+            ) + "</CompleteMultipartUpload>"
+            response = self._request("POST", key, {"uploadId": upload_id}, content=body.encode())
+            # Completion can fail after the 200 status has been sent
+            if b"<Error>" in response.content:
+                raise ObjectStoreError(f"Completing the upload of {key} failed")
+        except BaseException:
+            try:
+                self._request("DELETE", key, {"uploadId": upload_id})
+            except Exception:
+                pass
+            raise
+
+    def get(self, key: str, path: Path) -> bool:
+        start = time.perf_counter()
+        size = self.size(key)
+        if size is None:
+            return False
+
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.truncate(size)
+            ranges = [
+                (offset, min(offset + self.part_size, size))
+                for offset in range(0, size, self.part_size)
+            ]
+            list(self._parts.map(lambda r: self._get_range(key, tmp_path, *r), ranges))
+            tmp_path.replace(path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        OBJECT_STORE_BYTES.labels(direction="download").inc(size)
+        OBJECT_STORE_SECONDS.labels(operation="get").observe(time.perf_counter() - start)
+        return True
+
+    def _get_range(self, key: str, path: Path, start: int, end: int):
+        """Stream one byte range of an object into the same range of a file"""
+        written = 0
+        with open(path, "r+b") as f, self._stream(key, {"Range": f"bytes={start}-{end - 1}"}) as response:
+            f.seek(start)
+            for chunk in response.iter_bytes(STREAM_CHUNK):
+                f.write(chunk)
+                written += len(chunk)
+        if written != end - start:
+            raise ObjectStoreError(f"Object {key} changed during download")
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        """Bytes start to end (exclusive) of an object"""
+        response = self._request("GET", key, headers={"Range": f"bytes={start}-{end - 1}"})
+        OBJECT_STORE_BYTES.labels(direction="download").inc(len(response.content))
+        return response.content
+
+    # Metadata
+
+    def size(self, key: str) -> Optional[int]:
+        url, headers = self._prepare("HEAD", self._path(key), None, None)
+        response = self.client.head(url, headers=headers)
+        if response.status_code == 404:
+            return None
+        self._check(response, "HEAD", key)
+        return int(response.headers["Content-Length"])
+
+    def delete(self, key: str):
+        self._request("DELETE", key)
+
+    def list(self, prefix: str) -> List[str]:
+        keys: List[str] = []
+        query = {"list-type": "2", "prefix": f"{self.prefix}{prefix}"}
+        while True:
+            url, headers = self._prepare("GET", f"/{quote(self.bucket)}/", query, None)
+            response = self.client.get(url, headers=headers)
+            self._check(response, "LIST", prefix)
+            keys.extend(k[len(self.prefix):] for k in _xml_values(response.content, "Key"))
+            tokens = _xml_values(response.content, "NextContinuationToken")
+            if not tokens:
+                return keys
+            query["continuation-token"] = tokens[0]
+
+    def open(self, key: str) -> BinaryIO:
+        size = self.size(key)
+        if size is None:
+            raise FileNotFoundError(f"No object {key}")
+        return io.BufferedReader(RangeReader(self, key, size), buffer_size=READ_BUFFER)
+
+    def source(self, key: str) -> str:
+        """Presigned GET URL, valid for url_expiry seconds"""
+        path = self._path(key)
+        amz_date = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{amz_date[:8]}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(self.url_expiry),
+            "X-Amz-SignedHeaders": "host",
+        }
+        signature, _, _ = self._signature("GET", path, query, {"host": self.host}, amz_date)
+        query["X-Amz-Signature"] = signature
+        return f"{self.endpoint}{path}?{self._query(query)}"
+
+
+def create_object_store() -> ObjectStore:
+    """Object store selected by settings.storage_backend"""
+    if settings.storage_backend == "s3":
+        if not settings.s3_bucket:
+            raise ObjectStoreError("S3_BUCKET must be set when STORAGE_BACKEND=s3")
+        return S3ObjectStore(
+            endpoint_url=settings.s3_endpoint_url or f"https://s3.{settings.s3_region}.amazonaws.com",
+            bucket=settings.s3_bucket,
+            region=settings.s3_region,
+            access_key=settings.s3_access_key,
+            secret_key=settings.s3_secret_key,
+            prefix=settings.s3_prefix,
+            part_size=settings.s3_part_size_mb * 1024 * 1024,
+            connections=settings.s3_max_connections,
+            url_expiry=settings.s3_url_expiry_seconds,
+        )
+    return LocalObjectStore({"upload": settings.upload_dir, "processed": settings.processed_dir})
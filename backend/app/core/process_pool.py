@@ -0,0 +1,208 @@
+"""Worker processes that can be killed in the middle of a job
+
+concurrent.futures pools cannot stop a job once it has started. Here every
+worker process has its own pipe. A job that is cancelled, or whose
+CancelToken fires, has its process killed right away, and a fresh worker
+replaces it on the next submission. Progress and stage timings arrive over
+the pipe while the job runs.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from app.core.jobs import CancelToken, JobContext
+
+
+def _worker_main(conn):
+    """Worker loop: run jobs sent by the parent until the pipe closes"""
+    while True:
+        try:
+            fn, args = conn.recv()
+        except (EOFError, OSError):
+            return
+
+        job = JobContext(
+            on_progress=lambda progress, message: conn.send(("progress", progress, message)),
+            on_stage=lambda name, seconds: conn.send(("stage", name, seconds)),
+        )
+        try:
+            result = fn(job, *args)
+        except Exception as e:
+            try:
+                conn.send(("error", e))
+            except Exception:
+                # The exception itself does not pickle
+                conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+        else:
+            conn.send(("result", result))
+
+
+class _Worker:
+    """One worker process and the parent's end of its pipe"""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.killed = False
+
+    def alive(self) -> bool:
+        return not self.killed and self.process.is_alive()
+
+    def kill(self):
+        self.killed = True
+        if self.process.is_alive():
+            self.process.kill()
+
+    def close(self):
+        self.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ProcessPool:
+    """Fixed-size pool of killable worker processes"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Starting a worker, pickling a job into its pipe and waiting for
+        # the result all block. A job does one at a time, so a thread per
+        # worker process is enough and nothing queues behind other pools
+        self._threads = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="process-pool"
+        )
+        self.active = 0
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.close()
+        return _Worker(self._ctx)
+
+    def _release(self, worker: _Worker):
+        if worker.alive():
+            with self._lock:
+                self._idle.append(worker)
+        else:
+            worker.close()
+
+    async def _acquire_async(self) -> _Worker:
+        """Get a worker without blocking the loop on a process start"""
+        future = asyncio.get_event_loop().run_in_executor(self._threads, self._acquire)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Return the worker once it has started instead of leaking it
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception() or self._release(f.result())
+            )
+            raise
+
+    def _wait(
+        self,
+        worker: _Worker,
+        on_progress: Optional[Callable[[float, str], None]],
+        on_stage: Optional[Callable[[str, float], None]],
+    ) -> Any:
+        """Relay messages until the job finishes (runs in a thread)"""
+        while True:
+            message = worker.conn.recv()
+            kind = message[0]
+            if kind == "progress" and on_progress is not None:
+                on_progress(message[1], message[2])
+            elif kind == "stage" and on_stage is not None:
+                on_stage(message[1], message[2])
+            elif kind == "result":
+                return message[1]
+            elif kind == "error":
+                raise message[1]
+
+    async def run(
+        self,
+        fn: Callable,
+        *args,
+        token: Optional[CancelToken] = None,
+        on_progress: Optional[Callable[[float, str], None]] = None,
+        on_stage: Optional[Callable[[str, float], None]] = None,
+        on_start: Optional[Callable[[], None]] = None,
+    ) -> Any:
+        """
+        Run fn(job, *args) in a worker process
+
+        fn must be a module-level function and args must pickle. It gets a
+        JobContext whose progress and stage reports end up in on_progress
+        and on_stage here.
+
+        Args:
+            fn: Job function
+            args: Job arguments
+            token: Kills the worker when cancelled
+            on_progress: Called with (progress, message)
+            on_stage: Called with (stage name, seconds)
+            on_start: Called once a worker has been assigned
+
+        Returns:
+            Whatever fn returns
+
+        Raises:
+            TaskCancelledError: If the token fired (or its error)
+            RuntimeError: If the worker died for another reason
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        async with self._semaphore:
+            if token is not None:
+                token.check()
+
+            worker = await self._acquire_async()
+            kill = worker.kill
+            if token is not None:
+                token.add_callback(kill)
+
+            self.active += 1
+            loop = asyncio.get_event_loop()
+            try:
+                if on_start is not None:
+                    on_start()
+                # Large arguments take a while to pickle into the pipe
+                await loop.run_in_executor(self._threads, worker.conn.send, (fn, args))
+                return await loop.run_in_executor(
+                    self._threads, self._wait, worker, on_progress, on_stage
+                )
+            except asyncio.CancelledError:
+                worker.kill()
+                raise
+            except (EOFError, OSError):
+                if token is not None and token.cancelled:
+                    token.check()
+                raise RuntimeError("Worker process died")
+            finally:
+                self.active -= 1
+                if token is not None:
+                    token.remove_callback(kill)
+                self._release(worker)
+
+    def shutdown(self):
+        """Stop all idle workers"""
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.close()
+        self._threads.shutdown(wait=False)
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
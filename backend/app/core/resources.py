@@ -0,0 +1,436 @@
+"""CPU and memory budget of the process, shared between concurrent jobs
+
+torch runs every operation on all cores by default, so two separations
+running side by side oversubscribe the CPU and each one slows down by
+more than half. The resource manager instead:
+
+    detects    the usable cores (CPU affinity, capped by the cgroup CPU
+               quota) and memory (cgroup limit and usage, else the
+               machine's available memory)
+    partitions the cores between running separations: each job sets its
+               own torch thread count to cores / running jobs before
+               every inference segment, so a job that starts or ends
+               rebalances the others. OpenMP keeps the thread count per
+               calling thread. Worker processes get a fixed share,
+               cores / concurrency limit.
+    adapts     how many separations run at once. Every finished job
+               reports how much audio it separated and how many jobs ran
+               alongside it on average, which gives the aggregate
+               throughput (audio seconds per second) at that level of
+               concurrency. While jobs queue, the limit is raised one
+               step at a time as long as that improves throughput and
+               the estimated memory of another job fits above
+               settings.memory_headroom_mb. It steps back down when the
+               lower level was faster or memory runs short.
+
+settings.inference_workers is the starting limit, and the fixed one with
+settings.adaptive_concurrency off.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.core.metrics import (
+    INFERENCE_CONCURRENCY_LIMIT,
+    INFERENCE_JOB_MEMORY_BYTES,
+    INFERENCE_THROUGHPUT,
+    RESOURCE_CPU_CORES,
+    RESOURCE_MEMORY_AVAILABLE_BYTES,
+)
+
+
+CGROUP = Path("/sys/fs/cgroup")
+
+# Weight of a new throughput sample in the running average of its level
+RATE_SMOOTHING = 0.3
+# Relative throughput difference treated as a real change
+RATE_TOLERANCE = 0.05
+# Jobs measured at a level before the limit moves away from it
+MIN_SAMPLES = 2
+# Jobs after which a level measured as slower is tried again
+REPROBE_JOBS = 20
+
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def _read_stat(path: Path, field: str) -> Optional[int]:
+    """Value of a field in a "name value" per line file, e.g. memory.stat"""
+    text = _read(path)
+    for line in (text or "").splitlines():
+        name, _, value = line.partition(" ")
+        if name == field:
+            return int(value)
+    return None
+
+
+def cpu_limit() -> int:
+    """Cores this process may use: its CPU affinity, capped by the cgroup quota"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    quota = None
+    text = _read(CGROUP / "cpu.max")  # cgroup v2: "max 100000" or "200000 100000"
+    if text:
+        limit, _, period = text.partition(" ")
+        if limit != "max":
+            quota = int(limit) / int(period)
+    else:
+        limit = _read(CGROUP / "cpu" / "cpu.cfs_quota_us")  # cgroup v1, -1 without quota
+        period = _read(CGROUP / "cpu" / "cpu.cfs_period_us")
+        if limit and period and int(limit) > 0:
+            quota = int(limit) / int(period)
+
+    if quota is not None:
+        # A fractional core is throttled, count only whole ones
+        cores = min(cores, max(1, int(quota)))
+    return max(1, cores)
+
+
+def memory_limit() -> Optional[int]:
+    """Memory limit of the cgroup in bytes, None without one"""
+    text = _read(CGROUP / "memory.max")
+    if text is None:
+        text = _read(CGROUP / "memory" / "memory.limit_in_bytes")
+    if not text or text == "max":
+        return None
+    limit = int(text)
+    # cgroup v1 reports "no limit" as a huge number
+    return limit if limit < 1 << 60 else None
+
+
+def _cgroup_memory_used() -> Optional[int]:
+    """Memory charged to the cgroup, without page cache that can be dropped"""
+    used = _read(CGROUP / "memory.current")
+    if used is not None:
+        inactive = _read_stat(CGROUP / "memory.stat", "inactive_file")
+    else:
+        used = _read(CGROUP / "memory" / "memory.usage_in_bytes")
+        inactive = _read_stat(CGROUP / "memory" / "memory.stat", "total_inactive_file")
+    if used is None:
+        return None
+    return max(0, int(used) - (inactive or 0))
+
+
+def _meminfo() -> Dict[str, int]:
+    """/proc/meminfo in bytes"""
+    values = {}
+    for line in (_read(Path("/proc/meminfo")) or "").splitlines():
+        name, _, rest = line.partition(":")
+        fields = rest.split()
+        if fields:
+            values[name] = int(fields[0]) * 1024
+    return values
+
+
+def memory_status() -> Tuple[Optional[int], Optional[int]]:
+    """
+    Memory in use and still available to this process
+
+    Returns:
+        Tuple of (used, available) bytes: the cgroup's when it has a
+        limit, else the machine's. None where it cannot be determined.
+    """
+    meminfo = _meminfo()
+    total, available = meminfo.get("MemTotal"), meminfo.get("MemAvailable")
+    used = total - available if total is not None and available is not None else None
+
+    limit = memory_limit()
+    cgroup_used = _cgroup_memory_used()
+    if limit is not None and cgroup_used is not None:
+        remaining = max(0, limit - cgroup_used)
+        available = min(available, remaining) if available is not None else remaining
+        used = cgroup_used
+    return used, available
+
+
+class ConcurrencyGate:
+    """Admits up to limit jobs at once, the limit can change at any time"""
+
+    def __init__(self, limit: int, maximum: int):
+        self.maximum = maximum
+        self.limit = min(max(1, limit), maximum)
+        self.active = 0
+        self._waiters: List[asyncio.Future] = []
+        # Integral of running jobs over time, for the mean concurrency of a job
+        self._busy = 0.0
+        self._changed = time.monotonic()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def busy(self) -> Tuple[float, float]:
+        """Current time and running-job seconds so far"""
+        now = time.monotonic()
+        self._busy += self.active * (now - self._changed)
+        self._changed = now
+        return now, self._busy
+
+    def _wake(self):
+        free = self.limit - self.active
+        for waiter in self._waiters:
+            if free <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def set_limit(self, limit: int):
+        self.limit = min(max(1, limit), self.maximum)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the limit slots for the duration of the block"""
+        loop = asyncio.get_running_loop()
+        while self.active >= self.limit:
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                # A wake-up this waiter got goes to the next one
+                self._waiters.remove(waiter)
+                self._wake()
+                raise
+            self._waiters.remove(waiter)
+
+        self.busy()
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.busy()
+            self.active -= 1
+            self._wake()
+
+    def hold(self, future: Future):
+        """
+        Count a job that outlived its slot until its future finishes
+
+        A thread that ignores cancellation keeps running after its slot was
+        given back. Counting it keeps the jobs that run at once within the
+        limit, and within the threads of the inference pool.
+
+        Args:
+            future: Future of the job's thread
+        """
+        loop = asyncio.get_running_loop()
+
+        def release():
+            self.busy()
+            self.active -= 1
+            self._wake()
+
+        self.busy()
+        self.active += 1
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(release))
+
+
+class JobSlot:
+    """A running separation's share of the machine"""
+
+    def __init__(self, threads: int):
+        # torch threads for a job that runs in a worker process
+        self.threads = threads
+        self.audio_seconds: Optional[float] = None
+
+    def record(self, audio_seconds: float):
+        """Report how much audio the job actually separated"""
+        self.audio_seconds = audio_seconds
+
+
+class ResourceManager:
+    """Detects cores and memory, partitions threads and adapts concurrency"""
+
+    def __init__(self):
+        self.cores = cpu_limit()
+        self.memory_limit = memory_limit()
+        self.inference = ConcurrencyGate(settings.inference_workers, self.max_inference())
+        # Aggregate throughput (audio seconds per second) by concurrency level
+        self.rates: Dict[int, float] = {}
+        self.samples: Dict[int, int] = defaultdict(int)
+        self._since_change = 0
+        # Memory one running separation adds, measured while jobs run
+        self.job_memory = settings.inference_job_memory_mb * 1024 * 1024
+        self._idle_memory: Optional[int] = None
+        # Latest memory sample, taken off the event loop by run()
+        self.memory_used, self.memory_available = memory_status()
+        self._local = threading.local()
+
+        RESOURCE_CPU_CORES.set(self.cores)
+        RESOURCE_MEMORY_AVAILABLE_BYTES.set_function(lambda: self.memory_available or 0)
+        INFERENCE_CONCURRENCY_LIMIT.set_function(lambda: self.inference.limit)
+        INFERENCE_JOB_MEMORY_BYTES.set_function(lambda: self.job_memory)
+
+    def max_inference(self) -> int:
+        """Most separations ever run at once"""
+        if not settings.adaptive_concurrency:
+            return max(1, settings.inference_workers)
+        if settings.inference_workers_max > 0:
+            return settings.inference_workers_max
+        return max(1, settings.inference_workers, self.cores // 2)
+
+    def headroom(self) -> Optional[int]:
+        """Available memory above settings.memory_headroom_mb, None if unknown"""
+        if self.memory_available is None:
+            return None
+        return self.memory_available - settings.memory_headroom_mb * 1024 * 1024
+
+    # Threads
+
+    def thread_share(self) -> int:
+        """torch threads for each separation running in this process"""
+        return max(1, self.cores // max(1, self.inference.active))
+
+    def pin_threads(self, threads: Optional[int]):
+        """Give the calling thread a fixed thread count, e.g. in a worker process"""
+        self._local.pinned = threads
+
+    def apply_threads(self):
+        """Set the calling thread's torch thread count to its current share"""
+        threads = getattr(self._local, "pinned", None) or self.thread_share()
+        if getattr(self._local, "threads", None) != threads:
+            import torch
+
+            torch.set_num_threads(threads)
+            self._local.threads = threads
+
+    # Concurrency
+
+    @asynccontextmanager
+    async def inference_job(self):
+        """
+        Run a separation in one of the concurrency slots
+
+        Waits while the limit is reached. When the block finishes without
+        an error and the slot's record() was called, the job's throughput
+        is measured.
+
+        Yields:
+            JobSlot with the job's thread count for worker processes
+        """
+        gate = self.inference
+        async with gate.slot():
+            started, busy_before = gate.busy()
+            slot = JobSlot(max(1, self.cores // gate.limit))
+            yield slot
+            ended, busy_after = gate.busy()
+
+        wall = ended - started
+        if slot.audio_seconds and wall > 0:
+            self._record((busy_after - busy_before) / wall, slot.audio_seconds, wall)
+
+    def _record(self, concurrency: float, audio_seconds: float, wall_seconds: float):
+        level = max(1, round(concurrency))
+        # This job's rate times the jobs that ran alongside it
+        rate = max(concurrency, 1.0) * audio_seconds / wall_seconds
+        previous = self.rates.get(level)
+        self.rates[level] = rate if previous is None else previous + RATE_SMOOTHING * (rate - previous)
+        self.samples[level] += 1
+        self._since_change += 1
+        INFERENCE_THROUGHPUT.labels(concurrency=str(level)).set(self.rates[level])
+        self._adjust()
+
+    def _set_limit(self, limit: int, reason: str):
+        previous = self.inference.limit
+        self.inference.set_limit(limit)
+        if self.inference.limit != previous:
+            self._since_change = 0
+            print(f"Separation concurrency {previous} -> {self.inference.limit} ({reason})")
+
+    def _adjust(self):
+        """Move the limit one step towards the highest measured throughput"""
+        if not settings.adaptive_concurrency:
+            return
+        gate = self.inference
+        limit = gate.limit
+        current = self.rates.get(limit)
+        if current is None or self.samples[limit] < MIN_SAMPLES:
+            return
+
+        lower = self.rates.get(limit - 1)
+        if lower is not None and current < lower * (1 - RATE_TOLERANCE):
+            self._set_limit(limit - 1, "fewer jobs were faster")
+            return
+
+        # Measurements of a slower level go stale as the workload changes
+        if self._since_change >= REPROBE_JOBS:
+            self.rates.pop(limit + 1, None)
+            self.samples.pop(limit + 1, None)
+
+        higher = self.rates.get(limit + 1)
+        if (
+            gate.waiting
+            and limit < gate.maximum
+            and (higher is None or higher > current * (1 + RATE_TOLERANCE))
+            and self._fits_another_job()
+        ):
+            self._set_limit(limit + 1, "probing more jobs")
+
+    def _fits_another_job(self) -> bool:
+        headroom = self.headroom()
+        return headroom is None or headroom >= self.job_memory
+
+    def _sample_memory(self, used: Optional[int], available: Optional[int]):
+        """Update the per-job memory estimate and back off under memory pressure"""
+        self.memory_used, self.memory_available = used, available
+        active = self.inference.active
+        if used is not None:
+            if active == 0:
+                self._idle_memory = used
+            elif self._idle_memory is not None:
+                per_job = max(0, used - self._idle_memory) / active
+                self.job_memory = max(
+                    self.job_memory + RATE_SMOOTHING * (per_job - self.job_memory), 64 * 1024 * 1024
+                )
+
+        headroom = self.headroom()
+        if headroom is not None and headroom < 0 and self.inference.limit > 1:
+            # Running jobs finish, no new ones start until memory recovers
+            self._set_limit(max(1, active - 1), "memory pressure")
+
+    async def run(self):
+        """Sample memory periodically, runs until cancelled"""
+        from app.core.executors import executors
+
+        while True:
+            self._sample_memory(*await executors.run("fs", memory_status))
+            await asyncio.sleep(settings.resource_interval_seconds)
+
+    def describe(self) -> Dict[str, Any]:
+        """Detected resources and the adaptive state, for the debug endpoint"""
+        return {
+            "cores": self.cores,
+            "memory_limit": self.memory_limit,
+            "memory_used": self.memory_used,
+            "memory_available": self.memory_available,
+            "job_memory": int(self.job_memory),
+            "inference": {
+                "limit": self.inference.limit,
+                "maximum": self.inference.maximum,
+                "active": self.inference.active,
+                "waiting": self.inference.waiting,
+                "threads_per_job": self.thread_share(),
+            },
+            "throughput": {str(level): rate for level, rate in sorted(self.rates.items())},
+        }
+
+
+# Global instance
+resources = ResourceManager()
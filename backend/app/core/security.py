@@ -1,14 +1,17 @@
 """Security and validation utilities"""
 
 from fastapi import UploadFile, HTTPException
-import magic
+from pathlib import Path
+from typing import BinaryIO
+
 from app.config import settings
+from app.core import mp3
+from app.core.exceptions import InvalidAudioFileError
+from app.core.executors import executors
 
 
-ALLOWED_MIME_TYPES = {
-    "audio/mpeg",
-    "audio/mp3",
-}
+# Bytes inspected to detect the file type of partial uploads
+HEADER_CHECK_SIZE = 2048
 
 
 async def validate_audio_file(file: UploadFile) -> bool:
@@ -24,24 +27,103 @@ async def validate_audio_file(file: UploadFile) -> bool:
     Raises:
         HTTPException: If file is invalid
     """
-    # Read first 2KB to check MIME type
-    content = await file.read(2048)
-    await file.seek(0)  # Reset file pointer
+    # Large uploads are spooled to disk, so this reads from a file
+    await executors.run("fs", _validate_spooled, file.file)
+    return True
+
+
+def _validate_spooled(f: BinaryIO):
+    # Check file size
+    f.seek(0, 2)  # Seek to end
+    size = f.tell()
+
+    validate_audio_size(size)
+
+    # Check MP3 frame structure from headers only (not just extension)
+    validate_audio_stream(f, size)
+    f.seek(0)  # Reset to beginning
 
-    # Check MIME type using python-magic (not just extension)
-    mime = magic.from_buffer(content, mime=True)
 
-    if mime not in ALLOWED_MIME_TYPES:
+def validate_audio_header(content: bytes) -> None:
+    """
+    Validate the first bytes of an audio file
+
+    Args:
+        content: First HEADER_CHECK_SIZE bytes of the file
+
+    Raises:
+        HTTPException: If the content is not MP3
+    """
+    try:
+        mp3.check_prefix(content)
+    except InvalidAudioFileError as e:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid file format. Only MP3 files are allowed. Detected: {mime}"
+            detail=f"Invalid file format. Only MP3 files are allowed. {e}"
         )
 
-    # Check file size
-    await file.seek(0, 2)  # Seek to end
-    size = await file.tell()
-    await file.seek(0)  # Reset to beginning
 
+def validate_audio_stream(f: BinaryIO, size: int) -> mp3.Mp3Info:
+    """
+    Validate a complete MP3 file by its headers
+
+    Checks the frame sync structure and that the file is not truncated,
+    without decoding any audio.
+
+    Args:
+        f: Seekable binary stream of the file
+        size: File size in bytes
+
+    Returns:
+        Parsed stream information
+
+    Raises:
+        HTTPException: If the file is not a valid MP3
+    """
+    try:
+        info = mp3.parse_stream(f, size)
+    except InvalidAudioFileError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file format. Only MP3 files are allowed. {e}"
+        )
+
+    if info.layer != 3:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file format. Only MP3 files are allowed. Detected MPEG layer {info.layer}"
+        )
+
+    return info
+
+
+def validate_audio_path(path: Path) -> mp3.Mp3Info:
+    """
+    Validate a complete MP3 file on disk by its headers
+
+    Args:
+        path: Path to the file
+
+    Returns:
+        Parsed stream information
+
+    Raises:
+        HTTPException: If the file is not a valid MP3
+    """
+    with open(path, "rb") as f:
+        return validate_audio_stream(f, path.stat().st_size)
+
+
+def validate_audio_size(size: int) -> None:
+    """
+    Validate the size of an audio file
+
+    Args:
+        size: File size in bytes
+
+    Raises:
+        HTTPException: If the file is empty or too large
+    """
     if size > settings.max_file_size_bytes:
         raise HTTPException(
             status_code=413,
@@ -54,8 +136,6 @@ async def validate_audio_file(file: UploadFile) -> bool:
             detail="File is empty"
         )
 
-    return True
-
 
 def sanitize_filename(filename: str) -> str:
     """
@@ -0,0 +1,251 @@
+"""Per-task tracing with Chrome trace and flamegraph export
+
+A trace is started for a sampled task and follows it through context
+variables: asyncio tasks inherit them automatically and executor jobs
+receive them through ``contextvars.copy_context()``. Code outside a traced
+task pays a single context variable lookup per span.
+"""
+
+import asyncio
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+
+class Span:
+    """A single timed region of a trace"""
+
+    __slots__ = ("name", "start", "end", "parent", "lane", "args", "path")
+
+    def __init__(self, name: str, parent: Optional["Span"], lane: str, args: dict):
+        self.name = name
+        self.parent = parent
+        self.lane = lane
+        self.args = args
+        self.path = f"{parent.path};{name}" if parent else name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+
+class Trace:
+    """Spans and profiler samples recorded for one task"""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        # Collapsed stack -> sampled time in microseconds
+        self.samples: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def add_sample(self, stack: str, weight_us: int):
+        with self._lock:
+            self.samples[stack] += weight_us
+
+    def to_chrome_trace(self) -> dict:
+        """
+        Export as Chrome trace event format
+
+        Returns:
+            Dictionary loadable by chrome://tracing and Perfetto
+        """
+        pid = os.getpid()
+        lanes: Dict[str, int] = {}
+        events = []
+
+        with self._lock:
+            spans = [span for span in self.spans if span.end is not None]
+
+        for span in sorted(spans, key=lambda s: s.start):
+            tid = lanes.setdefault(span.lane, len(lanes) + 1)
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": (span.start - self.origin) * 1e6,
+                "dur": (span.end - span.start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": span.args,
+            })
+
+        for lane, tid in lanes.items():
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": lane},
+            })
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id},
+        }
+
+    def to_collapsed(self) -> str:
+        """
+        Export as collapsed stacks for flamegraph tools
+
+        Spans contribute their self time, profiler samples are nested under
+        the span that was open when they were taken. Weights are microseconds.
+
+        Returns:
+            One "frame;frame;frame weight" line per stack
+        """
+        with self._lock:
+            spans = [span for span in self.spans if span.end is not None]
+            samples = Counter(self.samples)
+
+        self_time: Counter = Counter()
+        for span in spans:
+            self_time[span.path] += int((span.end - span.start) * 1e6)
+        for span in spans:
+            if span.parent is not None:
+                self_time[span.parent.path] -= int((span.end - span.start) * 1e6)
+        for stack, weight in samples.items():
+            span_path = stack.split(";<py>;", 1)[0]
+            self_time[span_path] -= weight
+
+        stacks = Counter({path: t for path, t in self_time.items() if t > 0})
+        stacks.update(samples)
+        return "".join(f"{stack} {weight}\n" for stack, weight in sorted(stacks.items()))
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def _lane() -> str:
+    """Name of the timeline a span belongs to (asyncio task or thread)"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return f"async:{task.get_name()}"
+    return f"thread:{threading.current_thread().name}"
+
+
+class Tracer:
+    """
+    Records traces for a sampled subset of tasks
+
+    Keeps the most recent traces in memory, bounded by
+    settings.trace_max_traces.
+    """
+
+    def __init__(self):
+        self.traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start_trace(self, trace_id: str) -> Optional[Trace]:
+        """
+        Start tracing in the current context if the task is sampled
+
+        Args:
+            trace_id: ID of the traced task
+
+        Returns:
+            The new Trace, or None if the task was not sampled
+        """
+        rate = settings.trace_sample_rate
+        if rate <= 0.0 or (rate < 1.0 and random.random() >= rate):
+            return None
+
+        trace = Trace(trace_id)
+        with self._lock:
+            self.traces[trace_id] = trace
+            while len(self.traces) > settings.trace_max_traces:
+                self.traces.popitem(last=False)
+
+        _current_trace.set(trace)
+        _current_span.set(None)
+        return trace
+
+    def get_trace(self, trace_id: str) -> Optional[Trace]:
+        """Get a recorded trace by ID"""
+        with self._lock:
+            return self.traces.get(trace_id)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """
+        Record a span around the enclosed block
+
+        Args:
+            name: Span name
+            args: Extra attributes shown in the trace viewer
+        """
+        trace = _current_trace.get()
+        if trace is None:
+            yield
+            return
+
+        span = Span(name, _current_span.get(), _lane(), args)
+        token = _current_span.set(span)
+        try:
+            yield
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            trace.add_span(span)
+
+    @contextmanager
+    def profile(self):
+        """
+        Sample Python stacks of the current thread while the block runs
+
+        Only active when the current task is traced and
+        settings.trace_profile is enabled.
+        """
+        trace = _current_trace.get()
+        if trace is None or not settings.trace_profile:
+            yield
+            return
+
+        span = _current_span.get()
+        prefix = f"{span.path};<py>" if span else "<py>"
+        interval = settings.trace_profile_interval_ms / 1000.0
+        weight_us = int(settings.trace_profile_interval_ms * 1000)
+        target = threading.get_ident()
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(interval):
+                frame = sys._current_frames().get(target)
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                if frames:
+                    trace.add_sample(";".join([prefix] + frames[::-1]), weight_us)
+
+        sampler = threading.Thread(target=sample, name="trace-profiler", daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+
+
+# Global instance
+tracer = Tracer()
@@ -1,13 +1,24 @@
 """Main FastAPI application"""
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from contextlib import asynccontextmanager
 import asyncio
 
 from app.config import settings
-from app.api.routes import upload, audio, tasks
+from app.core.executors import executors
+from app.core.loop_monitor import loop_monitor
+from app.core.resources import resources
+from app.api.routes import upload, audio, tasks, batch, metadata
+from app.services.demucs_service import demucs_service
+from app.services.gemini_service import gemini_service
+from app.services.prefetcher import prefetcher
 from app.services.storage_service import storage_service
+from app.services.task_manager import task_manager
+from app.services.upload_session_service import upload_session_service
+from app.services.watchdog import watchdog
 
 
 @asynccontextmanager
@@ -24,6 +35,33 @@ async def lifespan(app: FastAPI):
     settings.upload_dir.mkdir(parents=True, exist_ok=True)
     settings.processed_dir.mkdir(parents=True, exist_ok=True)
 
+    # Task database, tasks of processes that are gone are failed here
+    await task_manager.open()
+
+    # Preload models without blocking startup, /ready reports progress
+    warmup_task = None
+    if settings.warmup_models:
+        warmup_task = asyncio.create_task(demucs_service.warmup(settings.warmup_models))
+
+    # Write batched progress updates even when no new ones arrive
+    flush_task = asyncio.create_task(run_task_flush_loop())
+
+    # Fail jobs that overrun their deadline or stall
+    watchdog_task = asyncio.create_task(watchdog.run())
+
+    # Track memory for the concurrency of separations
+    resources_task = asyncio.create_task(resources.run())
+
+    # Record event loop lag and whoever blocks the loop
+    monitor_task = None
+    if settings.loop_stall_threshold_ms > 0:
+        monitor_task = asyncio.create_task(loop_monitor.run())
+
+    # Work ahead on fresh uploads while no real job runs
+    prefetch_task = None
+    if settings.prefetch_enabled:
+        prefetch_task = asyncio.create_task(prefetcher.run())
+
     # Start background cleanup task (optional)
     # cleanup_task = asyncio.create_task(run_cleanup_loop())
 
@@ -31,15 +69,39 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     print("Shutting down Audio Processor API...")
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await gemini_service.close()
+    flush_task.cancel()
+    watchdog_task.cancel()
+    resources_task.cancel()
+    if monitor_task is not None:
+        monitor_task.cancel()
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+    await task_manager.close()
+    executors.shutdown()
     # cleanup_task.cancel()
 
 
+async def run_task_flush_loop():
+    """Background task to flush buffered task progress periodically"""
+    while True:
+        await asyncio.sleep(settings.task_flush_interval_ms / 1000)
+        try:
+            await task_manager.flush()
+            await task_manager.apply_cancel_requests()
+        except Exception as e:
+            print(f"Task flush error: {e}")
+
+
 async def run_cleanup_loop():
     """Background task to clean up old files periodically"""
     while True:
         await asyncio.sleep(3600)  # Run every hour
         try:
             await storage_service.cleanup_old_files(max_age_hours=24)
+            await upload_session_service.cleanup_expired()
         except Exception as e:
             print(f"Cleanup error: {e}")
 
@@ -65,6 +127,8 @@ app.add_middleware(
 app.include_router(upload.router, prefix="/api", tags=["upload"])
 app.include_router(audio.router, prefix="/api/audio", tags=["audio"])
 app.include_router(tasks.router, prefix="/api/tasks", tags=["tasks"])
+app.include_router(batch.router, prefix="/api/batches", tags=["batches"])
+app.include_router(metadata.router, prefix="/api/metadata", tags=["metadata"])
 
 # Health check endpoint
 @app.get("/")
@@ -83,6 +147,51 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint - ready once configured models are warm"""
+    ready = demucs_service.is_ready()
+    if ready:
+        status = "ready"
+    elif demucs_service.warmup_error:
+        status = "warmup_failed"
+    else:
+        status = "warming_up"
+
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": status,
+            "warmup_models": demucs_service.warmup_models,
+            "loaded_models": demucs_service.loaded_models(),
+            "warmup_error": demucs_service.warmup_error,
+        },
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics endpoint"""
+    # Storage gauges scan directories while collecting
+    content = await executors.run("fs", generate_latest)
+    return Response(content=content, media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/debug/loop-stalls", include_in_schema=False)
+async def loop_stalls():
+    """Recent event loop stalls with the coroutine and stack that caused them"""
+    return {
+        "threshold_ms": settings.loop_stall_threshold_ms,
+        "stalls": loop_monitor.recent(),
+    }
+
+
+@app.get("/debug/resources", include_in_schema=False)
+async def resource_usage():
+    """Detected cores and memory, concurrency limit and measured throughput"""
+    return resources.describe()
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,397 @@
+"""Local music analysis: tempo, key, loudness and section energy
+
+The track is decoded in chunks and analysed in a single pass. Each chunk
+goes through one shared STFT whose frames feed the onset envelope (tempo
+and beat grid), the chroma profile (key) and the frame energies (sections);
+loudness is measured on the same chunks with streaming K-weighting filters.
+Only small per-frame summaries are kept, never the spectrogram or the
+decoded audio. Results are cached on disk by content hash, so re-uploads
+of the same file are not analysed again.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.executors import executors
+from app.core.jobs import JobContext
+from app.core.tracing import tracer
+from app.services.resampler import resampler
+from app.services.storage_service import storage_service
+from app.services.task_manager import task_manager
+
+
+# Bump when the analysis output changes, old cache entries are ignored
+ANALYSIS_VERSION = 1
+
+ANALYSIS_SAMPLE_RATE = 22050
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# BS.1770 gating: 400 ms blocks with 75% overlap, built from 100 ms steps
+LOUDNESS_STEP_SECONDS = 0.1
+LOUDNESS_BLOCK_STEPS = 4
+LOUDNESS_ABSOLUTE_GATE = -70.0
+LOUDNESS_RELATIVE_GATE = -10.0
+
+SECTION_BEATS = 16
+SECTION_SECONDS = 10.0
+
+PITCH_CLASSES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# Krumhansl-Kessler key profiles, tonic first
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+# Common target tempos offered as tempo change suggestions
+TARGET_TEMPOS = [70, 80, 90, 100, 110, 120, 128, 140, 150, 170]
+
+
+def _k_weighting(sr: int):
+    """
+    K-weighting filter coefficients for a sample rate
+
+    Returns:
+        List of (b, a) for the high shelf and the high pass stage
+    """
+    # High shelf (head diffraction)
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / sr)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = (
+        np.array([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]),
+        np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]),
+    )
+
+    # High pass (RLB)
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / sr)
+    a0 = 1 + k / q + k * k
+    highpass = (
+        np.array([1.0, -2.0, 1.0]),
+        np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]),
+    )
+
+    return [shelf, highpass]
+
+
+class _Analyzer:
+    """Accumulates per-frame features over consecutive audio chunks"""
+
+    def __init__(self, sr: int, channels: int):
+        import librosa
+
+        self.sr = sr
+        self.window = np.hanning(N_FFT).astype(np.float32)
+        # Scale from one-sided power to windowed mean square
+        self.power_scale = 1.0 / (N_FFT * float(np.sum(self.window ** 2)))
+        self.chroma_fb = librosa.filters.chroma(sr=sr, n_fft=N_FFT).astype(np.float32)
+
+        self.carry = np.zeros(0, dtype=np.float32)
+        self.prev_log_mag: Optional[np.ndarray] = None
+        self.onsets: List[np.ndarray] = []
+        self.energies: List[np.ndarray] = []
+        self.chroma = np.zeros(12, dtype=np.float64)
+        self.samples = 0
+
+        self.k_filters = _k_weighting(sr)
+        self.k_state = [np.zeros((channels, 2)) for _ in self.k_filters]
+        self.step = int(LOUDNESS_STEP_SECONDS * sr)
+        self.sq_carry = np.zeros((channels, 0))
+        self.step_power: List[np.ndarray] = []
+
+    def feed(self, chunk: np.ndarray):
+        """
+        Analyse the next chunk
+
+        Args:
+            chunk: float32 array of shape (channels, frames)
+        """
+        self.samples += chunk.shape[1]
+        self._feed_loudness(chunk)
+        self._feed_stft(chunk.mean(axis=0))
+
+    def _feed_stft(self, mono: np.ndarray):
+        buf = np.concatenate([self.carry, mono])
+        n_frames = (len(buf) - N_FFT) // HOP_LENGTH + 1 if len(buf) >= N_FFT else 0
+        if n_frames <= 0:
+            self.carry = buf
+            return
+
+        frames = np.lib.stride_tricks.sliding_window_view(buf, N_FFT)[::HOP_LENGTH][:n_frames]
+        self.carry = buf[n_frames * HOP_LENGTH:]
+
+        mag = np.abs(np.fft.rfft(frames * self.window, axis=1)).astype(np.float32)
+        power = mag ** 2
+
+        # Windowed mean square per frame (Parseval, DC and Nyquist counted once)
+        self.energies.append(
+            (2 * power.sum(axis=1) - power[:, 0] - power[:, -1]) * self.power_scale
+        )
+
+        # Spectral flux of the log-compressed magnitude
+        log_mag = np.log1p(1000.0 * mag)
+        prev = log_mag[:1] if self.prev_log_mag is None else self.prev_log_mag[None]
+        diff = np.diff(np.concatenate([prev, log_mag]), axis=0)
+        self.onsets.append(np.maximum(diff, 0).sum(axis=1))
+        self.prev_log_mag = log_mag[-1]
+
+        # Frame-normalized chroma, so loud passages do not dominate the key
+        chroma = self.chroma_fb @ power.T
+        chroma /= chroma.max(axis=0, keepdims=True) + 1e-9
+        self.chroma += chroma.sum(axis=1)
+
+    def _feed_loudness(self, chunk: np.ndarray):
+        from scipy.signal import lfilter
+
+        y = chunk.astype(np.float64)
+        for i, (b, a) in enumerate(self.k_filters):
+            y, self.k_state[i] = lfilter(b, a, y, axis=1, zi=self.k_state[i])
+
+        sq = np.concatenate([self.sq_carry, y ** 2], axis=1)
+        n_steps = sq.shape[1] // self.step
+        used = n_steps * self.step
+        if n_steps:
+            steps = sq[:, :used].reshape(sq.shape[0], n_steps, self.step).mean(axis=2)
+            self.step_power.append(steps.T)
+        self.sq_carry = sq[:, used:]
+
+    def integrated_loudness(self) -> Optional[float]:
+        """Gated integrated loudness in LUFS, None for silence or very short audio"""
+        if not self.step_power:
+            return None
+        steps = np.concatenate(self.step_power).sum(axis=1)
+        if len(steps) < LOUDNESS_BLOCK_STEPS:
+            return None
+
+        kernel = np.ones(LOUDNESS_BLOCK_STEPS) / LOUDNESS_BLOCK_STEPS
+        blocks = np.convolve(steps, kernel, mode="valid")
+        with np.errstate(divide="ignore"):
+            block_lufs = -0.691 + 10 * np.log10(blocks)
+
+        gated = blocks[block_lufs > LOUDNESS_ABSOLUTE_GATE]
+        if not len(gated):
+            return None
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) + LOUDNESS_RELATIVE_GATE
+        gated = blocks[(block_lufs > LOUDNESS_ABSOLUTE_GATE) & (block_lufs > relative_gate)]
+        return round(float(-0.691 + 10 * np.log10(gated.mean())), 2)
+
+    def tempo(self):
+        """Estimate (bpm, beat times) from the onset envelope"""
+        import librosa
+
+        if not self.onsets:
+            return None, []
+        envelope = np.concatenate(self.onsets)
+        bpm, beats = librosa.beat.beat_track(
+            onset_envelope=envelope, sr=self.sr, hop_length=HOP_LENGTH
+        )
+        bpm = float(np.atleast_1d(bpm)[0])
+        # Frames are not centered, a frame's time is the middle of its window
+        times = (np.asarray(beats) * HOP_LENGTH + N_FFT / 2) / self.sr
+        return (round(bpm, 2) if bpm > 0 else None), [round(float(t), 3) for t in times]
+
+    def key(self) -> Optional[Dict[str, Any]]:
+        """Estimate the key by correlating the chroma profile with key profiles"""
+        if not self.chroma.any():
+            return None
+        best = None
+        for mode, profile in (("major", MAJOR_PROFILE), ("minor", MINOR_PROFILE)):
+            for tonic in range(12):
+                score = float(np.corrcoef(self.chroma, np.roll(profile, tonic))[0, 1])
+                if best is None or score > best[0]:
+                    best = (score, tonic, mode)
+
+        score, tonic, mode = best
+        return {
+            "tonic": PITCH_CLASSES[tonic],
+            "mode": mode,
+            "name": f"{PITCH_CLASSES[tonic]} {mode}",
+            "confidence": round(score, 3),
+        }
+
+    def sections(self, beats: List[float]) -> List[Dict[str, float]]:
+        """Mean energy of consecutive sections, beat aligned when possible"""
+        if not self.energies:
+            return []
+        energies = np.concatenate(self.energies)
+        frame_times = (np.arange(len(energies)) * HOP_LENGTH + N_FFT / 2) / self.sr
+        duration = self.samples / self.sr
+
+        if len(beats) >= 2 * SECTION_BEATS:
+            bounds = [0.0] + beats[SECTION_BEATS::SECTION_BEATS] + [duration]
+        else:
+            bounds = list(np.arange(0.0, duration, SECTION_SECONDS)) + [duration]
+
+        sections = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            mask = (frame_times >= start) & (frame_times < end)
+            if not mask.any():
+                continue
+            energy_db = 10 * np.log10(energies[mask].mean() + 1e-12)
+            sections.append({
+                "start": round(float(start), 3),
+                "end": round(float(end), 3),
+                "energy_db": round(float(energy_db), 2),
+            })
+        return sections
+
+
+def transposed_key(key: Dict[str, Any], semitones: int) -> str:
+    """Name of a key transposed by some semitones"""
+    tonic = (PITCH_CLASSES.index(key["tonic"]) + semitones) % 12
+    return f"{PITCH_CLASSES[tonic]} {key['mode']}"
+
+
+def suggest_tempo_factors(bpm: Optional[float]) -> Dict[str, float]:
+    """
+    Tempo factors that bring a track to common target tempos
+
+    Args:
+        bpm: Detected tempo
+
+    Returns:
+        Mapping of target BPM to tempo factor, within the allowed 0.5x-2.0x
+    """
+    if not bpm:
+        return {}
+    factors = {}
+    for target in TARGET_TEMPOS:
+        factor = round(target / bpm, 3)
+        if 0.5 < factor < 2.0 and factor != 1.0:
+            factors[str(target)] = factor
+    return factors
+
+
+def suggest_transpositions(key: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Smallest transposition to every other key of the same mode
+
+    Args:
+        key: Detected key
+
+    Returns:
+        Mapping of key name to semitones (-6 to +5)
+    """
+    if not key:
+        return {}
+    tonic = PITCH_CLASSES.index(key["tonic"])
+    shifts = {}
+    for target, name in enumerate(PITCH_CLASSES):
+        semitones = (target - tonic + 6) % 12 - 6
+        if semitones:
+            shifts[f"{name} {key['mode']}"] = semitones
+    return shifts
+
+
+class AnalysisService:
+    """Service for local tempo, key and loudness analysis"""
+
+    def __init__(self):
+        self.cache_dir = storage_service.processed_dir / "analysis"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def cache_path(self, content_hash: str) -> Path:
+        """Path of the cached analysis of some content"""
+        return self.cache_dir / f"{content_hash}.v{ANALYSIS_VERSION}.json"
+
+    async def get_cached(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a previous analysis of a file without analysing it
+
+        Args:
+            file_id: ID of the uploaded audio file
+
+        Returns:
+            Analysis result, or None if the file was not analysed yet
+        """
+        digest = await storage_service.get_content_hash(file_id)
+        if not digest:
+            return None
+        return await executors.run("fs", storage_service.read_json, self.cache_path(digest))
+
+    def _analyze_sync(self, job: JobContext, input_path: Path) -> Dict[str, Any]:
+        """
+        Synchronous single-pass analysis (runs in thread pool)
+
+        Args:
+            job: Progress reporting and cancellation of the task
+            input_path: Path to input audio file
+
+        Returns:
+            Analysis result
+        """
+        with tracer.span("executor.run"):
+            job.progress(0.1, "Analysing audio...")
+
+            analyzer = None
+            with tracer.span("analysis.pass"):
+                for chunk in resampler.stream(storage_service.input_source(input_path), ANALYSIS_SAMPLE_RATE):
+                    job.check()
+                    chunk = chunk.numpy()
+                    if analyzer is None:
+                        analyzer = _Analyzer(ANALYSIS_SAMPLE_RATE, chunk.shape[0])
+                    analyzer.feed(chunk)
+
+            if analyzer is None:
+                raise ValueError("No audio decoded")
+
+            job.progress(0.8, "Estimating tempo and key...")
+
+            with tracer.span("analysis.summarize"):
+                bpm, beats = analyzer.tempo()
+                key = analyzer.key()
+                return {
+                    "version": ANALYSIS_VERSION,
+                    "duration": round(analyzer.samples / ANALYSIS_SAMPLE_RATE, 3),
+                    "tempo": {"bpm": bpm, "beats": beats},
+                    "key": key,
+                    "loudness": {"integrated_lufs": analyzer.integrated_loudness()},
+                    "sections": analyzer.sections(beats),
+                    "suggestions": {
+                        "tempo_factors": suggest_tempo_factors(bpm),
+                        "semitones": suggest_transpositions(key),
+                    },
+                }
+
+    async def analyze(
+        self,
+        file_id: str,
+        task_id: Optional[str] = None,
+        job: Optional[JobContext] = None,
+    ) -> Dict[str, Any]:
+        """
+        Analyse an uploaded file, or return its cached analysis
+
+        Args:
+            file_id: ID of the uploaded audio file
+            task_id: Task ID for progress tracking
+            job: Context to run under instead of the task's
+
+        Returns:
+            Analysis result
+        """
+        input_path = await storage_service.get_file_path(file_id, directory="upload", fetch=False)
+        if not input_path:
+            raise FileNotFoundError(f"File {file_id} not found")
+
+        cached = await self.get_cached(file_id)
+        if cached:
+            return cached
+
+        with tracer.span("executor.submit"):
+            result = await executors.run(
+                "render", self._analyze_sync, job or task_manager.job_context(task_id), input_path
+            )
+
+        digest = await storage_service.get_content_hash(file_id)
+        await executors.run("fs", storage_service.write_json, self.cache_path(digest), result)
+
+        return result
+
+
+# Global instance
+analysis_service = AnalysisService()
@@ -0,0 +1,276 @@
+"""Batch service for running many file operations as one job"""
+
+import asyncio
+import json
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.api.schemas.audio import SeparationRequest, TempoRequest, TransposeRequest
+from app.api.schemas.batch import (
+    BatchItem,
+    BatchItemStatus,
+    BatchManifest,
+    BatchManifestItem,
+    BatchOutput,
+    BatchResponse,
+)
+from app.api.schemas.task import TaskStatus
+from app.core.executors import executors
+from app.services.pitch_tempo_service import pitch_tempo_service
+from app.services.prefetcher import prefetcher
+from app.services.task_manager import task_manager
+
+
+FINISHED_STATUSES = {TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED}
+
+REQUEST_MODELS = {
+    "separate": SeparationRequest,
+    "transpose": TransposeRequest,
+    "tempo": TempoRequest,
+}
+
+
+class Job:
+    """A unique unit of work, shared by identical batch items"""
+
+    def __init__(self, task_id: str, operation: str, func: Callable, kwargs: Dict[str, Any]):
+        self.task_id = task_id
+        self.operation = operation
+        self.func = func
+        self.kwargs = kwargs
+
+
+class Batch:
+    """Internal batch representation"""
+
+    def __init__(self, batch_id: str, items: List[BatchItem], item_task_ids: List[str]):
+        self.batch_id = batch_id
+        self.items = items
+        self.item_task_ids = item_task_ids
+        self.created_at = datetime.now()
+        self.runner: Optional[asyncio.Task] = None
+
+
+class BatchService:
+    """
+    Creates batches and schedules their items
+
+    Identical items (same file, operation and parameters) are coalesced
+    into one task. Separations are grouped by model and each group runs
+    before the next one starts, so a loaded model serves all items that
+    need it instead of being evicted by interleaved jobs.
+    """
+
+    def __init__(self):
+        self.batches: Dict[str, Batch] = {}
+
+    def _build_job(self, item: BatchItem) -> Tuple[Tuple, str, Callable, Dict[str, Any]]:
+        """
+        Validate an item and map it to a service call
+
+        Returns:
+            Tuple of (coalescing key, operation, function, keyword arguments)
+        """
+        request = REQUEST_MODELS[item.operation](file_id=item.file_id, **item.params)
+
+        if item.operation == "separate":
+            func, kwargs = prefetcher.separate, {"model_name": request.model}
+        elif item.operation == "transpose":
+            func, kwargs = pitch_tempo_service.transpose_audio, {"semitones": request.semitones}
+        else:
+            func, kwargs = pitch_tempo_service.change_tempo, {"tempo_factor": request.tempo_factor}
+
+        kwargs["file_id"] = item.file_id
+        key = (item.operation, json.dumps(kwargs, sort_keys=True))
+        return key, item.operation, func, kwargs
+
+    async def create_batch(self, items: List[BatchItem]) -> str:
+        """
+        Create a batch and start running it in the background
+
+        Args:
+            items: Batch items (already checked to reference existing files)
+
+        Returns:
+            Batch ID
+
+        Raises:
+            ValueError: If an item's params are invalid for its operation
+        """
+        jobs: "OrderedDict[Tuple, Job]" = OrderedDict()
+        item_task_ids = []
+
+        for index, item in enumerate(items):
+            try:
+                key, operation, func, kwargs = self._build_job(item)
+            except Exception as e:
+                raise ValueError(f"Item {index}: {e}")
+
+            job = jobs.get(key)
+            if job is None:
+                job = Job(await task_manager.create_task(), operation, func, kwargs)
+                jobs[key] = job
+            item_task_ids.append(job.task_id)
+
+        batch_id = str(uuid.uuid4())
+        batch = Batch(batch_id, items, item_task_ids)
+        batch.runner = asyncio.create_task(self._run_batch(list(jobs.values())))
+        self.batches[batch_id] = batch
+        return batch_id
+
+    async def _run_job(self, job: Job, limit: asyncio.Semaphore):
+        """Run one job as a regular task, unless it was cancelled while pending"""
+        async with limit:
+            task = await task_manager.get_task(job.task_id)
+            if task is None or task.status in FINISHED_STATUSES:
+                return
+
+            async_task = task_manager.start_background_task(job.task_id, job.func, **job.kwargs)
+            # wait() does not raise if the job fails or gets cancelled
+            await asyncio.wait([async_task])
+
+    async def _run_batch(self, jobs: List[Job]):
+        """Run separation groups one model at a time, other jobs alongside"""
+        # Separation concurrency matches the Demucs worker count
+        separation_limit = asyncio.Semaphore(executors.size("inference"))
+        other_limit = asyncio.Semaphore(executors.size("render"))
+
+        groups: "OrderedDict[str, List[Job]]" = OrderedDict()
+        others = []
+        for job in jobs:
+            if job.operation == "separate":
+                groups.setdefault(job.kwargs["model_name"], []).append(job)
+            else:
+                others.append(job)
+
+        async def run_separations():
+            for group in groups.values():
+                await asyncio.gather(*(self._run_job(job, separation_limit) for job in group))
+
+        await asyncio.gather(
+            run_separations(),
+            *(self._run_job(job, other_limit) for job in others),
+        )
+
+    async def get_batch(self, batch_id: str) -> Optional[BatchResponse]:
+        """
+        Get aggregate batch status
+
+        Args:
+            batch_id: The batch ID
+
+        Returns:
+            BatchResponse or None if not found
+        """
+        batch = self.batches.get(batch_id)
+        if not batch:
+            return None
+
+        items = []
+        for index, (item, task_id) in enumerate(zip(batch.items, batch.item_task_ids)):
+            task = await task_manager.get_task(task_id)
+            items.append(BatchItemStatus(
+                index=index,
+                file_id=item.file_id,
+                operation=item.operation,
+                params=item.params,
+                task_id=task_id,
+                status=task.status if task else TaskStatus.FAILED,
+                progress=task.progress if task else 0.0,
+                error=task.error if task else "Task expired",
+            ))
+
+        completed = sum(1 for item in items if item.status == TaskStatus.COMPLETED)
+        failed = sum(1 for item in items if item.status in (TaskStatus.FAILED, TaskStatus.CANCELLED))
+
+        if completed + failed < len(items):
+            started = any(item.status != TaskStatus.PENDING for item in items)
+            status = TaskStatus.PROCESSING if started else TaskStatus.PENDING
+        elif completed == 0:
+            status = TaskStatus.FAILED
+        else:
+            status = TaskStatus.COMPLETED
+
+        return BatchResponse(
+            batch_id=batch_id,
+            status=status,
+            progress=sum(item.progress for item in items) / len(items),
+            total=len(items),
+            completed=completed,
+            failed=failed,
+            items=items,
+            created_at=batch.created_at,
+        )
+
+    async def get_manifest(self, batch_id: str) -> Optional[BatchManifest]:
+        """
+        Get all outputs of a batch
+
+        Args:
+            batch_id: The batch ID
+
+        Returns:
+            BatchManifest or None if not found
+        """
+        status = await self.get_batch(batch_id)
+        if not status:
+            return None
+
+        items = []
+        for item in status.items:
+            task = await task_manager.get_task(item.task_id)
+            outputs = {}
+            if task and task.result and item.status == TaskStatus.COMPLETED:
+                for name, file_id in task.result.items():
+                    # Separation results also carry numeric statistics
+                    if not isinstance(file_id, str):
+                        continue
+                    outputs[name] = BatchOutput(
+                        file_id=file_id,
+                        url=f"/api/audio/download/{file_id}",
+                    )
+            items.append(BatchManifestItem(
+                index=item.index,
+                file_id=item.file_id,
+                operation=item.operation,
+                params=item.params,
+                task_id=item.task_id,
+                status=item.status,
+                error=item.error,
+                outputs=outputs,
+            ))
+
+        return BatchManifest(batch_id=batch_id, status=status.status, items=items)
+
+    async def cancel_batch(self, batch_id: str) -> bool:
+        """
+        Cancel all unfinished items of a batch
+
+        Args:
+            batch_id: The batch ID
+
+        Returns:
+            True if the batch exists
+        """
+        batch = self.batches.get(batch_id)
+        if not batch:
+            return False
+
+        for task_id in dict.fromkeys(batch.item_task_ids):
+            task = await task_manager.get_task(task_id)
+            if task is None or task.status in FINISHED_STATUSES:
+                continue
+            if not await task_manager.cancel_task(task_id):
+                # Not started yet, the runner skips it
+                await task_manager.update_task(
+                    task_id,
+                    status=TaskStatus.CANCELLED,
+                    message="Task was cancelled",
+                )
+        return True
+
+
+# Global instance
+batch_service = BatchService()
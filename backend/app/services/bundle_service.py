@@ -0,0 +1,223 @@
+"""ZIP bundles of all stems, streamed without temp files
+
+The archive uses store mode, so stem files are copied into it unchanged.
+CRCs and sizes are known before the first byte is sent, which makes the
+layout deterministic: the bundle has a fixed length and an ETag derived
+from its contents, and any byte range can be served by mapping it back
+onto the header bytes and stem files it covers.
+"""
+
+import asyncio
+import hashlib
+import struct
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from app.core.executors import executors
+from app.services.stem_store import stem_store
+
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_OF_CENTRAL_DIR = struct.Struct("<IHHHHIIH")
+
+ZIP_VERSION = 20
+ZIP_MADE_BY_UNIX = (3 << 8) | ZIP_VERSION
+ZIP_MAX_SIZE = 0xFFFFFFFF
+
+READ_CHUNK = 1 << 16
+
+# A segment is either literal bytes or (path, length) of a whole file
+Segment = Union[bytes, Tuple[Path, int]]
+
+
+def _dos_datetime(timestamp: float) -> Tuple[int, int]:
+    """Convert a timestamp to ZIP (time, date) fields"""
+    dt = datetime.fromtimestamp(timestamp)
+    year = max(dt.year, 1980)
+    return (
+        (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2),
+        ((year - 1980) << 9) | (dt.month << 5) | dt.day,
+    )
+
+
+class Bundle:
+    """Deterministic layout of a stored ZIP archive"""
+
+    def __init__(self, segments: List[Segment], etag: str):
+        self.segments = segments
+        self.etag = etag
+        self.size = sum(len(s) if isinstance(s, bytes) else s[1] for s in segments)
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Stream bytes [start, end] of the archive
+
+        Args:
+            start: First byte
+            end: Last byte (inclusive), None for the end of the archive
+
+        Returns:
+            Iterator over archive bytes
+        """
+        end = self.size - 1 if end is None else end
+        offset = 0
+        for segment in self.segments:
+            length = len(segment) if isinstance(segment, bytes) else segment[1]
+            seg_start, seg_end = offset, offset + length - 1
+            offset += length
+            if seg_end < start or seg_start > end:
+                continue
+
+            lo = max(start, seg_start) - seg_start
+            hi = min(end, seg_end) - seg_start + 1
+            if isinstance(segment, bytes):
+                yield segment[lo:hi]
+                continue
+
+            with open(segment[0], "rb") as f:
+                f.seek(lo)
+                remaining = hi - lo
+                while remaining > 0:
+                    data = f.read(min(READ_CHUNK, remaining))
+                    if not data:
+                        raise IOError(f"{segment[0].name} shrank while streaming")
+                    remaining -= len(data)
+                    yield data
+
+
+class BundleService:
+    """Builds stem bundles, caching CRCs of encoded stems"""
+
+    def __init__(self):
+        # path -> (size, mtime_ns, crc32)
+        self._crcs: Dict[Path, Tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _crc32(self, path: Path) -> Tuple[int, int, float]:
+        """Get (crc32, size, mtime) of a file, reading it only if it changed"""
+        stat = path.stat()
+        with self._lock:
+            cached = self._crcs.get(path)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2], stat.st_size, stat.st_mtime
+
+        crc = 0
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(1 << 20)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+
+        with self._lock:
+            self._crcs[path] = (stat.st_size, stat.st_mtime_ns, crc)
+        return crc, stat.st_size, stat.st_mtime
+
+    def _layout(self, files: List[Tuple[str, Path]]) -> Bundle:
+        """Compute archive segments for (name in archive, path) pairs"""
+        segments: List[Segment] = []
+        central = []
+        offset = 0
+        digest = hashlib.sha1()
+
+        for name, path in files:
+            crc, size, mtime = self._crc32(path)
+            if size > ZIP_MAX_SIZE:
+                raise ValueError(f"{name} is too large for a ZIP bundle")
+            dos_time, dos_date = _dos_datetime(mtime)
+            encoded_name = name.encode()
+            digest.update(f"{name}:{size}:{crc}:{dos_time}:{dos_date};".encode())
+
+            header = LOCAL_HEADER.pack(
+                0x04034B50, ZIP_VERSION, 0, 0, dos_time, dos_date,
+                crc, size, size, len(encoded_name), 0,
+            ) + encoded_name
+            central.append(CENTRAL_HEADER.pack(
+                0x02014B50, ZIP_MADE_BY_UNIX, ZIP_VERSION, 0, 0, dos_time, dos_date,
+                crc, size, size, len(encoded_name), 0, 0, 0, 0, 0o100644 << 16, offset,
+            ) + encoded_name)
+
+            segments.append(header)
+            segments.append((path, size))
+            offset += len(header) + size
+
+        central_dir = b"".join(central)
+        if offset + len(central_dir) > ZIP_MAX_SIZE:
+            raise ValueError("Bundle is too large for a ZIP archive without ZIP64")
+
+        segments.append(central_dir)
+        segments.append(END_OF_CENTRAL_DIR.pack(
+            0x06054B50, 0, 0, len(files), len(files), len(central_dir), offset, 0,
+        ))
+        return Bundle(segments, digest.hexdigest())
+
+    async def build(self, file_id: str, fmt: str = "mp3") -> Optional[Bundle]:
+        """
+        Build the bundle of all stems of an upload
+
+        Stems that were never downloaded in this format are encoded first.
+
+        Args:
+            file_id: ID of the original upload
+            fmt: Stem format ("mp3", "wav" or "flac")
+
+        Returns:
+            Bundle, or None if the file has no separated stems
+        """
+        stems = await executors.run("fs", stem_store.list_stems, file_id)
+        if not stems:
+            return None
+
+        paths = await asyncio.gather(
+            *(stem_store.get_encoded(f"{file_id}_{stem}", fmt) for stem in stems)
+        )
+        files = [(f"{stem}.{fmt}", path) for stem, path in zip(stems, paths)]
+
+        # Reads every stem once for its CRC
+        return await executors.run("decode", self._layout, files)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range HTTP Range header
+
+    Args:
+        header: Range header value, e.g. "bytes=100-" or "bytes=-500"
+        size: Total size of the resource
+
+    Returns:
+        (start, end) inclusive, or None if the header is absent or has
+        several ranges (callers then send the whole resource)
+
+    Raises:
+        ValueError: If the range is malformed or not satisfiable
+    """
+    if not header:
+        return None
+
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    if first:
+        start = int(first)
+        end = int(last) if last else size - 1
+    else:
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("Empty suffix range")
+        start, end = max(0, size - suffix), size - 1
+
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+# Global instance
+bundle_service = BundleService()
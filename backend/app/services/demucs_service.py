@@ -1,170 +1,591 @@
-"""Demucs service for audio source separation"""
+"""Demucs service for audio source separation
+
+torch, torchaudio and demucs are imported on first use so that importing
+the API (and answering /health) does not pay for loading them.
+
+Separation runs in a thread pool by default. Cancelled jobs stop at the
+next inference segment or stem write. With settings.separation_executor
+set to "process", jobs run in worker processes instead. Those workers are
+killed as soon as their task is cancelled.
+
+Silent stretches (intros, outros, gaps in mixes) are found with a cheap
+frame energy pass before inference and never reach the model. Only the
+active regions are separated. Their padded edges are crossfaded into the
+directly filled silence. Segments whose samples were separated before,
+e.g. the unchanged parts of a re-uploaded edit, come from the segment
+cache.
+"""
 
-import torch
-import torchaudio
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 
-from demucs.pretrained import get_model
-from demucs.apply import apply_model
-from demucs.audio import save_audio
-
+import numpy as np
+
+from app.config import settings
+from app.core.exceptions import ModelRepositoryError
+from app.core.executors import executors
+from app.core.jobs import JobContext
+from app.core.process_pool import ProcessPool
+from app.core.metrics import (
+    EXECUTOR_ACTIVE_WORKERS,
+    MODEL_CACHE_REQUESTS,
+    SEPARATION_SAVED_SECONDS,
+    SEPARATION_SKIPPED_SECONDS,
+    SEPARATION_STAGE_SECONDS,
+)
+from app.core.resources import resources
+from app.core.tracing import tracer
+from app.services.model_repository import model_repository
+from app.services.resampler import resampler
+from app.services.segment_cache import segment_cache
+from app.services.stem_store import stem_store
 from app.services.storage_service import storage_service
 from app.services.task_manager import task_manager
+from app.services.watchdog import watchdog
+
+
+# Overlap between inference segments, crossfaded when joining them
+SEGMENT_OVERLAP = 0.25
+
+# Segment length for models without a fixed training segment
+DEFAULT_SEGMENT_SECONDS = 10.0
+
+# Frame length of the silence detection pass
+SILENCE_FRAME_SECONDS = 0.05
+
+
+def find_active_regions(
+    wav: Any,
+    sample_rate: int,
+    threshold_db: float,
+    min_silence: float,
+    padding: float,
+) -> List[Tuple[int, int]]:
+    """
+    Find the parts of a track that are not silent
+
+    The mean square of the mixture is taken over short frames. Frames
+    above the threshold are active, each active run is widened by the
+    padding, and silent gaps shorter than min_silence are closed. Silence
+    at the start or end of the track shorter than min_silence is kept too.
+
+    Args:
+        wav: Audio of shape (channels, frames), full scale is 1.0
+        sample_rate: Sample rate of wav
+        threshold_db: Frames quieter than this (dBFS) are silent
+        min_silence: Shortest silence worth skipping, in seconds
+        padding: Context kept on each side of active audio, in seconds
+
+    Returns:
+        Sorted, disjoint (start, end) sample ranges
+    """
+    length = wav.shape[-1]
+    frame = max(1, int(SILENCE_FRAME_SECONDS * sample_rate))
+    count = -(-length // frame)
+
+    power = wav.double().pow(2).mean(0).cpu().numpy()
+    power = np.pad(power, (0, count * frame - length))
+    level = 10 * np.log10(power.reshape(count, frame).mean(axis=1) + 1e-20)
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], level > threshold_db, [0])).astype(np.int8)))
+    if len(edges) == 0:
+        return []
+    starts, ends = edges[0::2], edges[1::2]
+
+    pad = int(math.ceil(padding / SILENCE_FRAME_SECONDS))
+    gap = int(math.ceil(min_silence / SILENCE_FRAME_SECONDS))
+    starts = np.maximum(starts - pad, 0)
+    ends = np.minimum(ends + pad, count)
+
+    # Close gaps too short to skip, padding overlaps included
+    keep = starts[1:] - ends[:-1] >= gap
+    starts = np.concatenate((starts[:1], starts[1:][keep]))
+    ends = np.concatenate((ends[:-1][keep], ends[-1:]))
+    if starts[0] < gap:
+        starts[0] = 0
+    if count - ends[-1] < gap:
+        ends[-1] = count
+
+    return [
+        (int(start) * frame, min(int(end) * frame, length))
+        for start, end in zip(starts, ends)
+    ]
+
+
+def _observe_stage(name: str, seconds: float):
+    SEPARATION_STAGE_SECONDS.labels(stage=name).observe(seconds)
+
+
+def run_separation_job(
+    job: JobContext,
+    input_path: Path,
+    output_dir: Path,
+    model_name: str,
+    threads: Optional[int] = None,
+):
+    """Separation entry point for worker processes, threads is the job's torch thread count"""
+    resources.pin_threads(threads)
+    return demucs_service._separate(job, input_path, output_dir, model_name)
+
+
+def run_load_model_job(job: JobContext, model_name: str) -> str:
+    """Model preloading entry point for worker processes"""
+    demucs_service.load_model(model_name)
+    return model_name
 
 
 class DemucsService:
     """Service for separating audio into stems using Demucs"""
 
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = None
-        self.model_name = None
-        self.executor = ThreadPoolExecutor(max_workers=2)
-
-        print(f"DemucsService initialized with device: {self.device}")
-
-    def load_model(self, model_name: str = "htdemucs"):
+        self._device: Optional[str] = None
+        # Loaded models, least recently used first
+        self.models: "OrderedDict[str, Any]" = OrderedDict()
+        self._model_lock = threading.Lock()
+        self.process_pool: Optional[ProcessPool] = None
+        if settings.separation_executor == "process":
+            self.process_pool = ProcessPool(max_workers=executors.size("inference"))
+        # Models preloaded in worker processes
+        self.worker_models: set = set()
+
+        # Warmup state reported by /ready
+        self.warmup_models: List[str] = []
+        self.warmup_done = True
+        self.warmup_error: Optional[str] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Thread pool separation jobs run in"""
+        return executors.get("inference")
+
+    @property
+    def device(self) -> str:
+        """Torch device, resolved on first use"""
+        if self._device is None:
+            import torch
+
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+            print(f"DemucsService using device: {self._device}")
+        return self._device
+
+    def load_model(self, model_name: str = "htdemucs") -> Any:
         """
         Lazy load Demucs model
 
+        Keeps up to settings.max_cached_models models in memory,
+        evicting the least recently used one. Models in the local model
+        repository are mapped from it; others are fetched by Demucs unless
+        settings.demucs_repo_offline is set.
+
         Args:
             model_name: Model name (htdemucs, htdemucs_ft, etc.)
+
+        Returns:
+            The loaded model
         """
-        if self.model is None or self.model_name != model_name:
+        with self._model_lock:
+            model = self.models.get(model_name)
+            if model is not None:
+                MODEL_CACHE_REQUESTS.labels(result="hit").inc()
+                self.models.move_to_end(model_name)
+                return model
+
+            MODEL_CACHE_REQUESTS.labels(result="miss").inc()
             print(f"Loading Demucs model: {model_name}")
-            self.model = get_model(model_name)
-            self.model.to(self.device)
-            self.model_name = model_name
+            if model_repository.has(model_name):
+                model = model_repository.load(model_name, verify=settings.demucs_repo_verify)
+            elif settings.demucs_repo_offline:
+                raise ModelRepositoryError(
+                    f"Model {model_name} is not in the local repository and downloads are disabled"
+                )
+            else:
+                from demucs.pretrained import get_model
+
+                model = get_model(model_name)
+            model.to(self.device)
             print(f"Model loaded: {model_name}")
 
+            self.models[model_name] = model
+            while len(self.models) > max(1, settings.max_cached_models):
+                evicted, _ = self.models.popitem(last=False)
+                print(f"Evicted Demucs model: {evicted}")
+            return model
+
+    def loaded_models(self) -> List[str]:
+        """Models loaded in this process or preloaded in the worker processes"""
+        return sorted(set(self.models) | self.worker_models)
+
+    def is_ready(self) -> bool:
+        """Check whether warmup finished and every warmup model is loaded"""
+        loaded = self.loaded_models()
+        return self.warmup_done and all(name in loaded for name in self.warmup_models)
+
+    async def warmup(self, model_names: List[str]):
+        """
+        Preload models in the background
+
+        Args:
+            model_names: Models to load
+        """
+        self.warmup_models = list(model_names)
+        self.warmup_done = False
+        self.warmup_error = None
+
+        loop = asyncio.get_event_loop()
+        try:
+            for model_name in model_names:
+                if self.process_pool is not None:
+                    # One load per worker, each holds a worker until done
+                    await asyncio.gather(*(
+                        self.process_pool.run(run_load_model_job, model_name)
+                        for _ in range(self.process_pool.max_workers)
+                    ))
+                    self.worker_models.add(model_name)
+                else:
+                    await loop.run_in_executor(self.executor, self.load_model, model_name)
+        except Exception as e:
+            self.warmup_error = str(e)
+            print(f"Model warmup failed: {e}")
+        finally:
+            self.warmup_done = True
+
     def _separate_sync(
         self,
+        job: JobContext,
         input_path: Path,
         output_dir: Path,
         model_name: str,
-        task_id: str,
-    ) -> Dict[str, str]:
+    ) -> Dict[str, Any]:
         """
         Synchronous separation (runs in thread pool)
 
         Args:
+            job: Progress reporting and cancellation of the task
             input_path: Path to input audio file
             output_dir: Directory to save separated stems
             model_name: Demucs model name
-            task_id: Task ID for progress updates
 
         Returns:
-            Dictionary mapping stem names to file IDs
+            Stem names mapped to file IDs, plus skipped_seconds (silent audio
+            not separated), reused_seconds (audio taken from the segment
+            cache) and saved_seconds (estimated inference time saved)
+        """
+        job.start()
+        with EXECUTOR_ACTIVE_WORKERS.track_inprogress(), tracer.span("executor.run"):
+            return self._separate(job, input_path, output_dir, model_name)
+
+    def _report_stuck(self, future):
+        """Log a cancelled job whose thread is still running"""
+        if not future.done():
+            # Threads cannot be killed, resources.inference counts it until it ends
+            print("Separation thread ignored cancellation, its slot stays taken")
+
+    def _stage(self, job: JobContext, name: str):
+        """Time a pipeline stage in metrics and in the task trace"""
+        return job.stage(name, span=f"demucs.{name}")
+
+    def _apply_segmented(
+        self,
+        job: JobContext,
+        model: Any,
+        wav: Any,
+        progress: Tuple[float, float] = (0.3, 0.8),
+        model_name: Optional[str] = None,
+        raw: Any = None,
+        scale: float = 1.0,
+    ) -> Tuple[Any, int]:
+        """
+        Run the model over the track one segment at a time
+
+        This replaces apply_model's own splitting, so that the job can stop
+        between segments. Segments are as long as the model's training
+        segment and overlap by SEGMENT_OVERLAP. The overlapping parts are
+        joined with complementary linear crossfades. The job is checked for
+        cancellation before each segment.
+
+        With the raw input given, segments go through the segment cache.
+        The segment grid is then anchored at the loudest sample instead of
+        the first one. Cutting or adding audio elsewhere in the track does
+        not move the anchor, so the segments around it keep their samples
+        and their cache keys.
+
+        Args:
+            job: Progress reporting and cancellation of the task
+            model: Loaded Demucs model
+            wav: Normalized audio of shape (channels, frames) on the device
+            progress: Task progress at the first and after the last segment
+            model_name: Name of the model, part of the cache key
+            raw: The same audio before normalization, on the CPU
+            scale: Factor that normalized the audio
+
+        Returns:
+            Tuple of (sources tensor of shape (sources, channels, frames),
+            frames taken from the cache)
+        """
+        import torch
+        from demucs.apply import apply_model
+
+        length = wav.shape[-1]
+        seconds = float(getattr(model, "max_allowed_segment", getattr(model, "segment", math.inf)))
+        if not math.isfinite(seconds):
+            seconds = DEFAULT_SEGMENT_SECONDS
+        segment = int(seconds * model.samplerate)
+        overlap = int(segment * SEGMENT_OVERLAP)
+        stride = segment - overlap
+
+        cached = raw is not None and segment_cache.enabled
+        phase = int(raw.abs().sum(0).argmax()) % stride if cached else 0
+
+        # With a phase, the first segment is cut short at the start
+        first = phase - stride if phase > 0 else 0
+        spans = [
+            (max(offset, 0), min(offset + segment, length))
+            for offset in range(first, max(length - overlap, 1), stride)
+        ]
+
+        out = torch.zeros(len(model.sources), wav.shape[0], length, device=wav.device)
+        ramp = torch.linspace(0.0, 1.0, overlap + 2, device=wav.device)[1:-1]
+        reused = 0
+
+        for index, (start, end) in enumerate(spans):
+            job.progress(
+                progress[0] + (progress[1] - progress[0]) * index / len(spans),
+                f"Separating sources (segment {index + 1}/{len(spans)})...",
+            )
+
+            n = end - start
+            estimate = None
+            if cached:
+                key = segment_cache.key(model_name, raw[:, start:end].numpy())
+                stems = segment_cache.get(key)
+                if stems is not None and stems.shape[-1] == n:
+                    estimate = torch.from_numpy(stems).to(wav.device, torch.float32) / scale
+                    # Frames up to where the next segment takes over
+                    reused += (spans[index + 1][0] if index + 1 < len(spans) else end) - start
+
+            if estimate is None:
+                # Jobs that started or ended since the last segment change the share
+                resources.apply_threads()
+                estimate = apply_model(
+                    model,
+                    wav[:, start:end].unsqueeze(0),
+                    device=self.device,
+                    shifts=1,
+                    split=False,
+                    progress=False,
+                )[0]
+                if cached:
+                    segment_cache.put(key, (estimate * scale).cpu().numpy())
+
+            # Fade in where the previous segment fades out and vice versa
+            weight = torch.ones(n, device=wav.device)
+            if index > 0:
+                head = min(overlap, n)
+                weight[:head] = ramp[:head]
+            if index < len(spans) - 1:
+                weight[-overlap:] = 1.0 - ramp
+
+            out[..., start:end] += estimate * weight
+
+        return out, reused
+
+    def _apply_active(
+        self,
+        job: JobContext,
+        model: Any,
+        wav: Any,
+        regions: List[Tuple[int, int]],
+        model_name: Optional[str] = None,
+        raw: Any = None,
+        scale: float = 1.0,
+    ) -> Tuple[Any, int]:
+        """
+        Run the model over the active regions only
+
+        Silent parts of every stem are filled directly: zeros, except that
+        the residual stem ("other", or the last one) gets the mixture, so
+        the stems still add up to the input. Region edges that are not track
+        edges are crossfaded into the fill over the silence padding.
+
+        Args:
+            job: Progress reporting and cancellation of the task
+            model: Loaded Demucs model
+            wav: Normalized audio of shape (channels, frames) on the device
+            regions: Active (start, end) sample ranges
+            model_name: Name of the model, part of the segment cache key
+            raw: The same audio before normalization, on the CPU
+            scale: Factor that normalized the audio
+
+        Returns:
+            Tuple of (sources tensor of shape (sources, channels, frames),
+            frames taken from the segment cache)
         """
+        import torch
+
+        length = wav.shape[-1]
+        sources = list(model.sources)
+        residual = sources.index("other") if "other" in sources else len(sources) - 1
+
+        out = torch.zeros(len(sources), wav.shape[0], length, device=wav.device)
+        out[residual] = wav
+
+        fade = max(1, int(settings.silence_padding_seconds * model.samplerate))
+        ramp = torch.linspace(0.0, 1.0, fade + 2, device=wav.device)[1:-1]
+        total = sum(end - start for start, end in regions)
+        done = 0
+        reused = 0
+
+        for start, end in regions:
+            span = (0.3 + 0.5 * done / total, 0.3 + 0.5 * (done + end - start) / total)
+            estimate, region_reused = self._apply_segmented(
+                job,
+                model,
+                wav[:, start:end],
+                progress=span,
+                model_name=model_name,
+                raw=raw[:, start:end] if raw is not None else None,
+                scale=scale,
+            )
+            done += end - start
+            reused += region_reused
+
+            n = end - start
+            weight = torch.ones(n, device=wav.device)
+            if start > 0:
+                head = min(fade, n)
+                weight[:head] = ramp[:head]
+            if end < length:
+                tail = min(fade, n)
+                weight[n - tail:] = torch.minimum(weight[n - tail:], 1.0 - ramp[fade - tail:])
+
+            region = out[..., start:end]
+            out[..., start:end] = estimate * weight + region * (1.0 - weight)
+
+        return out, reused
+
+    def _separate(
+        self,
+        job: JobContext,
+        input_path: Path,
+        output_dir: Path,
+        model_name: str,
+    ) -> Dict[str, Any]:
+        """Separation pipeline, timed stage by stage"""
+        import torch
+
         # Load model
-        self.load_model(model_name)
+        with self._stage(job, "model_load"):
+            model = self.load_model(model_name)
 
         # Update progress
-        asyncio.run(
-            task_manager.update_task(
-                task_id,
-                progress=0.1,
-                message="Loading audio file...",
-            )
-        )
+        job.progress(0.1, "Loading audio file...")
+
+        # Load audio, decoded straight at the model's rate when possible
+        with self._stage(job, "decode"):
+            source = storage_service.input_source(input_path)
+            wav, sr = resampler.decode(source, sample_rate=model.samplerate)
 
-        # Load audio
-        wav, sr = torchaudio.load(str(input_path))
+        # Convert to the model's sample rate if the decoder could not
+        if sr != model.samplerate:
+            with self._stage(job, "resample"):
+                wav = resampler.resample(wav, sr, model.samplerate)
+            sr = model.samplerate
 
         # Ensure audio is stereo
         if wav.shape[0] == 1:
             wav = wav.repeat(2, 1)
 
-        # Convert to the model's sample rate if needed
-        if sr != self.model.samplerate:
-            resampler = torchaudio.transforms.Resample(sr, self.model.samplerate)
-            wav = resampler(wav)
-            sr = self.model.samplerate
-
-        asyncio.run(
-            task_manager.update_task(
-                task_id,
-                progress=0.2,
-                message="Processing audio with Demucs...",
-            )
-        )
+        job.progress(0.2, "Processing audio with Demucs...")
 
-        # Move audio to device
-        wav = wav.to(self.device)
+        length = wav.shape[-1]
+        regions = [(0, length)]
+        if settings.separation_skip_silence:
+            with self._stage(job, "silence"):
+                regions = find_active_regions(
+                    wav,
+                    sr,
+                    settings.silence_threshold_db,
+                    settings.silence_min_seconds,
+                    settings.silence_padding_seconds,
+                )
+        active = sum(end - start for start, end in regions)
 
-        # Add batch dimension and process
-        ref = wav.mean(0)
-        wav = (wav - ref.mean()) / ref.std()
+        # Segment cache keys are computed from the input as decoded
+        raw = wav
 
-        asyncio.run(
-            task_manager.update_task(
-                task_id,
-                progress=0.3,
-                message="Separating sources (this may take a few minutes)...",
-            )
-        )
+        with self._stage(job, "normalize"):
+            # Move audio to device
+            wav = wav.to(self.device)
+
+            ref = wav.mean(0)
+            wav = (wav - ref.mean()) / ref.std()
+
+        job.progress(0.3, "Separating sources (this may take a few minutes)...")
 
         # Apply model
-        with torch.no_grad():
-            sources = apply_model(
-                self.model,
-                wav.unsqueeze(0),
-                device=self.device,
-                shifts=1,
-                split=True,
-                overlap=0.25,
-                progress=False,
-            )[0]
+        inference_started = time.perf_counter()
+        with self._stage(job, "inference"), tracer.profile(), torch.no_grad():
+            cache = {"model_name": model_name, "raw": raw, "scale": float(ref.std())}
+            if regions == [(0, length)]:
+                sources, reused = self._apply_segmented(job, model, wav, **cache)
+            else:
+                sources, reused = self._apply_active(job, model, wav, regions, **cache)
+        inference_seconds = time.perf_counter() - inference_started
+
+        # Time saved, assuming skipped and reused audio would have been
+        # inferred at the same speed as the rest
+        skipped = (length - active) / sr
+        inferred = (active - reused) / sr
+        saved = inference_seconds / inferred * (skipped + reused / sr) if inferred > 0 else 0.0
+        if skipped > 0:
+            SEPARATION_SKIPPED_SECONDS.inc(skipped)
+        if saved > 0:
+            SEPARATION_SAVED_SECONDS.inc(saved)
 
         # Restore original scale
         sources = sources * ref.std() + ref.mean()
 
-        asyncio.run(
-            task_manager.update_task(
-                task_id,
-                progress=0.8,
-                message="Saving separated tracks...",
-            )
-        )
+        job.progress(0.8, "Saving separated tracks...")
 
         # Get stem names from model
         # htdemucs has: drums, bass, other, vocals
-        stem_names = self.model.sources
+        stem_names = model.sources
 
-        # Save each stem
+        # Save each stem as raw PCM, it is encoded on first download
         result = {}
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        for i, stem_name in enumerate(stem_names):
-            # Generate file ID for this stem
-            stem_file_id = f"{input_path.stem}_{stem_name}"
-            stem_path = output_dir / f"{stem_file_id}.mp3"
-
-            # Get the separated source
-            source = sources[i].cpu()
-
-            # Save as MP3 using torchaudio
-            torchaudio.save(
-                str(stem_path),
-                source,
-                sr,
-                format="mp3",
-                bits_per_sample=320,
-            )
+        try:
+            with self._stage(job, "store"):
+                for i, stem_name in enumerate(stem_names):
+                    job.check()
 
-            result[stem_name] = stem_file_id
+                    # Generate file ID for this stem
+                    stem_file_id = f"{input_path.stem}_{stem_name}"
 
-        asyncio.run(
-            task_manager.update_task(
-                task_id,
-                progress=0.95,
-                message="Finalizing...",
-            )
-        )
+                    # Get the separated source
+                    source = sources[i].cpu()
 
+                    result[stem_name] = stem_file_id
+                    stem_store.write(stem_file_id, source, sr)
+        except BaseException:
+            # No half-written set of stems is left behind
+            for stem_file_id in result.values():
+                stem_store.delete(stem_file_id)
+            raise
+
+        job.progress(0.95, "Finalizing...")
+
+        result["skipped_seconds"] = round(skipped, 2)
+        result["reused_seconds"] = round(reused / sr, 2)
+        result["saved_seconds"] = round(saved, 2)
         return result
 
     async def separate_audio(
@@ -172,7 +593,8 @@ class DemucsService:
         file_id: str,
         model_name: str = "htdemucs",
         task_id: Optional[str] = None,
-    ) -> Dict[str, str]:
+        job: Optional[JobContext] = None,
+    ) -> Dict[str, Any]:
         """
         Separate audio into stems (async wrapper)
 
@@ -180,30 +602,95 @@ class DemucsService:
             file_id: ID of the uploaded audio file
             model_name: Demucs model to use
             task_id: Task ID for progress tracking
+            job: Context to run under instead of the task's, e.g. for
+                speculative work outside of any task
 
         Returns:
-            Dictionary mapping stem names to file IDs
+            Stem names mapped to file IDs, plus skipped_seconds (silent audio
+            not separated), reused_seconds (audio taken from the segment
+            cache) and saved_seconds (estimated inference time saved)
         """
         # Get input file path
-        input_path = storage_service.get_file_path(file_id, directory="upload")
+        input_path = await storage_service.get_file_path(file_id, directory="upload", fetch=False)
         if not input_path:
             raise FileNotFoundError(f"File {file_id} not found")
 
         # Output directory
         output_dir = storage_service.processed_dir
 
-        # Run separation in thread pool (blocking operation)
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            self.executor,
-            self._separate_sync,
-            input_path,
-            output_dir,
-            model_name,
-            task_id,
-        )
+        if job is None:
+            job = task_manager.job_context(task_id)
+        job.on_stage = _observe_stage
+        started = time.time()
 
-        return result
+        # The deadline scales with the track length, without one only
+        # stalls are detected
+        metadata = await storage_service.get_audio_metadata(input_path)
+        preset = f"separate:{model_name}:{settings.separation_executor}"
+
+        async with watchdog.guard(
+            task_id,
+            preset,
+            metadata.get("duration") or None,
+            stall_seconds=settings.job_stall_timeout_seconds,
+        ) as arm, resources.inference_job() as slot:
+            job.on_start = arm
+
+            if self.process_pool is not None:
+                try:
+                    with EXECUTOR_ACTIVE_WORKERS.track_inprogress(), tracer.span("process_pool.run"):
+                        result = await self.process_pool.run(
+                            run_separation_job,
+                            input_path,
+                            output_dir,
+                            model_name,
+                            slot.threads,
+                            token=job.token,
+                            on_progress=job.on_progress,
+                            on_stage=job.on_stage,
+                            on_start=job.on_start,
+                        )
+                except BaseException:
+                    # A killed worker had no chance to clean up after itself
+                    stem_store.remove_partial(file_id, started)
+                    raise
+            else:
+                # Run separation in thread pool (blocking operation), carrying
+                # the trace context over to the worker thread
+                loop = asyncio.get_event_loop()
+                with tracer.span("executor.submit"):
+                    context = contextvars.copy_context()
+                    future = self.executor.submit(
+                        context.run,
+                        self._separate_sync,
+                        job,
+                        input_path,
+                        output_dir,
+                        model_name,
+                    )
+                    try:
+                        result = await asyncio.wrap_future(future)
+                    except asyncio.CancelledError:
+                        # Queued jobs are dropped, running ones stop at their
+                        # next check unless they are stuck in a blocking call.
+                        # Until then the thread still takes cores and memory
+                        if not future.done():
+                            resources.inference.hold(future)
+                            loop.call_later(
+                                settings.job_kill_grace_seconds, self._report_stuck, future
+                            )
+                        raise
+
+            # Only separated audio counts towards the real-time factor and
+            # the throughput of this concurrency level
+            inferred = (
+                (metadata.get("duration") or 0.0)
+                - result.get("skipped_seconds", 0.0)
+                - result.get("reused_seconds", 0.0)
+            )
+            arm.record(inferred)
+            slot.record(inferred)
+            return result
 
 
 # Global instance
@@ -0,0 +1,278 @@
+"""Track description with Google Gemini
+
+Gemini never receives the uploaded file. Each request carries the local
+analysis (tempo, key, loudness, energy curve) and a short mono excerpt of
+the most energetic section, encoded as low-rate FLAC. Calls go through one
+shared HTTP connection pool with a concurrency limit and timeouts, and
+responses are cached on disk by (content hash, prompt version), so a track
+is described at most once per prompt revision. The API base URL is a
+setting, which lets tests point the client at a local stub server.
+"""
+
+import asyncio
+import base64
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.core.exceptions import ExternalServiceError
+from app.core.executors import executors
+from app.core.tracing import tracer
+from app.services.encoder import iter_encode
+from app.services.prefetcher import prefetcher
+from app.services.resampler import resampler
+from app.services.storage_service import storage_service
+from app.services.task_manager import task_manager
+
+
+# Bump when PROMPT or the payload changes, old cache entries are ignored
+PROMPT_VERSION = 1
+
+PROMPT = """You are a music analyst. Describe the track from the measured
+features and the audio excerpt below. Answer with a JSON object with the keys
+"genre" (string), "subgenres" (list of strings), "mood" (list of strings),
+"instruments" (list of strings), "vocals" (boolean) and "description"
+(one or two sentences). Use the measured tempo and key, do not guess them."""
+
+EXCERPT_SAMPLE_RATE = 16000
+
+# Status codes worth retrying after a short pause
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class GeminiService:
+    """Client for track descriptions from the Gemini API"""
+
+    def __init__(self):
+        self.cache_dir = storage_service.processed_dir / "gemini"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Content hash -> in-flight request, concurrent callers share it
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def cache_path(self, content_hash: str) -> Path:
+        """Path of the cached description of some content"""
+        return self.cache_dir / f"{content_hash}.p{PROMPT_VERSION}.json"
+
+    def _get_client(self):
+        """Create the shared connection pool on first use"""
+        if self._client is None:
+            import httpx
+
+            limit = settings.gemini_max_concurrency
+            self._client = httpx.AsyncClient(
+                base_url=settings.gemini_api_base,
+                limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+                timeout=httpx.Timeout(settings.gemini_timeout_seconds, connect=5.0),
+            )
+            self._semaphore = asyncio.Semaphore(limit)
+        return self._client
+
+    async def close(self):
+        """Close the connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_cached(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a previous description of a file without calling the API
+
+        Args:
+            file_id: ID of the uploaded audio file
+
+        Returns:
+            Description, or None if the file was not described yet
+        """
+        digest = await storage_service.get_content_hash(file_id)
+        if not digest:
+            return None
+        return await executors.run("fs", storage_service.read_json, self.cache_path(digest))
+
+    def _excerpt(self, input_path: Path, start: float) -> bytes:
+        """
+        Encode a short mono excerpt as FLAC (runs in thread pool)
+
+        Args:
+            input_path: Path to input audio file
+            start: Excerpt start in seconds
+
+        Returns:
+            FLAC bytes
+        """
+        length = int(settings.gemini_excerpt_seconds * EXCERPT_SAMPLE_RATE)
+        skip = int(start * EXCERPT_SAMPLE_RATE)
+        parts = []
+        collected = 0
+
+        # Decoding stops as soon as the excerpt is complete
+        for chunk in resampler.stream(storage_service.input_source(input_path), EXCERPT_SAMPLE_RATE):
+            mono = chunk.numpy().mean(axis=0)
+            if skip >= len(mono):
+                skip -= len(mono)
+                continue
+            mono = mono[skip:skip + length - collected]
+            skip = 0
+            parts.append(mono)
+            collected += len(mono)
+            if collected >= length:
+                break
+
+        if not parts:
+            return b""
+        excerpt = np.concatenate(parts).astype(np.float32)[:, None]
+        return b"".join(iter_encode([excerpt], EXCERPT_SAMPLE_RATE, 1, len(excerpt), "flac"))
+
+    def _features(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Compact feature summary sent instead of the audio"""
+        return {
+            "duration_seconds": analysis["duration"],
+            "tempo_bpm": analysis["tempo"]["bpm"],
+            "key": analysis["key"]["name"] if analysis["key"] else None,
+            "integrated_loudness_lufs": analysis["loudness"]["integrated_lufs"],
+            "section_energy_db": [
+                [section["start"], section["energy_db"]] for section in analysis["sections"]
+            ],
+        }
+
+    async def _request(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """POST generateContent with bounded concurrency and retries"""
+        import httpx
+
+        client = self._get_client()
+        url = f"/v1beta/models/{settings.gemini_model}:generateContent"
+        # A header, not the query string, which proxies and access logs record
+        headers = {"x-goog-api-key": settings.google_api_key}
+
+        for attempt in range(settings.gemini_max_retries + 1):
+            async with self._semaphore:
+                try:
+                    response = await client.post(url, headers=headers, json=body)
+                except httpx.TimeoutException:
+                    response = None
+                except httpx.HTTPError as e:
+                    raise ExternalServiceError(f"Gemini request failed: {e}")
+
+            if response is None:
+                if attempt < settings.gemini_max_retries:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                raise ExternalServiceError("Gemini request timed out")
+            if response.status_code in RETRY_STATUS and attempt < settings.gemini_max_retries:
+                await asyncio.sleep(2 ** attempt)
+                continue
+            if response.status_code != 200:
+                raise ExternalServiceError(
+                    f"Gemini returned {response.status_code}: {response.text[:200]}"
+                )
+            break
+
+        try:
+            text = response.json()["candidates"][0]["content"]["parts"][0]["text"]
+            return json.loads(text)
+        except (KeyError, IndexError, ValueError) as e:
+            raise ExternalServiceError(f"Unexpected Gemini response: {e}")
+
+    async def _describe(
+        self,
+        file_id: str,
+        input_path: Path,
+        digest: str,
+        task_id: Optional[str],
+    ) -> Dict[str, Any]:
+        """Analyse locally, build the compact payload, call the API and cache the answer"""
+        analysis = await prefetcher.analyze(file_id)
+
+        parts = [
+            {"text": PROMPT},
+            {"text": json.dumps(self._features(analysis))},
+        ]
+
+        if settings.gemini_excerpt_seconds > 0:
+            if task_id:
+                await task_manager.update_task(task_id, progress=0.5, message="Preparing excerpt...")
+
+            # Start the excerpt at the loudest section
+            sections = analysis["sections"]
+            start = max(sections, key=lambda s: s["energy_db"])["start"] if sections else 0.0
+
+            with tracer.span("gemini.excerpt"):
+                excerpt = await executors.run("render", self._excerpt, input_path, start)
+            if excerpt:
+                parts.append({"inline_data": {
+                    "mime_type": "audio/flac",
+                    "data": base64.b64encode(excerpt).decode(),
+                }})
+
+        body = {
+            "contents": [{"role": "user", "parts": parts}],
+            "generationConfig": {
+                "responseMimeType": "application/json",
+                "temperature": 0.2,
+            },
+        }
+
+        if task_id:
+            await task_manager.update_task(task_id, progress=0.7, message="Asking Gemini...")
+        with tracer.span("gemini.request"):
+            description = await self._request(body)
+
+        result = {
+            "prompt_version": PROMPT_VERSION,
+            "model": settings.gemini_model,
+            "analysis": self._features(analysis),
+            "description": description,
+        }
+
+        await executors.run("fs", storage_service.write_json, self.cache_path(digest), result)
+
+        return result
+
+    async def describe(
+        self,
+        file_id: str,
+        task_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Describe an uploaded file, or return its cached description
+
+        Args:
+            file_id: ID of the uploaded audio file
+            task_id: Task ID for progress tracking
+
+        Returns:
+            Description with the features it was based on
+
+        Raises:
+            FileNotFoundError: If the file does not exist
+            ExternalServiceError: If the API is not configured or fails
+        """
+        input_path = await storage_service.get_file_path(file_id, directory="upload", fetch=False)
+        if not input_path:
+            raise FileNotFoundError(f"File {file_id} not found")
+
+        cached = await self.get_cached(file_id)
+        if cached:
+            return cached
+
+        if not settings.google_api_key:
+            raise ExternalServiceError("GOOGLE_API_KEY is not configured")
+
+        # Identical tracks described concurrently share one API call, which
+        # finishes and gets cached even if the caller that started it goes away
+        digest = await storage_service.get_content_hash(file_id)
+        future = self._pending.get(digest)
+        if future is None:
+            future = asyncio.ensure_future(self._describe(file_id, input_path, digest, task_id))
+            self._pending[digest] = future
+            future.add_done_callback(lambda _: self._pending.pop(digest, None))
+
+        return await asyncio.shield(future)
+
+
+# Global instance
+gemini_service = GeminiService()
@@ -0,0 +1,277 @@
+"""Local repository of Demucs models in a memory-mappable format
+
+demucs.pretrained.get_model downloads weights on first use, and every
+process then unpickles its own copy into private memory. Models imported
+here (python -m app.tools.import_model) are stored as
+
+    {repo}/{model}/manifest.json   classes, constructor arguments, tensor table
+    {repo}/{model}/weights.bin     raw little-endian tensors, 64-byte aligned
+
+Loading maps weights.bin copy-on-write and hands the mapped tensors to
+the model as its parameters, without copying them. Every process that
+loads a model therefore shares one page-cached copy of the weights, and
+nothing is fetched over the network. The content hash of weights.bin is
+recorded at import and checked on every load.
+"""
+
+import json
+from fractions import Fraction
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.core.exceptions import ModelRepositoryError
+from app.core.hashing import file_content_hash
+
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+WEIGHTS_NAME = "weights.bin"
+ALIGNMENT = 64
+
+# Stored tensor dtypes; others (e.g. bfloat16) are converted to float32
+DTYPES = {
+    "float32": "<f4",
+    "float16": "<f2",
+    "float64": "<f8",
+    "int64": "<i8",
+    "int32": "<i4",
+    "uint8": "u1",
+    "bool": "?",
+}
+
+
+def _encode(value: Any) -> Any:
+    """JSON encoding of constructor arguments"""
+    if isinstance(value, Fraction):
+        return {"__fraction__": [value.numerator, value.denominator]}
+    if isinstance(value, tuple):
+        return [_encode(v) for v in value]
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise ModelRepositoryError(f"Cannot store constructor argument {value!r}")
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "__fraction__" in value:
+            return Fraction(*value["__fraction__"])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _import_class(path: str):
+    import importlib
+
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class ModelRepository:
+    """Imports, verifies and loads models in a local directory"""
+
+    def __init__(self, root: Optional[Path]):
+        self.root = root
+
+    def path(self, model_name: str) -> Path:
+        """Directory of a model"""
+        if self.root is None:
+            raise ModelRepositoryError("No model repository configured (DEMUCS_REPO_DIR)")
+        return self.root / model_name
+
+    def has(self, model_name: str) -> bool:
+        """Whether a model has been imported"""
+        return self.root is not None and (self.path(model_name) / MANIFEST_NAME).exists()
+
+    def list(self) -> List[str]:
+        """Names of the imported models"""
+        if self.root is None or not self.root.exists():
+            return []
+        return sorted(p.parent.name for p in self.root.glob(f"*/{MANIFEST_NAME}"))
+
+    def manifest(self, model_name: str) -> Dict[str, Any]:
+        """Read a model's manifest"""
+        path = self.path(model_name) / MANIFEST_NAME
+        try:
+            manifest = json.loads(path.read_text())
+        except FileNotFoundError:
+            raise ModelRepositoryError(f"Model {model_name} is not in the repository")
+        if manifest.get("format") != FORMAT_VERSION:
+            raise ModelRepositoryError(
+                f"Model {model_name} has format {manifest.get('format')}, re-import it"
+            )
+        return manifest
+
+    def verify(self, model_name: str) -> Dict[str, Any]:
+        """
+        Check a model's weights against the hash recorded at import
+
+        Args:
+            model_name: Model name
+
+        Returns:
+            The manifest
+
+        Raises:
+            ModelRepositoryError: If the model is missing or corrupted
+        """
+        manifest = self.manifest(model_name)
+        weights = self.path(model_name) / WEIGHTS_NAME
+        if not weights.exists() or weights.stat().st_size != manifest["size"]:
+            raise ModelRepositoryError(f"Weights of {model_name} are missing or truncated")
+        if file_content_hash(weights) != manifest["content_hash"]:
+            raise ModelRepositoryError(f"Weights of {model_name} do not match their checksum")
+        return manifest
+
+    def save(self, model_name: str, model: Any) -> Dict[str, Any]:
+        """
+        Convert a loaded Demucs model (or bag of models) into the repository
+
+        Args:
+            model_name: Name to store the model under
+            model: Model as returned by demucs.pretrained.get_model
+
+        Returns:
+            The written manifest
+        """
+        import torch
+        from demucs.apply import BagOfModels
+
+        directory = self.path(model_name)
+        directory.mkdir(parents=True, exist_ok=True)
+        members = list(model.models) if isinstance(model, BagOfModels) else [model]
+
+        tmp_weights = directory / f"{WEIGHTS_NAME}.tmp"
+        entries = []
+        offset = 0
+        with open(tmp_weights, "wb") as f:
+            for member in members:
+                args, kwargs = member._init_args_kwargs
+                tensors = {}
+                for name, tensor in member.state_dict().items():
+                    tensor = tensor.detach().cpu()
+                    dtype = str(tensor.dtype).replace("torch.", "")
+                    if dtype not in DTYPES:
+                        tensor, dtype = tensor.float(), "float32"
+                    data = tensor.contiguous().numpy().astype(DTYPES[dtype], copy=False)
+
+                    padding = -offset % ALIGNMENT
+                    f.write(b"\0" * padding)
+                    offset += padding
+                    f.write(data.tobytes())
+                    tensors[name] = {"dtype": dtype, "shape": list(tensor.shape), "offset": offset}
+                    offset += data.nbytes
+
+                segment = getattr(member, "segment", None)
+                entries.append({
+                    "class": f"{type(member).__module__}:{type(member).__qualname__}",
+                    "args": _encode(list(args)),
+                    "kwargs": _encode(dict(kwargs)),
+                    "segment": _encode(Fraction(segment) if segment is not None else None),
+                    "tensors": tensors,
+                })
+
+        manifest = {
+            "format": FORMAT_VERSION,
+            "name": model_name,
+            "torch": torch.__version__,
+            "bag_weights": model.weights if isinstance(model, BagOfModels) else None,
+            "models": entries,
+            "size": offset,
+            "content_hash": file_content_hash(tmp_weights),
+        }
+
+        # Weights first, the manifest marks the import as complete
+        tmp_weights.replace(directory / WEIGHTS_NAME)
+        tmp_manifest = directory / f"{MANIFEST_NAME}.tmp"
+        tmp_manifest.write_text(json.dumps(manifest, indent=1))
+        tmp_manifest.replace(directory / MANIFEST_NAME)
+        return manifest
+
+    def _map_tensors(self, weights: np.memmap, table: Dict[str, Any]) -> Dict[str, Any]:
+        import torch
+
+        tensors = {}
+        for name, entry in table.items():
+            dtype = np.dtype(DTYPES[entry["dtype"]])
+            count = int(np.prod(entry["shape"], dtype=np.int64))
+            view = np.ndarray(
+                entry["shape"], dtype=dtype, buffer=weights, offset=entry["offset"]
+            ) if count else np.zeros(entry["shape"], dtype=dtype)
+            tensors[name] = torch.from_numpy(view)
+        return tensors
+
+    def _assign(self, module: Any, tensors: Dict[str, Any]):
+        """Make the mapped tensors the module's parameters and buffers, no copies"""
+        import torch
+
+        expected = set(module.state_dict())
+        if expected != set(tensors):
+            missing = sorted(expected - set(tensors))
+            unexpected = sorted(set(tensors) - expected)
+            raise ModelRepositoryError(
+                f"Tensor table does not match the model (missing {missing[:3]}, "
+                f"unexpected {unexpected[:3]})"
+            )
+
+        for name, tensor in tensors.items():
+            path, _, leaf = name.rpartition(".")
+            owner = module.get_submodule(path) if path else module
+            if leaf in owner._parameters:
+                owner._parameters[leaf] = torch.nn.Parameter(tensor, requires_grad=False)
+            else:
+                owner._buffers[leaf] = tensor
+
+    def load(self, model_name: str, verify: bool = True) -> Any:
+        """
+        Load a model with its weights mapped from the repository
+
+        Args:
+            model_name: Model name
+            verify: Check the weights' content hash first
+
+        Returns:
+            Model in eval mode, ready for apply_model
+
+        Raises:
+            ModelRepositoryError: If the model is missing or corrupted
+        """
+        from demucs.apply import BagOfModels
+
+        manifest = self.verify(model_name) if verify else self.manifest(model_name)
+        weights_path = self.path(model_name) / WEIGHTS_NAME
+        # Copy-on-write: pages come from the shared page cache until written
+        weights = np.memmap(weights_path, dtype=np.uint8, mode="c")
+
+        members = []
+        for entry in manifest["models"]:
+            klass = _import_class(entry["class"])
+            member = klass(*_decode(entry["args"]), **_decode(entry["kwargs"]))
+            self._assign(member, self._map_tensors(weights, entry["tensors"]))
+            if entry["segment"] is not None:
+                member.segment = _decode(entry["segment"])
+            members.append(member)
+
+        if manifest["bag_weights"] is not None:
+            model = BagOfModels(members, weights=manifest["bag_weights"])
+        else:
+            model = members[0]
+        model.eval()
+        return model
+
+    def describe(self, model_name: str) -> Tuple[int, int]:
+        """Number of member models and weight bytes of an imported model"""
+        manifest = self.manifest(model_name)
+        return len(manifest["models"]), manifest["size"]
+
+
+# Global instance
+model_repository = ModelRepository(settings.demucs_repo_dir)
@@ -0,0 +1,158 @@
+"""Pitch transposition and tempo change service (Rubber Band)"""
+
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.config import settings
+from app.core.executors import executors
+from app.core.jobs import JobContext
+from app.core.tracing import tracer
+from app.services.prefetcher import prefetcher
+from app.services.resampler import resampler
+from app.services.storage_service import storage_service
+from app.services.task_manager import task_manager
+from app.services.watchdog import watchdog
+
+
+class PitchTempoService:
+    """Service for transposing pitch and changing tempo with pyrubberband"""
+
+    def _process_sync(
+        self,
+        job: JobContext,
+        input_path: Path,
+        output_path: Path,
+        semitones: Optional[int] = None,
+        tempo_factor: Optional[float] = None,
+    ) -> Dict[str, str]:
+        """
+        Synchronous pitch/tempo processing (runs in thread pool)
+
+        Args:
+            job: Progress reporting and cancellation of the task
+            input_path: Path to input audio file
+            output_path: Path of the processed MP3
+            semitones: Semitones to transpose by
+            tempo_factor: Tempo multiplier
+
+        Returns:
+            Dictionary with the processed file ID
+        """
+        import pyrubberband as pyrb
+        import torch
+        import torchaudio
+
+        job.start()
+        with tracer.span("executor.run"):
+            job.progress(0.1, "Loading audio file...")
+
+            with tracer.span("pitch_tempo.decode"):
+                wav, sr = resampler.load(
+                    storage_service.input_source(input_path), settings.pitch_tempo_sample_rate
+                )
+
+            job.progress(0.3, "Processing audio with Rubber Band...")
+
+            # Rubber Band expects (time, channels)
+            y = wav.numpy().T
+            with tracer.span("pitch_tempo.process"):
+                if semitones:
+                    y = pyrb.pitch_shift(y, sr, semitones)
+                    job.check()
+                if tempo_factor and tempo_factor != 1.0:
+                    y = pyrb.time_stretch(y, sr, tempo_factor)
+
+            job.progress(0.8, "Saving processed track...")
+
+            with tracer.span("pitch_tempo.encode"):
+                try:
+                    torchaudio.save(
+                        str(output_path),
+                        torch.from_numpy(y.T.copy()).float(),
+                        sr,
+                        format="mp3",
+                    )
+                except BaseException:
+                    output_path.unlink(missing_ok=True)
+                    raise
+                storage_service.publish(output_path)
+
+        return {"file_id": output_path.stem}
+
+    async def _process(
+        self,
+        file_id: str,
+        suffix: str,
+        task_id: Optional[str],
+        **params,
+    ) -> Dict[str, str]:
+        """Resolve paths and run processing in the thread pool"""
+        input_path = await storage_service.get_file_path(file_id, directory="upload", fetch=False)
+        if not input_path:
+            raise FileNotFoundError(f"File {file_id} not found")
+
+        output_path = await storage_service.get_processed_path(file_id, suffix)
+        job = task_manager.job_context(task_id)
+        metadata = await storage_service.get_audio_metadata(input_path)
+
+        # Rubber Band runs as one blocking call, so only the deadline applies.
+        # Without a known duration there is none, and stalls are detected
+        # instead
+        preset = "transpose" if params.get("semitones") else "tempo"
+        duration = metadata.get("duration") or None
+        stall_seconds = None if duration else settings.job_stall_timeout_seconds
+        async with prefetcher.foreground(), watchdog.guard(
+            task_id, preset, duration, stall_seconds=stall_seconds
+        ) as arm:
+            job.on_start = arm
+
+            with tracer.span("executor.submit"):
+                return await executors.run(
+                    "render", self._process_sync, job, input_path, output_path, **params
+                )
+
+    async def transpose_audio(
+        self,
+        file_id: str,
+        semitones: int,
+        task_id: Optional[str] = None,
+    ) -> Dict[str, str]:
+        """
+        Transpose audio pitch
+
+        Args:
+            file_id: ID of the uploaded audio file
+            semitones: Number of semitones (-12 to +12)
+            task_id: Task ID for progress tracking
+
+        Returns:
+            Dictionary with the processed file ID
+        """
+        return await self._process(
+            file_id, f"transpose_{semitones}", task_id, semitones=semitones
+        )
+
+    async def change_tempo(
+        self,
+        file_id: str,
+        tempo_factor: float,
+        task_id: Optional[str] = None,
+    ) -> Dict[str, str]:
+        """
+        Change audio tempo without changing pitch
+
+        Args:
+            file_id: ID of the uploaded audio file
+            tempo_factor: Tempo multiplier (0.5x to 2.0x)
+            task_id: Task ID for progress tracking
+
+        Returns:
+            Dictionary with the processed file ID
+        """
+        return await self._process(
+            file_id, f"tempo_{tempo_factor:g}", task_id, tempo_factor=tempo_factor
+        )
+
+
+# Global instance
+pitch_tempo_service = PitchTempoService()
@@ -0,0 +1,314 @@
+"""Speculative processing of fresh uploads while the server is idle
+
+Almost every upload is followed by a request to separate it. While no
+real job runs in this process, the prefetcher starts low-priority work
+on the newest upload: its analysis and, with settings.prefetch_separation,
+its separation with settings.prefetch_model. Real jobs always win. Each
+one that starts preempts all speculative work through its CancelToken:
+a thread stops at its next segment, a worker process is killed, and the
+upload goes back in the queue until the server is idle again.
+
+A later request for the same work adopts it instead of starting over.
+It waits for the running speculation, with the speculation's progress
+mirrored into its own task, or takes the finished result right away.
+Adopted work is no longer speculative and is not preempted, and the
+watchdog holds it to the adopting task's deadline. Speculative
+separations also fill the segment cache, so a request that lands in
+another worker process reads most segments back instead of inferring them.
+"""
+
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.core.exceptions import TaskCancelledError
+from app.core.executors import executors
+from app.core.jobs import CancelToken, JobContext
+from app.core.metrics import PREFETCH_ADOPTIONS, PREFETCH_JOBS
+from app.services.analysis_service import analysis_service
+from app.services.demucs_service import demucs_service
+from app.services.stem_store import stem_store
+from app.services.storage_service import storage_service
+from app.services.task_manager import task_manager
+from app.services.watchdog import watchdog
+
+
+# Finished speculative separations kept for adoption
+MAX_RESULTS = 64
+
+
+class Speculation:
+    """One speculative job on an upload"""
+
+    def __init__(self, kind: str, file_id: str, model_name: Optional[str] = None):
+        self.kind = kind
+        self.file_id = file_id
+        self.model_name = model_name
+        self.token = CancelToken()
+        self.task: Optional[asyncio.Task] = None
+        self.adopted = False
+        self.progress = 0.0
+        self.message = "Queued"
+        # Progress callbacks of the tasks that adopted this job
+        self.listeners: List[Callable[[float, str], None]] = []
+
+    @property
+    def key(self) -> Tuple[str, str, Optional[str]]:
+        return (self.kind, self.file_id, self.model_name)
+
+    def on_progress(self, progress: float, message: str):
+        """Record progress and pass it on, safe to call from worker threads"""
+        self.progress, self.message = progress, message
+        for listener in list(self.listeners):
+            listener(progress, message)
+
+    def job(self) -> JobContext:
+        return JobContext(self.token, self.on_progress)
+
+
+class Prefetcher:
+    """Runs speculative jobs on idle time and hands them to real requests"""
+
+    def __init__(self):
+        # Uploads waiting for idle time, newest last
+        self.pending: "OrderedDict[str, None]" = OrderedDict()
+        self.running: Dict[Tuple, Speculation] = {}
+        # Finished separations by (kind, file_id, model_name), oldest first
+        self.results: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._foreground = 0
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def idle(self) -> bool:
+        """No real job is running in this process"""
+        return self._foreground == 0
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def submit(self, file_id: str):
+        """
+        Queue a fresh upload for speculative processing
+
+        Args:
+            file_id: ID of the uploaded audio file
+        """
+        if not settings.prefetch_enabled:
+            return
+        self.pending[file_id] = None
+        self.pending.move_to_end(file_id)
+        while len(self.pending) > max(1, settings.prefetch_queue_size):
+            self.pending.popitem(last=False)
+        self._wake()
+
+    def preempt(self):
+        """Stop all speculative jobs nobody has adopted"""
+        for spec in list(self.running.values()):
+            if not spec.adopted:
+                spec.token.cancel(TaskCancelledError("Preempted by a foreground job"))
+
+    @asynccontextmanager
+    async def foreground(self):
+        """Mark a real job as running for the duration of the block"""
+        self._foreground += 1
+        self.preempt()
+        try:
+            yield
+        finally:
+            self._foreground -= 1
+            if self.idle:
+                self._wake()
+
+    async def run(self):
+        """Start speculative jobs whenever the server is idle, runs until cancelled"""
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.pending and self.idle:
+                    file_id, _ = self.pending.popitem(last=True)
+                    await self._speculate(file_id)
+        finally:
+            self.preempt()
+
+    async def _speculate(self, file_id: str):
+        """Run the speculative jobs of one upload that are not done yet"""
+        specs = []
+        if await analysis_service.get_cached(file_id) is None:
+            specs.append(Speculation("analysis", file_id))
+        if settings.prefetch_separation:
+            spec = Speculation("separation", file_id, settings.prefetch_model)
+            if spec.key not in self.results:
+                specs.append(spec)
+
+        for spec in specs:
+            if spec.key in self.running:
+                continue
+            self.running[spec.key] = spec
+            spec.task = asyncio.create_task(self._run(spec))
+
+        await asyncio.gather(*(spec.task for spec in specs if spec.task), return_exceptions=True)
+
+    async def _run(self, spec: Speculation) -> Dict[str, Any]:
+        try:
+            if spec.kind == "analysis":
+                result = await analysis_service.analyze(spec.file_id, job=spec.job())
+            else:
+                self._forget_other_models(spec.file_id, spec.model_name)
+                result = await demucs_service.separate_audio(
+                    spec.file_id, model_name=spec.model_name, job=spec.job()
+                )
+                self._remember(spec.key, result)
+            PREFETCH_JOBS.labels(kind=spec.kind, outcome="completed").inc()
+            return result
+        except TaskCancelledError:
+            PREFETCH_JOBS.labels(kind=spec.kind, outcome="preempted").inc()
+            # Retried on the next idle stretch, unless a request took it over
+            if not spec.adopted and spec.file_id not in self.pending:
+                self.pending[spec.file_id] = None
+            raise
+        except Exception as e:
+            PREFETCH_JOBS.labels(kind=spec.kind, outcome="failed").inc()
+            print(f"Speculative {spec.kind} of {spec.file_id} failed: {e}")
+            raise
+        finally:
+            self.running.pop(spec.key, None)
+
+    def _remember(self, key: Tuple, result: Dict[str, Any]):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > MAX_RESULTS:
+            self.results.popitem(last=False)
+
+    def _forget_other_models(self, file_id: str, model_name: str):
+        """
+        Drop finished separations of a file by other models
+
+        Stems are stored per upload whatever the model, so a separation
+        with model_name overwrites the files those results point to.
+        """
+        for key in [k for k in self.results if k[1] == file_id and k[2] != model_name]:
+            del self.results[key]
+
+    def _adopt(self, key: Tuple, task_id: Optional[str]) -> Optional[Speculation]:
+        """Take over a running speculative job on behalf of a task"""
+        spec = self.running.get(key)
+        if spec is None or spec.task is None or spec.token.cancelled:
+            return None
+        spec.adopted = True
+        PREFETCH_ADOPTIONS.labels(kind=spec.kind, state="running").inc()
+
+        if task_id is not None:
+            job = task_manager.job_context(task_id)
+            if job.on_progress is not None:
+                job.on_progress(spec.progress, spec.message)
+                spec.listeners.append(job.on_progress)
+            # Cancelling or failing the task stops the adopted job too
+            if job.token is not None:
+                job.token.add_callback(lambda: spec.token.cancel(job.token.error))
+        return spec
+
+    async def _watch_adopted(
+        self,
+        spec: Speculation,
+        task_id: Optional[str],
+        preset: str,
+        stall_seconds: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Wait for an adopted job under the watchdog of the adopting task"""
+        input_path = await storage_service.get_file_path(
+            spec.file_id, directory="upload", fetch=False
+        )
+        metadata = await storage_service.get_audio_metadata(input_path) if input_path else {}
+
+        async with watchdog.guard(
+            task_id, preset, metadata.get("duration") or None, stall_seconds=stall_seconds
+        ) as watch:
+            # The clock starts once the job reports progress, it may still
+            # be waiting for a worker
+            if spec.progress > 0:
+                watch()
+            else:
+                spec.listeners.append(lambda *_: watch.started is None and watch())
+            try:
+                return await spec.task
+            finally:
+                # Only the rest of the job ran under this watch, so it says
+                # nothing about the preset's real-time factor
+                watch.record(0.0)
+
+    async def _finished(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """Result of a finished speculative separation whose stems still exist"""
+        result = self.results.get(key)
+        if result is None:
+            return None
+        stems = [value for value in result.values() if isinstance(value, str)]
+        if not await executors.run("fs", lambda: all(stem_store.exists(s) for s in stems)):
+            self.results.pop(key, None)
+            return None
+        return result
+
+    async def separate(
+        self,
+        file_id: str,
+        model_name: str = "htdemucs",
+        task_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Separate audio into stems, adopting speculative work when there is some
+
+        Args:
+            file_id: ID of the uploaded audio file
+            model_name: Demucs model to use
+            task_id: Task ID for progress tracking
+
+        Returns:
+            Result of DemucsService.separate_audio
+        """
+        key = ("separation", file_id, model_name)
+        result = await self._finished(key)
+        if result is not None:
+            PREFETCH_ADOPTIONS.labels(kind="separation", state="finished").inc()
+            return result
+
+        spec = self._adopt(key, task_id)
+        async with self.foreground():
+            if spec is not None:
+                return await self._watch_adopted(
+                    spec,
+                    task_id,
+                    f"separate:{model_name}:{settings.separation_executor}",
+                    stall_seconds=settings.job_stall_timeout_seconds,
+                )
+            self._forget_other_models(file_id, model_name)
+            result = await demucs_service.separate_audio(
+                file_id, model_name=model_name, task_id=task_id
+            )
+        # Nothing left to speculate for this separation
+        self._remember(key, result)
+        return result
+
+    async def analyze(self, file_id: str, task_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Analyse an uploaded file, adopting a running speculative analysis
+
+        Args:
+            file_id: ID of the uploaded audio file
+            task_id: Task ID for progress tracking
+
+        Returns:
+            Analysis result
+        """
+        spec = self._adopt(("analysis", file_id, None), task_id)
+        async with self.foreground():
+            if spec is not None:
+                return await self._watch_adopted(spec, task_id, "analysis")
+            return await analysis_service.analyze(file_id, task_id=task_id)
+
+
+# Global instance
+prefetcher = Prefetcher()
@@ -0,0 +1,382 @@
+"""Real-time pitch/tempo preview engine
+
+Rubber Band renders whole files offline, which is too slow to audition
+slider settings. Previews use a lighter block-based engine instead:
+
+    WSOLA      overlap-adds Hann-windowed frames at a fixed synthesis hop,
+               reading the input at hop / stretch. Each frame is shifted
+               within a small tolerance to where it best continues the
+               previous one, which keeps the waveform continuous.
+    resample   reads the stretched signal at the pitch ratio with linear
+               interpolation, which restores the duration and moves pitch.
+
+Stretching by ratio / tempo and then resampling by ratio gives the
+requested tempo and pitch. Both stages keep their state between blocks,
+so parameters can change between any two blocks without a restart.
+The time each block takes is exported as PREVIEW_BLOCK_SECONDS. The
+quality is good enough for choosing settings; the final render still
+goes through Rubber Band.
+
+Decoded PCM is kept in memory per upload, least recently used first,
+up to settings.preview_cache_mb, so seeking and reconnecting do not decode
+the file again.
+"""
+
+import asyncio
+import json
+import struct
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.api.schemas.audio import PreviewParams
+from app.config import settings
+from app.core.executors import executors
+from app.core.metrics import PREVIEW_BLOCK_SECONDS
+from app.services.resampler import resampler
+from app.services.storage_service import storage_service
+
+
+# WSOLA frame length and how far a frame may move to line up with the last
+FRAME_SECONDS = 0.025
+TOLERANCE_SECONDS = 0.006
+
+# Header of every streamed block: track position (s), seek generation
+BLOCK_HEADER = struct.Struct("<dI")
+
+
+class PreviewStream:
+    """Block-by-block pitch and tempo processing of one decoded track"""
+
+    def __init__(
+        self,
+        pcm: np.ndarray,
+        sample_rate: int,
+        position: float = 0.0,
+        semitones: float = 0.0,
+        tempo: float = 1.0,
+    ):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.hop = max(1, int(FRAME_SECONDS * sample_rate) // 2)
+        self.frame = 2 * self.hop
+        self.tolerance = int(TOLERANCE_SECONDS * sample_rate)
+        # Periodic Hann windows at 50% overlap sum to exactly one
+        phase = 2 * np.pi * np.arange(self.frame) / self.frame
+        self.window = (0.5 - 0.5 * np.cos(phase)).astype(np.float32)
+
+        self.set_params(semitones, tempo)
+        self.seek(position)
+
+    @property
+    def channels(self) -> int:
+        return self.pcm.shape[0]
+
+    @property
+    def length(self) -> int:
+        return self.pcm.shape[1]
+
+    @property
+    def position_seconds(self) -> float:
+        """Where in the track the engine is reading"""
+        return min(self.position, self.length) / self.sample_rate
+
+    @property
+    def finished(self) -> bool:
+        """The whole track has been played out"""
+        return self._drained
+
+    def set_params(self, semitones: float, tempo: float):
+        """
+        Change pitch and tempo, effective from the next block
+
+        Args:
+            semitones: Pitch shift in semitones
+            tempo: Tempo factor, 2.0 plays twice as fast
+        """
+        self.semitones = semitones
+        self.tempo = tempo
+        self.ratio = 2.0 ** (semitones / 12.0)
+        self.stretch = self.ratio / tempo
+
+    def seek(self, position: float):
+        """
+        Restart playback at a position
+
+        Args:
+            position: Position in the track, in seconds
+        """
+        self.position = float(min(max(0, int(position * self.sample_rate)), self.length))
+        self._previous = None
+        self._overlap = np.zeros((self.channels, self.frame), dtype=np.float32)
+        # Stretched signal not yet resampled, and the read position in it
+        self._buffered = np.zeros((self.channels, 0), dtype=np.float32)
+        self._phase = 0.0
+        self._drained = False
+
+    def _read(self, start: int, frames: int) -> np.ndarray:
+        """Input frames, zero-padded past the end"""
+        chunk = self.pcm[:, start:start + frames]
+        if chunk.shape[1] < frames:
+            chunk = np.pad(chunk, ((0, 0), (0, frames - chunk.shape[1])))
+        return chunk
+
+    def _align(self, nominal: int) -> int:
+        """Frame start near nominal that best continues the previous frame"""
+        if self._previous is None:
+            return nominal
+
+        low = max(0, nominal - self.tolerance)
+        high = min(nominal + self.tolerance, self.length - self.frame)
+        if high <= low:
+            return nominal
+
+        # The previous frame's natural continuation is what the new frame
+        # overlaps with, compare on the mono mix
+        reference = self._read(self._previous + self.hop, self.hop).mean(axis=0)
+        candidates = self.pcm[:, low:high + self.hop].mean(axis=0)
+        correlation = np.correlate(candidates, reference, mode="valid")
+        return low + int(np.argmax(correlation))
+
+    def _stretch_hop(self) -> np.ndarray:
+        """Time-stretch one synthesis hop"""
+        start = self._align(int(round(self.position)))
+        self._overlap += self._read(start, self.frame) * self.window
+
+        out = self._overlap[:, :self.hop].copy()
+        self._overlap = np.concatenate(
+            (self._overlap[:, self.hop:], np.zeros((self.channels, self.hop), dtype=np.float32)),
+            axis=1,
+        )
+        self._previous = start
+        self.position = min(self.position + self.hop / self.stretch, float(self.length))
+        return out
+
+    def process(self, frames: int) -> np.ndarray:
+        """
+        Produce the next block of output
+
+        Args:
+            frames: Output frames
+
+        Returns:
+            float32 array of shape (channels, frames), silence past the end
+        """
+        needed = int(self._phase + self.ratio * frames) + 2
+        chunks = [self._buffered]
+        available = self._buffered.shape[1]
+        while available < needed:
+            if self.position >= self.length:
+                chunks.append(np.zeros((self.channels, needed - available), dtype=np.float32))
+                self._drained = True
+                break
+            chunk = self._stretch_hop()
+            chunks.append(chunk)
+            available += chunk.shape[1]
+        stretched = np.concatenate(chunks, axis=1)
+
+        # Linear interpolation at the pitch ratio
+        positions = self._phase + self.ratio * np.arange(frames)
+        index = positions.astype(np.int64)
+        fraction = (positions - index).astype(np.float32)
+        out = stretched[:, index] * (1.0 - fraction) + stretched[:, index + 1] * fraction
+
+        advance = self._phase + self.ratio * frames
+        consumed = int(advance)
+        self._buffered = stretched[:, consumed:]
+        self._phase = advance - consumed
+        return out
+
+
+class PreviewSession:
+    """
+    Paces one preview stream in real time and applies client changes
+
+    Blocks are produced in the realtime pool and sent at most
+    settings.preview_lead_ms ahead of playback, so a changed setting is
+    heard after that lead plus one block.
+    """
+
+    def __init__(self, stream: PreviewStream):
+        self.stream = stream
+        self.params = PreviewParams(semitones=stream.semitones, tempo=stream.tempo)
+        self.generation = 0
+        self._params: Optional[PreviewParams] = None
+        self._seek: Optional[float] = None
+        self._changed = asyncio.Event()
+
+    def handle(self, text: str):
+        """
+        Apply a client message from the next block on
+
+        Args:
+            text: JSON message, {"type": "params", "semitones", "tempo"}
+                (either may be left out) or {"type": "seek", "position"}
+
+        Raises:
+            ValueError: If the message is malformed or out of range
+        """
+        message = json.loads(text)
+        if not isinstance(message, dict):
+            raise ValueError("Messages must be JSON objects")
+
+        kind = message.get("type")
+        if kind == "params":
+            current = self._params or self.params
+            self._params = PreviewParams(
+                semitones=message.get("semitones", current.semitones),
+                tempo=message.get("tempo", current.tempo),
+            )
+        elif kind == "seek":
+            position = message.get("position")
+            if not isinstance(position, (int, float)) or position < 0:
+                raise ValueError("position must be a number of seconds")
+            self._seek = float(position)
+        else:
+            raise ValueError(f"Unknown message type: {kind}")
+        self._changed.set()
+
+    def _apply(self) -> bool:
+        """Apply pending changes, True on a seek"""
+        if self._params is not None:
+            self.params, self._params = self._params, None
+            self.stream.set_params(self.params.semitones, self.params.tempo)
+        if self._seek is None:
+            return False
+        self.stream.seek(self._seek)
+        self._seek = None
+        self.generation += 1
+        return True
+
+    async def run(
+        self,
+        send_block: Callable[[bytes], Awaitable[Any]],
+        send_event: Callable[[Dict[str, Any]], Awaitable[Any]],
+    ):
+        """
+        Stream blocks until cancelled
+
+        After the end of the track an "end" event is sent, and streaming
+        resumes on the next seek.
+
+        Args:
+            send_block: Sends a binary block (header + int16 PCM)
+            send_event: Sends a JSON event
+        """
+        loop = asyncio.get_running_loop()
+        frames, seconds = preview_service.block_frames()
+        lead = settings.preview_lead_ms / 1000
+        started, sent = loop.time(), 0.0
+        ended = False
+
+        while True:
+            self._changed.clear()
+            if self._apply():
+                # Playback restarts, refill the client's buffer right away
+                started, sent = loop.time(), 0.0
+                ended = False
+
+            if self.stream.finished:
+                if not ended:
+                    await send_event({"type": "end", "generation": self.generation})
+                    ended = True
+                await self._changed.wait()
+                continue
+
+            ahead = sent - (loop.time() - started) - lead
+            if ahead > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), ahead)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            header = BLOCK_HEADER.pack(self.stream.position_seconds, self.generation)
+            block_started = time.perf_counter()
+            block = await executors.run("realtime", self.stream.process, frames)
+            PREVIEW_BLOCK_SECONDS.observe(time.perf_counter() - block_started)
+
+            await send_block(header + preview_service.encode_block(block))
+            sent += seconds
+
+
+class PreviewService:
+    """Decoded PCM cache and preview streams"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # file_id -> decoded PCM, least recently used first
+        self._pcm: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def sample_rate(self) -> int:
+        return settings.preview_sample_rate
+
+    def _decode(self, file_id: str, path: Path) -> np.ndarray:
+        with self._lock:
+            pcm = self._pcm.get(file_id)
+            if pcm is not None:
+                self._pcm.move_to_end(file_id)
+                return pcm
+
+        wav, _ = resampler.load(storage_service.input_source(path), self.sample_rate)
+        pcm = np.ascontiguousarray(wav.numpy(), dtype=np.float32)
+
+        with self._lock:
+            if file_id not in self._pcm:
+                self._pcm[file_id] = pcm
+                self._bytes += pcm.nbytes
+            while self._bytes > self.max_bytes and len(self._pcm) > 1:
+                _, evicted = self._pcm.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return pcm
+
+    async def open(
+        self,
+        file_id: str,
+        position: float = 0.0,
+        semitones: float = 0.0,
+        tempo: float = 1.0,
+    ) -> PreviewStream:
+        """
+        Start a preview of an upload
+
+        Args:
+            file_id: ID of the uploaded audio file
+            position: Start position in seconds
+            semitones: Pitch shift in semitones
+            tempo: Tempo factor
+
+        Returns:
+            PreviewStream positioned at position
+
+        Raises:
+            FileNotFoundError: If the upload does not exist
+        """
+        path = await storage_service.get_file_path(file_id, directory="upload", fetch=False)
+        if not path:
+            raise FileNotFoundError(f"File {file_id} not found")
+
+        pcm = await executors.run("decode", self._decode, file_id, path)
+        return PreviewStream(pcm, self.sample_rate, position, semitones, tempo)
+
+    @staticmethod
+    def encode_block(block: np.ndarray) -> bytes:
+        """Interleaved little-endian int16 PCM of a (channels, frames) block"""
+        pcm = np.clip(np.round(block.T * 32767.0), -32768, 32767).astype("<i2")
+        return pcm.tobytes()
+
+    def block_frames(self) -> Tuple[int, float]:
+        """Frames per streamed block and its duration in seconds"""
+        frames = max(1, int(settings.preview_block_ms / 1000 * self.sample_rate))
+        return frames, frames / self.sample_rate
+
+
+# Global instance
+preview_service = PreviewService(settings.preview_cache_mb * 1024 * 1024)
@@ -0,0 +1,148 @@
+"""Remix service for mixing stored stems with per-stem gains"""
+
+import hashlib
+import json
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from app.config import settings
+from app.services.encoder import iter_encode
+from app.services.stem_store import READ_BLOCK_FRAMES, RawStem, stem_store
+from app.services.storage_service import storage_service
+
+
+class RemixService:
+    """
+    Mixes raw stems block by block into an encoded stream
+
+    Stems are read from their memory maps one block at a time, so neither
+    the input stems nor the mix are ever held in memory at full length.
+    Gain presets requested at least settings.remix_cache_min_requests times
+    are written to disk while streaming and served from there afterwards.
+    """
+
+    def __init__(self):
+        self._requests: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def cache_key(self, file_id: str, gains: Dict[str, float], fmt: str) -> str:
+        """Stable key for a (file, gains, format) preset"""
+        preset = json.dumps(
+            {"file_id": file_id, "gains": {k: round(v, 3) for k, v in sorted(gains.items())}, "format": fmt},
+            sort_keys=True,
+        )
+        return hashlib.sha1(preset.encode()).hexdigest()[:16]
+
+    def cached_path(self, file_id: str, key: str, fmt: str) -> Path:
+        """Path of a cached remix"""
+        return storage_service.processed_dir / f"{file_id}_remix_{key}.{fmt}"
+
+    def resolve_gains(self, file_id: str, gains: Dict[str, float]) -> Dict[str, float]:
+        """
+        Validate gains against the stored stems
+
+        Args:
+            file_id: ID of the original upload
+            gains: Gain per stem name, missing stems default to 1.0
+
+        Returns:
+            Gain for every stored stem
+
+        Raises:
+            FileNotFoundError: If the file has no separated stems
+            ValueError: If gains name a stem that does not exist
+        """
+        stems = stem_store.list_stems(file_id)
+        if not stems:
+            raise FileNotFoundError(f"No separated stems for {file_id}")
+
+        unknown = sorted(set(gains) - set(stems))
+        if unknown:
+            raise ValueError(f"Unknown stems: {', '.join(unknown)}. Available: {', '.join(stems)}")
+
+        return {stem: gains.get(stem, 1.0) for stem in stems}
+
+    def _iter_mix(self, stems: List[RawStem], gains: List[float]) -> Iterator[np.ndarray]:
+        """Yield mixed float32 blocks of shape (frames, channels)"""
+        frames = min(stem.frames for stem in stems)
+        for start in range(0, frames, READ_BLOCK_FRAMES):
+            stop = min(start + READ_BLOCK_FRAMES, frames)
+            mix = np.zeros((stop - start, stems[0].channels), dtype=np.float32)
+            for stem, gain in zip(stems, gains):
+                block = stem.data[start:stop]
+                # Fold the int16 scale into the gain, one multiply-add per stem
+                mix += block * np.float32(gain * stem.scale / 32767.0)
+            yield mix
+
+    def stream_remix(
+        self,
+        file_id: str,
+        gains: Dict[str, float],
+        fmt: str = "mp3",
+    ) -> Iterator[bytes]:
+        """
+        Mix stems and stream the encoded result
+
+        Args:
+            file_id: ID of the original upload
+            gains: Gain for every stem, as returned by resolve_gains
+            fmt: "mp3", "wav" or "flac"
+
+        Returns:
+            Iterator over encoded bytes
+        """
+        key = self.cache_key(file_id, gains, fmt)
+        cached = self.cached_path(file_id, key, fmt)
+        if cached.exists():
+            return self._iter_file(cached)
+
+        active = {stem: gain for stem, gain in gains.items() if gain != 0.0} or gains
+        stems = [stem_store.open(f"{file_id}_{stem}") for stem in active]
+        frames = min(stem.frames for stem in stems)
+        encoded = iter_encode(
+            self._iter_mix(stems, list(active.values())),
+            stems[0].sample_rate,
+            stems[0].channels,
+            frames,
+            fmt,
+        )
+
+        with self._lock:
+            self._requests[key] += 1
+            popular = 0 < settings.remix_cache_min_requests <= self._requests[key]
+        if popular:
+            return self._tee_to_file(encoded, cached)
+        return encoded
+
+    def _iter_file(self, path: Path, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    return
+                yield data
+
+    def _tee_to_file(self, encoded: Iterator[bytes], path: Path) -> Iterator[bytes]:
+        """Stream encoded bytes while saving them, keep the file only if complete"""
+        tmp_path = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp")
+        completed = False
+        try:
+            with open(tmp_path, "wb") as f:
+                for data in encoded:
+                    f.write(data)
+                    yield data
+            completed = True
+        finally:
+            if completed:
+                tmp_path.replace(path)
+            else:
+                tmp_path.unlink(missing_ok=True)
+
+
+# Global instance
+remix_service = RemixService()
@@ -0,0 +1,213 @@
+"""Shared decoding and resampling for all processing paths
+
+Resampling kernels are cached per (source rate, target rate, dtype) and
+applied in chunks, so a 48 kHz or 22.05 kHz upload pays for the kernel
+once per process and never builds a padded full-length copy of the track.
+Where the FFmpeg decoder is available, audio is decoded straight at the
+requested rate and no separate resampling pass is needed.
+
+Sources may be local paths or URLs, e.g. presigned object store URLs
+from StorageService.input_source(), which FFmpeg streams as it decodes.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterator, Optional, Tuple, Union
+
+
+class Resampler:
+    """Decodes audio files and converts between sample rates"""
+
+    def __init__(self, max_kernels: int = 16, chunk_seconds: float = 10.0):
+        self.max_kernels = max_kernels
+        self.chunk_seconds = chunk_seconds
+        # (orig_sr, new_sr, dtype) -> torchaudio.transforms.Resample
+        self._kernels: "OrderedDict[Tuple[int, int, Any], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_kernel(self, orig_sr: int, new_sr: int, dtype: Any) -> Any:
+        """
+        Get a cached resampling kernel
+
+        Args:
+            orig_sr: Source sample rate
+            new_sr: Target sample rate
+            dtype: Torch dtype of the audio
+
+        Returns:
+            torchaudio Resample module with a precomputed kernel
+        """
+        key = (orig_sr, new_sr, dtype)
+        with self._lock:
+            kernel = self._kernels.get(key)
+            if kernel is not None:
+                self._kernels.move_to_end(key)
+                return kernel
+
+        import torchaudio
+
+        kernel = torchaudio.transforms.Resample(orig_sr, new_sr, dtype=dtype)
+
+        with self._lock:
+            self._kernels[key] = kernel
+            while len(self._kernels) > self.max_kernels:
+                self._kernels.popitem(last=False)
+        return kernel
+
+    def resample(self, wav: Any, orig_sr: int, new_sr: int) -> Any:
+        """
+        Resample a waveform chunk by chunk
+
+        Chunks are aligned to the kernel's phase period and carry enough
+        context on each side, so the result matches resampling the whole
+        waveform in one call.
+
+        Args:
+            wav: Tensor of shape (..., time)
+            orig_sr: Source sample rate
+            new_sr: Target sample rate
+
+        Returns:
+            Resampled tensor of shape (..., new_time)
+        """
+        if orig_sr == new_sr:
+            return wav
+
+        import torch
+
+        kernel = self.get_kernel(orig_sr, new_sr, wav.dtype)
+
+        gcd = math.gcd(orig_sr, new_sr)
+        orig, new = orig_sr // gcd, new_sr // gcd
+        length = wav.shape[-1]
+        out_length = -(-new * length // orig)
+
+        # Input samples needed on each side of a chunk, in whole phase periods
+        context = -(-(kernel.width + orig) // orig) * orig
+        block = max(1, int(self.chunk_seconds * orig_sr) // orig) * orig
+
+        out = torch.empty(wav.shape[:-1] + (out_length,), dtype=wav.dtype, device=wav.device)
+        with torch.no_grad():
+            for start in range(0, length, block):
+                stop = min(start + block, length)
+                lo = max(0, start - context)
+                hi = min(length, stop + context)
+
+                chunk = kernel(wav[..., lo:hi])
+
+                skip = (start - lo) // orig * new
+                out_start = start // orig * new
+                out_stop = out_length if stop == length else stop // orig * new
+                out[..., out_start:out_stop] = chunk[..., skip:skip + out_stop - out_start]
+
+        return out
+
+    def decode(self, path: Union[Path, str], sample_rate: Optional[int] = None) -> Tuple[Any, int]:
+        """
+        Decode an audio file, at sample_rate when the decoder supports it
+
+        Args:
+            path: Path or URL of the audio file
+            sample_rate: Desired sample rate, None keeps the native rate
+
+        Returns:
+            Tuple of (waveform of shape (channels, time), sample rate). The
+            rate may differ from sample_rate if direct decoding is unavailable,
+            callers should pass the result through resample() in that case.
+        """
+        if sample_rate is not None:
+            try:
+                return self._decode_ffmpeg(path, sample_rate), sample_rate
+            except (ImportError, OSError, RuntimeError):
+                pass
+
+        import torchaudio
+
+        wav, sr = torchaudio.load(str(path))
+        return wav, sr
+
+    def load(self, path: Union[Path, str], sample_rate: Optional[int] = None) -> Tuple[Any, int]:
+        """
+        Decode an audio file and make sure it is at sample_rate
+
+        Args:
+            path: Path or URL of the audio file
+            sample_rate: Desired sample rate, None keeps the native rate
+
+        Returns:
+            Tuple of (waveform of shape (channels, time), sample rate)
+        """
+        wav, sr = self.decode(path, sample_rate)
+        if sample_rate is not None and sr != sample_rate:
+            wav, sr = self.resample(wav, sr, sample_rate), sample_rate
+        return wav, sr
+
+    def stream(
+        self,
+        path: Union[Path, str],
+        sample_rate: int,
+        chunk_seconds: Optional[float] = None,
+    ) -> Iterator[Any]:
+        """
+        Decode an audio file chunk by chunk at sample_rate
+
+        Args:
+            path: Path or URL of the audio file
+            sample_rate: Output sample rate
+            chunk_seconds: Chunk duration (default: self.chunk_seconds)
+
+        Returns:
+            Iterator over tensors of shape (channels, frames)
+        """
+        frames_per_chunk = int((chunk_seconds or self.chunk_seconds) * sample_rate)
+
+        # FFmpeg may only fail on the first read, e.g. on an unsupported
+        # codec, which still falls back to a full decode
+        try:
+            from torchaudio.io import StreamReader
+
+            reader = StreamReader(str(path))
+            reader.add_basic_audio_stream(
+                frames_per_chunk=frames_per_chunk,
+                sample_rate=sample_rate,
+            )
+            chunks = reader.stream()
+            first = next(chunks, None)
+        except (ImportError, OSError, RuntimeError):
+            chunks = None
+
+        if chunks is not None:
+            while first is not None:
+                (chunk,) = first
+                if chunk is not None:
+                    yield chunk.t()
+                first = next(chunks, None)
+            return
+
+        wav, _ = self.load(path, sample_rate)
+        for start in range(0, wav.shape[-1], frames_per_chunk):
+            yield wav[:, start:start + frames_per_chunk]
+
+    def _decode_ffmpeg(self, path: Union[Path, str], sample_rate: int) -> Any:
+        """Decode with FFmpeg, converting the sample rate inside the decoder"""
+        import torch
+        from torchaudio.io import StreamReader
+
+        reader = StreamReader(str(path))
+        reader.add_basic_audio_stream(
+            frames_per_chunk=int(self.chunk_seconds * sample_rate),
+            sample_rate=sample_rate,
+        )
+
+        chunks = [chunk for (chunk,) in reader.stream() if chunk is not None]
+        if not chunks:
+            raise RuntimeError(f"No audio decoded from {getattr(path, 'name', 'stream')}")
+
+        # Chunks are (frames, channels)
+        return torch.cat(chunks, dim=0).t().contiguous()
+
+
+# Global instance
+resampler = Resampler()
@@ -0,0 +1,178 @@
+"""Cache of separated segments, keyed by their input samples
+
+Demucs segments are inferred independently, so the stems of a segment
+depend only on the model and on the segment's samples. Each segment is
+keyed by a hash of its PCM, quantized to 16 bits. When a track is
+re-uploaded with a new intro or a trimmed ending, the unchanged parts
+decode to the same samples. Their segments are read back instead of
+inferred, as long as the segment grid lands on the same samples; see
+DemucsService._apply_segmented for how the grid is anchored. Stems are
+stored as float16 in the scale of the input. That way they stay valid
+when an edit changes the loudness normalization of the whole track.
+
+Entries are evicted least recently used first once they take more than
+settings.segment_cache_max_mb. A hit refreshes the file mtime, so the
+order survives restarts and is shared by worker processes. Each process
+only knows what it wrote itself since it last indexed the directory, so
+it re-indexes after writing RESCAN_FRACTION of the limit. The directory
+overshoots the limit by at most that much per worker process.
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.config import settings
+from app.core.metrics import SEGMENT_CACHE_BYTES, SEGMENT_CACHE_REQUESTS
+from app.services.storage_service import storage_service
+
+
+# Share of the limit a process writes before it re-indexes the directory
+RESCAN_FRACTION = 1 / 16
+
+class SegmentCache:
+    """Disk cache of per-segment model output with LRU eviction"""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Key -> file size, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._loaded = False
+        # Bytes this process wrote since it last indexed the directory
+        self._unscanned = 0
+        self._lock = threading.Lock()
+
+        SEGMENT_CACHE_BYTES.set_function(lambda: self._bytes)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npy"
+
+    def _load(self):
+        """Index the entries on disk once (called with the lock held)"""
+        if not self._loaded:
+            self._scan()
+
+    def _scan(self):
+        """
+        Index the entries on disk, oldest first (called with the lock held)
+
+        Picks up entries other worker processes wrote or evicted.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        entries = []
+        for path in self.directory.glob("*.npy"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+
+        self._entries.clear()
+        self._bytes = 0
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._bytes += size
+        self._unscanned = 0
+        self._loaded = True
+
+    def key(self, model_name: str, audio: np.ndarray) -> str:
+        """
+        Fingerprint a segment of input
+
+        Args:
+            model_name: Model the segment is separated with
+            audio: Raw (not normalized) samples of shape (channels, frames)
+
+        Returns:
+            Hex key
+        """
+        pcm = np.clip(np.round(audio * 32768.0), -32768, 32767).astype(np.int16)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{model_name}:{pcm.shape[0]}:{pcm.shape[1]}".encode())
+        digest.update(np.ascontiguousarray(pcm).tobytes())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Look up the stems of a segment
+
+        Args:
+            key: Segment key
+
+        Returns:
+            float16 array of shape (sources, channels, frames), or None
+        """
+        path = self._path(key)
+        try:
+            stems = np.load(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            SEGMENT_CACHE_REQUESTS.labels(result="miss").inc()
+            return None
+
+        with self._lock:
+            self._load()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        SEGMENT_CACHE_REQUESTS.labels(result="hit").inc()
+        return stems
+
+    def put(self, key: str, stems: np.ndarray):
+        """
+        Store the stems of a segment and evict old entries over the limit
+
+        Args:
+            key: Segment key
+            stems: Array of shape (sources, channels, frames) in input scale
+        """
+        path = self._path(key)
+        with self._lock:
+            self._load()
+            if key in self._entries:
+                return
+
+        tmp_path = path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, stems.astype(np.float16))
+        size = tmp_path.stat().st_size
+        tmp_path.replace(path)
+
+        evicted = []
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = size
+                self._bytes += size
+                self._unscanned += size
+            # What other processes wrote only shows up on disk
+            if (
+                self._bytes > self.max_bytes
+                or self._unscanned > self.max_bytes * RESCAN_FRACTION
+            ):
+                self._scan()
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append(old)
+
+        for old in evicted:
+            self._path(old).unlink(missing_ok=True)
+
+
+# Global instance
+segment_cache = SegmentCache(
+    storage_service.processed_dir / "segments",
+    settings.segment_cache_max_mb * 1024 * 1024,
+)
@@ -0,0 +1,279 @@
+"""Compact raw stem storage with lazy, cached encoding
+
+Separated stems are stored as interleaved int16 PCM behind a 32 byte
+header, which keeps them at half the size of float32 and lets readers
+memory-map any range of frames. A stem is encoded to MP3/WAV/FLAC only
+the first time it is downloaded in that format, the encoded file then
+sits next to the raw one and is served directly.
+
+Raw stems are published to the object store, encodings stay local: a
+node that needs a stem it has not written fetches the raw file once and
+encodes it itself.
+"""
+
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.executors import executors
+from app.core.metrics import SEPARATION_ENCODE_SECONDS
+from app.services.encoder import iter_encode
+from app.services.storage_service import storage_service
+
+
+RAW_EXTENSION = ".pcm"
+
+# magic, version, channels, sample rate, reserved, frames, scale
+HEADER = struct.Struct("<4sHHIIQf4x")
+MAGIC = b"RSTM"
+VERSION = 1
+
+# Frames converted per write, bounds the temporary int16 buffer
+WRITE_BLOCK_FRAMES = 1 << 20
+
+# Frames per block when reading for encoding or mixing (~1.5 s at 44.1 kHz)
+READ_BLOCK_FRAMES = 1 << 16
+
+ENCODE_FORMATS = {
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+}
+
+
+class RawStem:
+    """Read-only, memory-mapped view of a raw stem file"""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        magic, version, channels, sample_rate, _, frames, scale = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path.name} is not a raw stem file")
+
+        self.path = path
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.frames = frames
+        self.scale = scale
+        # (frames, channels), pages are only read when touched
+        self.data = np.memmap(
+            path, dtype="<i2", mode="r", offset=HEADER.size, shape=(frames, channels)
+        )
+
+    @property
+    def duration(self) -> float:
+        """Duration in seconds"""
+        return self.frames / self.sample_rate
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """
+        Read a range of frames as float32
+
+        Args:
+            start: First frame
+            stop: End frame (exclusive), None reads to the end
+
+        Returns:
+            Array of shape (frames, channels)
+        """
+        block = self.data[start:stop].astype(np.float32)
+        block *= self.scale / 32767.0
+        return block
+
+    def iter_blocks(self, block_frames: int = READ_BLOCK_FRAMES) -> Iterator[np.ndarray]:
+        """Read the whole stem as consecutive float32 blocks"""
+        for start in range(0, self.frames, block_frames):
+            yield self.read(start, start + block_frames)
+
+
+class StemStore:
+    """Writes raw stems and encodes them on demand"""
+
+    def __init__(self):
+        # One lock per output file while it is being encoded, so concurrent
+        # first downloads encode once: path -> [lock, threads holding or waiting]
+        self._encode_locks: Dict[Path, list] = {}
+        self._locks_guard = threading.Lock()
+
+    def raw_path(self, file_id: str) -> Path:
+        """Path of the raw stem for a processed file ID"""
+        return storage_service.processed_dir / f"{file_id}{RAW_EXTENSION}"
+
+    def encoded_path(self, file_id: str, fmt: str) -> Path:
+        """Path of the encoded stem for a processed file ID"""
+        return storage_service.processed_dir / f"{file_id}.{fmt}"
+
+    def exists(self, file_id: str) -> bool:
+        """Check if a raw stem exists"""
+        return storage_service.stored(self.raw_path(file_id))
+
+    def open(self, file_id: str) -> RawStem:
+        """Open a raw stem for reading, fetching it from the object store if needed"""
+        path = self.raw_path(file_id)
+        storage_service.fetch(path)
+        return RawStem(path)
+
+    def list_stems(self, file_id: str) -> List[str]:
+        """
+        List stem names stored for an uploaded file
+
+        Args:
+            file_id: ID of the original upload
+
+        Returns:
+            Stem names, e.g. ["bass", "drums", "other", "vocals"]
+        """
+        prefix = f"{file_id}_"
+        return [
+            name[len(prefix):-len(RAW_EXTENSION)]
+            for name in storage_service.list_names("processed", prefix)
+            if name.endswith(RAW_EXTENSION)
+        ]
+
+    def write(self, file_id: str, source: Any, sample_rate: int) -> Path:
+        """
+        Store a separated source as raw int16 PCM
+
+        Args:
+            file_id: Processed file ID of the stem
+            source: Array or CPU tensor of shape (channels, frames)
+            sample_rate: Sample rate in Hz
+
+        Returns:
+            Path of the raw stem file
+        """
+        source = np.asarray(source, dtype=np.float32)
+        channels, frames = source.shape
+
+        # Demucs output can exceed full scale, keep the peak representable
+        peak = float(np.abs(source).max()) if frames else 0.0
+        scale = max(peak, 1.0)
+        factor = 32767.0 / scale
+
+        path = self.raw_path(file_id)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, channels, sample_rate, 0, frames, scale))
+            for start in range(0, frames, WRITE_BLOCK_FRAMES):
+                block = source[:, start:start + WRITE_BLOCK_FRAMES].T * factor
+                np.rint(block, out=block)
+                f.write(block.astype("<i2").tobytes())
+        tmp_path.replace(path)
+        storage_service.publish(path)
+
+        # Previously encoded versions and cached remixes of the upload
+        # belong to an older separation
+        for fmt in ENCODE_FORMATS:
+            self.encoded_path(file_id, fmt).unlink(missing_ok=True)
+        upload_id = file_id.rsplit("_", 1)[0]
+        for remix in storage_service.processed_dir.glob(f"{upload_id}_remix_*"):
+            remix.unlink(missing_ok=True)
+
+        return path
+
+    def delete(self, file_id: str):
+        """Delete a raw stem, its encodings and any unfinished temp files"""
+        storage_service.remove(self.raw_path(file_id))
+        self.raw_path(file_id).with_suffix(".tmp").unlink(missing_ok=True)
+        for fmt in ENCODE_FORMATS:
+            path = self.encoded_path(file_id, fmt)
+            path.unlink(missing_ok=True)
+            path.with_name(f"{path.stem}.tmp.{fmt}").unlink(missing_ok=True)
+
+    def remove_partial(self, file_id: str, since: float):
+        """
+        Delete stems of an upload written by an interrupted separation
+
+        Args:
+            file_id: ID of the original upload
+            since: Start time (epoch seconds) of the interrupted job
+        """
+        prefix = f"{file_id}_"
+        for path in storage_service.processed_dir.glob(f"{prefix}*.tmp"):
+            self.delete(path.stem)
+        for stem in self.list_stems(file_id):
+            path = self.raw_path(f"{prefix}{stem}")
+            try:
+                if path.stat().st_mtime >= since:
+                    self.delete(f"{prefix}{stem}")
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _encode_lock(self, path: Path):
+        """Hold the lock of an output file, dropped again once nobody uses it"""
+        with self._locks_guard:
+            entry = self._encode_locks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._encode_locks[path]
+
+    def encode(self, file_id: str, fmt: str = "mp3") -> Path:
+        """
+        Encode a raw stem, reusing an earlier encoding if present
+
+        Args:
+            file_id: Processed file ID of the stem
+            fmt: "mp3", "wav" or "flac"
+
+        Returns:
+            Path of the encoded file
+        """
+        path = self.encoded_path(file_id, fmt)
+        with self._encode_lock(path):
+            if path.exists():
+                return path
+
+            stem = self.open(file_id)
+            stem_name = file_id.rsplit("_", 1)[-1]
+
+            with SEPARATION_ENCODE_SECONDS.labels(stem=stem_name).time():
+                tmp_path = path.with_name(f"{path.stem}.tmp.{fmt}")
+                with open(tmp_path, "wb") as f:
+                    for data in iter_encode(
+                        stem.iter_blocks(), stem.sample_rate, stem.channels, stem.frames, fmt
+                    ):
+                        f.write(data)
+                tmp_path.replace(path)
+
+        return path
+
+    async def get_encoded(self, file_id: str, fmt: str = "mp3") -> Optional[Path]:
+        """
+        Get an encoded stem, encoding it in the background on first request
+
+        Args:
+            file_id: Processed file ID of the stem
+            fmt: "mp3", "wav" or "flac"
+
+        Returns:
+            Path of the encoded file, or None if there is no such stem
+        """
+        path, stored = await executors.run("fs", self._lookup, file_id, fmt)
+        if path is not None:
+            return path
+        if not stored:
+            return None
+        return await executors.run("decode", self.encode, file_id, fmt)
+
+    def _lookup(self, file_id: str, fmt: str) -> Tuple[Optional[Path], bool]:
+        """Encoded path if already encoded, and whether the raw stem exists"""
+        path = self.encoded_path(file_id, fmt)
+        if path.exists():
+            return path, True
+        return None, self.exists(file_id)
+
+
+# Global instance
+stem_store = StemStore()
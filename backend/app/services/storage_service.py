@@ -1,29 +1,60 @@
-"""Storage service for managing uploaded and processed files"""
+"""Storage service for managing uploaded and processed files
+
+Filesystem probes and deletes run in the "fs" executor and metadata reads
+in the "decode" executor, never on the event loop.
+
+Uploads, processed outputs and raw stems are published to the object
+store (see app/core/object_store.py) once written. With a remote store
+the local directories act as a cache: a file missing locally is fetched
+on first use, or read straight from the store where a whole copy is not
+needed (input_source, read_audio_metadata).
+"""
 
 import aiofiles
+import json
 import uuid
-import librosa
-import soundfile as sf
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Optional, Tuple
-import asyncio
+from typing import Any, List, Optional, Tuple, Union
 import os
 
 from app.config import settings
+from app.core import mp3
+from app.core.exceptions import InvalidAudioFileError
+from app.core.executors import executors
+from app.core.hashing import content_hash, file_content_hash
+from app.core.metrics import STORAGE_BYTES
+from app.core.object_store import create_object_store
 from app.core.security import sanitize_filename
 
 
+# Sidecar file holding the content hash of an upload
+HASH_EXTENSION = ".sha256"
+
+
 class StorageService:
     """Handles file storage and cleanup operations"""
 
     def __init__(self):
         self.upload_dir = settings.upload_dir
         self.processed_dir = settings.processed_dir
+        # Chunked uploads in progress, on the same filesystem as uploads
+        # so that finished ones are moved in place by a rename
+        self.parts_dir = self.upload_dir / ".parts"
+        self.objects = create_object_store()
 
         # Create directories if they don't exist
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         self.processed_dir.mkdir(parents=True, exist_ok=True)
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+
+        # Directory sizes are computed lazily, when /metrics is scraped
+        STORAGE_BYTES.labels(directory="upload").set_function(
+            lambda: self.directory_size("upload")
+        )
+        STORAGE_BYTES.labels(directory="processed").set_function(
+            lambda: self.directory_size("processed")
+        )
 
     async def save_upload(self, file_data: bytes, original_filename: str) -> Tuple[str, Path]:
         """
@@ -50,15 +81,157 @@ class StorageService:
         async with aiofiles.open(file_path, "wb") as f:
             await f.write(file_data)
 
+        # Hash while the content is still in memory
+        digest = await executors.run("decode", content_hash, file_data)
+        await self._write_content_hash(file_id, digest)
+        await executors.run("fs", self._publish_upload, file_id, file_path)
+
         return file_id, file_path
 
-    def get_file_path(self, file_id: str, directory: Optional[str] = "upload") -> Optional[Path]:
+    async def commit_upload(
+        self,
+        part_path: Path,
+        original_filename: str,
+        digest: str,
+    ) -> Tuple[str, Path]:
         """
-        Get path to file by ID
+        Move a fully assembled upload into place
+
+        Args:
+            part_path: Assembled file in parts_dir
+            original_filename: Original filename from upload
+            digest: Content hash computed while receiving the file
+
+        Returns:
+            Tuple of (file_id, file_path)
+        """
+        file_id = str(uuid.uuid4())
+        ext = Path(original_filename).suffix or ".mp3"
+        file_path = self.upload_dir / f"{file_id}{ext}"
+
+        await executors.run("fs", os.replace, part_path, file_path)
+        await self._write_content_hash(file_id, digest)
+        await executors.run("fs", self._publish_upload, file_id, file_path)
+
+        return file_id, file_path
+
+    def _publish_upload(self, file_id: str, file_path: Path):
+        self.publish(file_path)
+        self.publish(self.upload_dir / f"{file_id}{HASH_EXTENSION}")
+
+    def object_key(self, path: Path) -> str:
+        """Object store key of a file in the upload or processed directory"""
+        directory = "upload" if path.parent == self.upload_dir else "processed"
+        return f"{directory}/{path.name}"
+
+    def publish(self, path: Path):
+        """Store a finished local file in the object store (blocking)"""
+        self.objects.put(self.object_key(path), path)
+
+    def fetch(self, path: Path) -> bool:
+        """
+        Make sure a file is present locally (blocking)
+
+        Args:
+            path: Path in the upload or processed directory
+
+        Returns:
+            True if the file exists locally, after fetching it from the
+            object store if it was missing
+        """
+        if path.exists():
+            return True
+        return self.objects.remote and self.objects.get(self.object_key(path), path)
+
+    def stored(self, path: Path) -> bool:
+        """Whether a file exists locally or in the object store (blocking)"""
+        return path.exists() or (self.objects.remote and self.objects.exists(self.object_key(path)))
+
+    def input_source(self, path: Path) -> Union[Path, str]:
+        """
+        Where a decoder reads a file from (blocking)
+
+        Args:
+            path: Path in the upload or processed directory
+
+        Returns:
+            The local path if the file is here, else a URL the decoder
+            streams the object from without a local copy
+        """
+        if path.exists() or not self.objects.remote:
+            return path
+        return self.objects.source(self.object_key(path))
+
+    def list_names(self, directory: str, prefix: str) -> List[str]:
+        """
+        Names of the files starting with prefix, locally or in the object store (blocking)
+
+        Args:
+            directory: "upload" or "processed"
+            prefix: Start of the file names
+
+        Returns:
+            Sorted file names
+        """
+        base_dir = self.upload_dir if directory == "upload" else self.processed_dir
+        names = {path.name for path in base_dir.glob(f"{prefix}*")}
+        if self.objects.remote:
+            names.update(key.partition("/")[2] for key in self.objects.list(f"{directory}/{prefix}"))
+        return sorted(names)
+
+    def remove(self, path: Path):
+        """Delete a file locally and from the object store (blocking)"""
+        path.unlink(missing_ok=True)
+        if self.objects.remote:
+            self.objects.delete(self.object_key(path))
+
+    async def _write_content_hash(self, file_id: str, digest: str):
+        async with aiofiles.open(self.upload_dir / f"{file_id}{HASH_EXTENSION}", "w") as f:
+            await f.write(digest)
+
+    async def get_content_hash(self, file_id: str) -> Optional[str]:
+        """
+        Get the content hash of an upload
+
+        Args:
+            file_id: File ID
+
+        Returns:
+            Hex content hash, or None if the file does not exist
+        """
+        hash_path = self.upload_dir / f"{file_id}{HASH_EXTENSION}"
+        if await executors.run("fs", self.fetch, hash_path):
+            try:
+                async with aiofiles.open(hash_path, "r") as f:
+                    return (await f.read()).strip()
+            except FileNotFoundError:
+                pass
+
+        # Uploads from before hashes were recorded
+        file_path = await self.get_file_path(file_id, directory="upload")
+        if not file_path:
+            return None
+
+        digest = await executors.run("decode", file_content_hash, file_path)
+        await self._write_content_hash(file_id, digest)
+        await executors.run("fs", self.publish, hash_path)
+        return digest
+
+    def find_file(
+        self,
+        file_id: str,
+        directory: Optional[str] = "upload",
+        fetch: bool = True,
+    ) -> Optional[Path]:
+        """
+        Get path to file by ID (blocking, for worker threads)
 
         Args:
             file_id: File ID
             directory: "upload" or "processed"
+            fetch: Fetch a file that is only in the object store. Without
+                it the returned path may not exist locally, read it with
+                input_source() or read_audio_metadata()
 
         Returns:
             Path to file or None if not found
@@ -71,11 +244,72 @@ class StorageService:
             if file_path.exists():
                 return file_path
 
+        # Stored by another node
+        if self.objects.remote:
+            for ext in [".mp3", ".wav"]:
+                file_path = base_dir / f"{file_id}{ext}"
+                if self.fetch(file_path) if fetch else self.stored(file_path):
+                    return file_path
+
         return None
 
-    def file_exists(self, file_id: str, directory: str = "upload") -> bool:
+    async def get_file_path(
+        self,
+        file_id: str,
+        directory: Optional[str] = "upload",
+        fetch: bool = True,
+    ) -> Optional[Path]:
+        """
+        Get path to file by ID
+
+        Args:
+            file_id: File ID
+            directory: "upload" or "processed"
+            fetch: Fetch a file that is only in the object store (see find_file)
+
+        Returns:
+            Path to file or None if not found
+        """
+        return await executors.run("fs", self.find_file, file_id, directory, fetch)
+
+    async def file_exists(self, file_id: str, directory: str = "upload") -> bool:
         """Check if file exists"""
-        return self.get_file_path(file_id, directory) is not None
+        return await self.get_file_path(file_id, directory, fetch=False) is not None
+
+    def read_json(self, path: Path) -> Optional[Any]:
+        """Read a JSON file, None if it does not exist (blocking)"""
+        try:
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+
+    def write_json(self, path: Path, data: Any):
+        """Write a JSON file atomically, readers never see a partial file (blocking)"""
+        tmp_path = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_text(json.dumps(data))
+        tmp_path.replace(path)
+
+    def directory_size(self, directory: str = "upload") -> int:
+        """
+        Get total size of files in a storage directory
+
+        Args:
+            directory: "upload" or "processed"
+
+        Returns:
+            Size in bytes
+        """
+        base_dir = self.upload_dir if directory == "upload" else self.processed_dir
+
+        total = 0
+        try:
+            with os.scandir(base_dir) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            pass
+        return total
 
     async def get_audio_metadata(self, file_path: Path) -> dict:
         """
@@ -87,6 +321,36 @@ class StorageService:
         Returns:
             Dictionary with duration, sample_rate, channels
         """
+        return await executors.run("decode", self.read_audio_metadata, file_path)
+
+    @staticmethod
+    def _mp3_metadata(info: mp3.Mp3Info, size: int) -> dict:
+        return {
+            "duration": info.duration,
+            "sample_rate": info.sample_rate,
+            "channels": info.channels,
+            "bitrate": info.bitrate,
+            "frame_count": info.frame_count,
+            "file_size": size,
+        }
+
+    def read_audio_metadata(self, file_path: Path) -> dict:
+        """Extract metadata from audio file (blocking, for worker threads)"""
+        if self.objects.remote and not file_path.exists():
+            return self._read_object_metadata(file_path)
+
+        # MP3 headers give exact values without decoding anything
+        if file_path.suffix.lower() == ".mp3":
+            try:
+                return self._mp3_metadata(mp3.parse_file(file_path), file_path.stat().st_size)
+            except InvalidAudioFileError:
+                pass
+
+        # Imported here: librosa pulls in numba and scipy, which are slow
+        # to import and not needed until the first metadata read
+        import librosa
+        import soundfile as sf
+
         try:
             # Use soundfile for basic info (faster than librosa)
             info = sf.info(str(file_path))
@@ -117,6 +381,39 @@ class StorageService:
                     "file_size": file_path.stat().st_size,
                 }
 
+    def _read_object_metadata(self, file_path: Path) -> dict:
+        """Metadata of a file only in the object store, read with ranged GETs"""
+        import soundfile as sf
+
+        key = self.object_key(file_path)
+        size = self.objects.size(key)
+        if size is None:
+            raise FileNotFoundError(f"File {file_path.name} not found")
+
+        with self.objects.open(key) as f:
+            if file_path.suffix.lower() == ".mp3":
+                try:
+                    return self._mp3_metadata(mp3.parse_stream(f, size), size)
+                except InvalidAudioFileError:
+                    pass
+
+            try:
+                f.seek(0)
+                info = sf.info(f)
+                return {
+                    "duration": info.duration,
+                    "sample_rate": info.samplerate,
+                    "channels": info.channels,
+                    "file_size": size,
+                }
+            except Exception:
+                return {
+                    "duration": None,
+                    "sample_rate": None,
+                    "channels": None,
+                    "file_size": size,
+                }
+
     async def delete_file(self, file_id: str, directory: str = "upload") -> bool:
         """
         Delete a file
@@ -128,11 +425,24 @@ class StorageService:
         Returns:
             True if deleted, False if not found
         """
-        file_path = self.get_file_path(file_id, directory)
-        if file_path and file_path.exists():
-            file_path.unlink()
-            return True
-        return False
+        return await executors.run("fs", self._delete, file_id, directory)
+
+    def _delete(self, file_id: str, directory: str) -> bool:
+        if directory == "processed":
+            # Imported here, the stem store is built on this service
+            from app.services.stem_store import stem_store
+
+            if stem_store.exists(file_id):
+                stem_store.delete(file_id)
+                return True
+
+        file_path = self.find_file(file_id, directory, fetch=False)
+        if file_path is None:
+            return False
+        self.remove(file_path)
+        if directory == "upload":
+            self.remove(self.upload_dir / f"{file_id}{HASH_EXTENSION}")
+        return True
 
     async def cleanup_old_files(self, max_age_hours: int = 24):
         """
@@ -141,8 +451,10 @@ class StorageService:
         Args:
             max_age_hours: Maximum age in hours before deletion
         """
-        cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
+        await executors.run("fs", self._cleanup, datetime.now() - timedelta(hours=max_age_hours))
 
+    def _cleanup(self, cutoff_time: datetime):
+        # Only local copies, objects expire through the bucket's lifecycle rules
         for directory in [self.upload_dir, self.processed_dir]:
             for file_path in directory.glob("*"):
                 if file_path.is_file():
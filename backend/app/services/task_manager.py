@@ -1,54 +1,49 @@
 """Task manager for handling background audio processing tasks"""
 
 import asyncio
+import threading
 import uuid
-from datetime import datetime
-from typing import Dict, Optional, Callable, Any
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Callable, Any, Tuple
 from enum import Enum
 
 from app.api.schemas.task import TaskStatus, TaskResponse
-
-
-class Task:
-    """Internal task representation"""
-
-    def __init__(self, task_id: str):
-        self.task_id = task_id
-        self.status = TaskStatus.PENDING
-        self.progress = 0.0
-        self.message: Optional[str] = None
-        self.result: Optional[Dict[str, Any]] = None
-        self.error: Optional[str] = None
-        self.created_at = datetime.now()
-        self.updated_at = datetime.now()
-
-    def to_response(self) -> TaskResponse:
-        """Convert to API response model"""
-        return TaskResponse(
-            task_id=self.task_id,
-            status=self.status,
-            progress=self.progress,
-            message=self.message,
-            result=self.result,
-            error=self.error,
-            created_at=self.created_at,
-            updated_at=self.updated_at,
-        )
+from app.core.executors import executors
+from app.core.jobs import CancelToken, JobContext
+from app.core.metrics import TASKS_TOTAL
+from app.core.tracing import tracer
+from app.services.task_store import FINISHED_STATUSES, Task, TaskStore, create_task_store
 
 
 class TaskManager:
     """
     Manages background tasks using asyncio
 
-    For MVP, uses in-memory storage. For production,
-    should use Redis or a database.
+    Task state is kept in a TaskStore (SQLite by default, shared between
+    worker processes). Tasks run in the process that created them, so
+    only that process can cancel them. Once a task has finished its state
+    is final, late updates from a job that is still winding down are
+    ignored. Store calls that may wait on the database run in the "fs"
+    pool, so a contended write lock never stalls the event loop.
     """
 
-    def __init__(self):
-        self.tasks: Dict[str, Task] = {}
+    def __init__(self, store: Optional[TaskStore] = None):
+        self.store = store or create_task_store()
         self.running_tasks: Dict[str, asyncio.Task] = {}
+        self.tokens: Dict[str, CancelToken] = {}
+        # Progress ticks come from worker threads, status changes from the
+        # "fs" pool: the finished check and the update happen as one step
+        self._update_lock = threading.Lock()
+
+    async def open(self):
+        """Open the store, failing tasks left unfinished by dead processes"""
+        await executors.run("fs", self.store.open)
+
+    async def close(self):
+        """Write buffered updates and close the store"""
+        await executors.run("fs", self.store.close)
 
-    def create_task(self, task_id: Optional[str] = None) -> str:
+    async def create_task(self, task_id: Optional[str] = None) -> str:
         """
         Create a new task
 
@@ -61,10 +56,36 @@ class TaskManager:
         if task_id is None:
             task_id = str(uuid.uuid4())
 
-        task = Task(task_id)
-        self.tasks[task_id] = task
+        await executors.run("fs", self.store.add, Task(task_id))
+        self.tokens[task_id] = CancelToken()
         return task_id
 
+    def job_context(
+        self,
+        task_id: Optional[str],
+        on_stage: Optional[Callable[[str, float], None]] = None,
+    ) -> JobContext:
+        """
+        Context for blocking work done on behalf of a task
+
+        Progress reports update the task and raise once the task has been
+        cancelled, so jobs stop at their next report or check().
+
+        Args:
+            task_id: The task ID, None for work outside of any task
+            on_stage: Called with (stage name, seconds) after each stage
+
+        Returns:
+            JobContext bound to the task
+        """
+        if task_id is None:
+            return JobContext(on_stage=on_stage)
+
+        def on_progress(progress: float, message: str):
+            self._apply_update(task_id, progress=progress, message=message)
+
+        return JobContext(self.tokens.get(task_id), on_progress, on_stage)
+
     async def run_task(
         self,
         task_id: str,
@@ -81,10 +102,23 @@ class TaskManager:
             args: Positional arguments for func
             kwargs: Keyword arguments for func
         """
-        task = self.tasks.get(task_id)
-        if not task:
+        if not await self.get_task(task_id):
             raise ValueError(f"Task {task_id} not found")
 
+        try:
+            with tracer.span("task_manager.run_task", task_id=task_id):
+                await self._run_task(task_id, func, *args, **kwargs)
+        finally:
+            self.tokens.pop(task_id, None)
+
+    async def _run_task(
+        self,
+        task_id: str,
+        func: Callable,
+        *args,
+        **kwargs
+    ):
+        """Run func and record its outcome on the task"""
         try:
             # Update status to processing
             await self.update_task(
@@ -100,22 +134,24 @@ class TaskManager:
                 result = func(*args, task_id=task_id, **kwargs)
 
             # Mark as completed
-            await self.update_task(
+            if await self.update_task(
                 task_id,
                 status=TaskStatus.COMPLETED,
                 progress=1.0,
                 result=result,
                 message="Processing completed successfully",
-            )
+            ):
+                TASKS_TOTAL.labels(status=TaskStatus.COMPLETED.value).inc()
 
         except Exception as e:
-            # Mark as failed
-            await self.update_task(
+            # Mark as failed, unless it was cancelled in the meantime
+            if await self.update_task(
                 task_id,
                 status=TaskStatus.FAILED,
                 error=str(e),
                 message=f"Processing failed: {str(e)}",
-            )
+            ):
+                TASKS_TOTAL.labels(status=TaskStatus.FAILED.value).inc()
             raise
 
     def start_background_task(
@@ -151,7 +187,7 @@ class TaskManager:
         message: Optional[str] = None,
         result: Optional[Dict[str, Any]] = None,
         error: Optional[str] = None,
-    ):
+    ) -> bool:
         """
         Update task status
 
@@ -162,25 +198,54 @@ class TaskManager:
             message: Status message
             result: Result dictionary
             error: Error message
+
+        Returns:
+            False if the task had already finished and was left unchanged
         """
-        task = self.tasks.get(task_id)
+        return await executors.run(
+            "fs", self._apply_update, task_id, status, progress, message, result, error
+        )
+
+    def _apply_update(
+        self,
+        task_id: str,
+        status: Optional[TaskStatus] = None,
+        progress: Optional[float] = None,
+        message: Optional[str] = None,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Update a task in place, safe to call from worker threads"""
+        task = self.store.get(task_id)
         if not task:
             raise ValueError(f"Task {task_id} not found")
 
-        if status is not None:
-            task.status = status
-        if progress is not None:
-            task.progress = min(1.0, max(0.0, progress))
-        if message is not None:
-            task.message = message
-        if result is not None:
-            task.result = result
-        if error is not None:
-            task.error = error
-
-        task.updated_at = datetime.now()
+        with self._update_lock:
+            # A finished task keeps its final state
+            if task.status in FINISHED_STATUSES:
+                return False
+
+            if status is not None:
+                task.status = status
+            if progress is not None:
+                task.progress = min(1.0, max(0.0, progress))
+            if message is not None:
+                task.message = message
+            if result is not None:
+                task.result = result
+            if error is not None:
+                task.error = error
+
+            task.updated_at = datetime.now()
+
+        # Progress ticks are batched, everything else is written through
+        self.store.save(
+            task,
+            immediate=status is not None or result is not None or error is not None,
+        )
+        return True
 
-    def get_task(self, task_id: str) -> Optional[TaskResponse]:
+    async def get_task(self, task_id: str) -> Optional[TaskResponse]:
         """
         Get task status
 
@@ -190,53 +255,121 @@ class TaskManager:
         Returns:
             TaskResponse or None if not found
         """
-        task = self.tasks.get(task_id)
+        task = self.store.cached(task_id)
+        if task is None:
+            task = await executors.run("fs", self.store.get, task_id)
         if task:
             return task.to_response()
         return None
 
-    async def cancel_task(self, task_id: str) -> bool:
+    async def list_tasks(
+        self,
+        status: Optional[TaskStatus] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> Tuple[List[TaskResponse], int]:
+        """
+        List tasks of all workers, newest first
+
+        Args:
+            status: Only tasks with this status
+            limit: Page size
+            offset: Number of tasks to skip
+
+        Returns:
+            Tuple of (tasks on the page, total matching tasks)
+        """
+        tasks, total = await executors.run("fs", self.store.list, status, limit, offset)
+        return [task.to_response() for task in tasks], total
+
+    async def flush(self):
+        """Write buffered progress updates to the store"""
+        await executors.run("fs", self.store.flush)
+
+    async def apply_cancel_requests(self):
+        """Cancel tasks of this process whose cancel another worker requested"""
+        for task_id in await executors.run("fs", self.store.cancel_requests):
+            if not await self.cancel_task(task_id, forward=False):
+                # Not started yet, e.g. queued in a batch
+                await self.update_task(
+                    task_id,
+                    status=TaskStatus.CANCELLED,
+                    message="Task was cancelled",
+                )
+                TASKS_TOTAL.labels(status=TaskStatus.CANCELLED.value).inc()
+
+    async def cancel_task(self, task_id: str, forward: bool = True) -> bool:
         """
         Cancel a running task
 
+        A task running in another worker process is cancelled through the
+        store: the request is picked up by that worker's flush loop.
+
         Args:
             task_id: The task ID
+            forward: Request the cancel from other workers if not running here
 
         Returns:
-            True if cancelled, False if not found or not running
+            True if cancelled (or requested), False if not found or not running
         """
         async_task = self.running_tasks.get(task_id)
         if async_task and not async_task.done():
-            async_task.cancel()
+            # Final status first, so nothing the job reports later overrides it
             await self.update_task(
                 task_id,
                 status=TaskStatus.CANCELLED,
                 message="Task was cancelled",
             )
+            TASKS_TOTAL.labels(status=TaskStatus.CANCELLED.value).inc()
+
+            # Stops the blocking job at its next check, or kills its process
+            token = self.tokens.get(task_id)
+            if token is not None:
+                token.cancel()
+            async_task.cancel()
             return True
+        if forward:
+            return await executors.run("fs", self.store.request_cancel, task_id)
         return False
 
-    def cleanup_old_tasks(self, max_age_seconds: int = 3600):
+    async def fail_task(self, task_id: str, error: Exception) -> bool:
+        """
+        Fail a running task from outside, e.g. when it timed out
+
+        Args:
+            task_id: The task ID
+            error: Reason, also raised inside the job at its next check
+
+        Returns:
+            True if the task was still running
+        """
+        if not await self.update_task(
+            task_id,
+            status=TaskStatus.FAILED,
+            error=str(error),
+            message=f"Processing failed: {error}",
+        ):
+            return False
+        TASKS_TOTAL.labels(status=TaskStatus.FAILED.value).inc()
+
+        token = self.tokens.get(task_id)
+        if token is not None:
+            token.cancel(error)
+        async_task = self.running_tasks.get(task_id)
+        if async_task and not async_task.done():
+            async_task.cancel()
+        return True
+
+    async def cleanup_old_tasks(self, max_age_seconds: int = 3600):
         """
         Remove tasks older than max_age_seconds
 
         Args:
             max_age_seconds: Maximum age in seconds
         """
-        now = datetime.now()
-        tasks_to_remove = []
-
-        for task_id, task in self.tasks.items():
-            age = (now - task.created_at).total_seconds()
-            if age > max_age_seconds and task.status in [
-                TaskStatus.COMPLETED,
-                TaskStatus.FAILED,
-                TaskStatus.CANCELLED,
-            ]:
-                tasks_to_remove.append(task_id)
+        cutoff = datetime.now() - timedelta(seconds=max_age_seconds)
 
-        for task_id in tasks_to_remove:
-            del self.tasks[task_id]
+        for task_id in await executors.run("fs", self.store.delete_finished, cutoff):
             if task_id in self.running_tasks:
                 del self.running_tasks[task_id]
 
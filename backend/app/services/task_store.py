@@ -0,0 +1,473 @@
+"""Task persistence
+
+Tasks live in a store shared by all API worker processes, so any worker
+can answer status requests and task state survives restarts. The SQLite
+store runs in WAL mode: readers never block the writer, and writers from
+several processes queue on the database lock. Status changes are written
+through immediately. Progress and message updates are buffered and
+written in one transaction at most every settings.task_flush_interval_ms.
+
+Each process keeps a small hot cache of Task objects. Tasks running in
+the process are authoritative there. Finished tasks are immutable, so
+they can be cached too. Everything else is read from the database.
+
+Store methods block on the database, TaskManager calls them from the
+"fs" pool. Nothing touches the database before open(), which the API
+process calls at startup, so importing the services (in worker processes
+or tools) neither creates the file nor fails other processes' tasks.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.api.schemas.task import TaskResponse, TaskStatus
+from app.config import settings
+
+
+FINISHED_STATUSES = {TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED}
+
+
+class Task:
+    """Internal task representation"""
+
+    __slots__ = (
+        "task_id", "status", "progress", "message", "result", "error",
+        "created_at", "updated_at", "owner",
+    )
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.status = TaskStatus.PENDING
+        self.progress = 0.0
+        self.message: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.updated_at = datetime.now()
+        # Process running the task, see process_token()
+        self.owner = process_token()
+
+    def to_response(self) -> TaskResponse:
+        """Convert to API response model"""
+        return TaskResponse(
+            task_id=self.task_id,
+            status=self.status,
+            progress=self.progress,
+            message=self.message,
+            result=self.result,
+            error=self.error,
+            created_at=self.created_at,
+            updated_at=self.updated_at,
+        )
+
+
+class TaskStore:
+    """In-memory task store, for a single worker process"""
+
+    def __init__(self):
+        self.tasks: Dict[str, Task] = {}
+
+    def open(self):
+        """Prepare the store for use"""
+
+    def cached(self, task_id: str) -> Optional[Task]:
+        """Get a task if it is held in memory, never blocks"""
+        return self.tasks.get(task_id)
+
+    def add(self, task: Task):
+        """Store a new task"""
+        self.tasks[task.task_id] = task
+
+    def get(self, task_id: str) -> Optional[Task]:
+        """Get a task by ID"""
+        return self.tasks.get(task_id)
+
+    def save(self, task: Task, immediate: bool = True):
+        """
+        Persist changes to a task
+
+        Args:
+            task: The changed task
+            immediate: Write now, otherwise the write may be batched
+        """
+
+    def list(
+        self,
+        status: Optional[TaskStatus] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> Tuple[List[Task], int]:
+        """
+        List tasks, newest first
+
+        Args:
+            status: Only tasks with this status
+            limit: Page size
+            offset: Number of tasks to skip
+
+        Returns:
+            Tuple of (tasks on the page, total matching tasks)
+        """
+        tasks = [t for t in self.tasks.values() if status is None or t.status == status]
+        tasks.sort(key=lambda t: t.created_at, reverse=True)
+        return tasks[offset:offset + limit], len(tasks)
+
+    def delete_finished(self, before: datetime) -> List[str]:
+        """
+        Delete finished tasks created before a time
+
+        Returns:
+            IDs of the deleted tasks
+        """
+        removed = [
+            task_id for task_id, task in self.tasks.items()
+            if task.created_at < before and task.status in FINISHED_STATUSES
+        ]
+        for task_id in removed:
+            del self.tasks[task_id]
+        return removed
+
+    def request_cancel(self, task_id: str) -> bool:
+        """
+        Ask the process running a task to cancel it
+
+        Returns:
+            True if the task is unfinished and the request was recorded
+        """
+        return False
+
+    def cancel_requests(self) -> List[str]:
+        """IDs of unfinished tasks of this process whose cancel was requested"""
+        return []
+
+    def flush(self):
+        """Write buffered updates"""
+
+    def close(self):
+        """Flush and release resources"""
+
+
+class SQLiteTaskStore(TaskStore):
+    """Task store in a SQLite database shared by worker processes"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            progress REAL NOT NULL,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            owner TEXT NOT NULL,
+            cancel_requested INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks (status, created_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (created_at);
+    """
+
+    COLUMNS = "task_id, status, progress, message, result, error, created_at, updated_at, owner"
+
+    def __init__(self, path: Path, flush_interval: float = 0.5, max_cached: int = 1024):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_cached = max_cached
+
+        self._local = threading.local()
+        # Connections of all threads, so close() can release every one
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        # Tasks running in this process, never evicted
+        self.tasks: Dict[str, Task] = {}
+        # Finished tasks read back, LRU
+        self._finished: "OrderedDict[str, Task]" = OrderedDict()
+        self._dirty: Dict[str, Task] = {}
+        self._last_flush = time.monotonic()
+        self._opened = False
+
+    def open(self):
+        """Create the database if needed and fail tasks of dead processes"""
+        if self._opened:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        # Databases created before cross-process cancellation
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]
+        if "cancel_requested" not in columns:
+            conn.execute(
+                "ALTER TABLE tasks ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0"
+            )
+        self._recover_orphans()
+        self._opened = True
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connection of the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Used by its own thread only, closed from another one in close()
+            conn = sqlite3.connect(
+                self.path, timeout=10.0, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _row(self, task: Task) -> tuple:
+        return (
+            task.task_id,
+            task.status.value,
+            task.progress,
+            task.message,
+            json.dumps(task.result) if task.result is not None else None,
+            task.error,
+            task.created_at.timestamp(),
+            task.updated_at.timestamp(),
+            task.owner,
+        )
+
+    def _task(self, row: tuple) -> Task:
+        task = Task(row[0])
+        task.status = TaskStatus(row[1])
+        task.progress = row[2]
+        task.message = row[3]
+        task.result = json.loads(row[4]) if row[4] is not None else None
+        task.error = row[5]
+        task.created_at = datetime.fromtimestamp(row[6])
+        task.updated_at = datetime.fromtimestamp(row[7])
+        task.owner = str(row[8])
+        return task
+
+    def _write(self, tasks: List[Task]):
+        # An upsert rather than INSERT OR REPLACE, which would reset cancel_requested
+        updates = ", ".join(
+            f"{column} = excluded.{column}" for column in self.COLUMNS.split(", ")[1:]
+        )
+        self._conn().executemany(
+            f"INSERT INTO tasks ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            f"ON CONFLICT(task_id) DO UPDATE SET {updates}",
+            [self._row(task) for task in tasks],
+        )
+
+    def _recover_orphans(self):
+        """Fail unfinished tasks whose process is gone (e.g. after a restart)"""
+        conn = self._conn()
+        owners = [row[0] for row in conn.execute(
+            "SELECT DISTINCT owner FROM tasks WHERE status IN (?, ?)",
+            (TaskStatus.PENDING.value, TaskStatus.PROCESSING.value),
+        )]
+
+        for owner in owners:
+            if str(owner) != process_token() and _owner_alive(str(owner)):
+                continue
+            conn.execute(
+                "UPDATE tasks SET status = ?, error = ?, message = ?, updated_at = ? "
+                "WHERE owner = ? AND status IN (?, ?)",
+                (
+                    TaskStatus.FAILED.value,
+                    "Interrupted by a server restart",
+                    "Processing failed: Interrupted by a server restart",
+                    time.time(),
+                    owner,
+                    TaskStatus.PENDING.value,
+                    TaskStatus.PROCESSING.value,
+                ),
+            )
+
+    def cached(self, task_id: str) -> Optional[Task]:
+        with self._lock:
+            return self.tasks.get(task_id) or self._finished.get(task_id)
+
+    def add(self, task: Task):
+        with self._lock:
+            self.tasks[task.task_id] = task
+        self._write([task])
+
+    def get(self, task_id: str) -> Optional[Task]:
+        with self._lock:
+            task = self.tasks.get(task_id) or self._finished.get(task_id)
+            if task is not None:
+                if task_id in self._finished:
+                    self._finished.move_to_end(task_id)
+                return task
+
+        row = self._conn().execute(
+            f"SELECT {self.COLUMNS} FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        task = self._task(row)
+        if task.status in FINISHED_STATUSES:
+            with self._lock:
+                self._finished[task_id] = task
+                while len(self._finished) > self.max_cached:
+                    self._finished.popitem(last=False)
+        return task
+
+    def save(self, task: Task, immediate: bool = True):
+        with self._lock:
+            self._dirty[task.task_id] = task
+            due = immediate or time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+        # Finished tasks move from the running set to the LRU
+        if task.status in FINISHED_STATUSES:
+            with self._lock:
+                if self.tasks.pop(task.task_id, None) is not None:
+                    self._finished[task.task_id] = task
+                    while len(self._finished) > self.max_cached:
+                        self._finished.popitem(last=False)
+
+    def request_cancel(self, task_id: str) -> bool:
+        cursor = self._conn().execute(
+            "UPDATE tasks SET cancel_requested = 1 WHERE task_id = ? AND status IN (?, ?)",
+            (task_id, TaskStatus.PENDING.value, TaskStatus.PROCESSING.value),
+        )
+        return cursor.rowcount > 0
+
+    def cancel_requests(self) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT task_id FROM tasks "
+            "WHERE status IN (?, ?) AND owner = ? AND cancel_requested = 1",
+            (TaskStatus.PENDING.value, TaskStatus.PROCESSING.value, process_token()),
+        )
+        return [row[0] for row in rows]
+
+    def flush(self):
+        with self._lock:
+            dirty = list(self._dirty.values())
+            self._dirty.clear()
+            self._last_flush = time.monotonic()
+        if not dirty:
+            return
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write(dirty)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def list(
+        self,
+        status: Optional[TaskStatus] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> Tuple[List[Task], int]:
+        self.flush()
+        where, params = ("WHERE status = ?", (status.value,)) if status else ("", ())
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM tasks {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {self.COLUMNS} FROM tasks {where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            params + (limit, offset),
+        ).fetchall()
+        return [self._task(row) for row in rows], total
+
+    def delete_finished(self, before: datetime) -> List[str]:
+        self.flush()
+        statuses = [s.value for s in FINISHED_STATUSES]
+        placeholders = ", ".join("?" * len(statuses))
+        where = f"WHERE created_at < ? AND status IN ({placeholders})"
+        params = (before.timestamp(), *statuses)
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = [row[0] for row in conn.execute(f"SELECT task_id FROM tasks {where}", params)]
+            conn.execute(f"DELETE FROM tasks {where}", params)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            for task_id in removed:
+                self._finished.pop(task_id, None)
+        return removed
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        # Threads that use the store again reconnect
+        self._local = threading.local()
+
+
+_own_token: Dict[int, str] = {}
+
+
+def _process_start(pid: int) -> Optional[str]:
+    """Start time of a process in clock ticks since boot, None if unknown"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name in parentheses may contain spaces
+    return stat.rsplit(")", 1)[1].split()[19]
+
+
+def process_token(pid: Optional[int] = None) -> str:
+    """
+    Identity of a process that survives PID reuse
+
+    PIDs in a restarted container start from 1 again, so a task owner is
+    the PID together with the process start time, where /proc has it.
+
+    Args:
+        pid: Process ID, the current process by default
+
+    Returns:
+        "pid:start" or just "pid"
+    """
+    if pid is None:
+        pid = os.getpid()
+        # Keyed by PID, so a forked child computes its own
+        token = _own_token.get(pid)
+        if token is None:
+            token = _own_token[pid] = process_token(pid)
+        return token
+    start = _process_start(pid)
+    return f"{pid}:{start}" if start is not None else str(pid)
+
+
+def _owner_alive(owner: str) -> bool:
+    """Whether the process that owns a task still runs"""
+    pid_text, _, start = owner.partition(":")
+    pid = int(pid_text)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # Same PID, but a different process that reused it
+    return not start or _process_start(pid) == start
+
+
+def create_task_store() -> TaskStore:
+    """Create the task store selected in settings"""
+    if settings.task_store == "sqlite":
+        return SQLiteTaskStore(
+            settings.task_db_path,
+            flush_interval=settings.task_flush_interval_ms / 1000,
+        )
+    return TaskStore()
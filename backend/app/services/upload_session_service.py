@@ -0,0 +1,258 @@
+"""Resumable chunked uploads
+
+A session preallocates the target file and each numbered chunk is written
+straight to its offset, so chunks can arrive in parallel, in any order and
+be retried individually. Every chunk is hashed when it arrives and the
+first one is type-checked right away; finalizing only combines the chunk
+digests and renames the file into the uploads directory, the data is
+never read back.
+"""
+
+import math
+import uuid
+from datetime import datetime, timedelta
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.core.executors import executors
+from app.core.hashing import HASH_BLOCK_SIZE, block_digests, combine_digests
+from app.core.metrics import UPLOAD_SIZE_BYTES
+from app.core.security import (
+    HEADER_CHECK_SIZE,
+    validate_audio_header,
+    validate_audio_path,
+    validate_audio_size,
+)
+from app.services.storage_service import storage_service
+
+
+class UploadSession:
+    """State of one chunked upload"""
+
+    def __init__(self, upload_id: str, filename: str, file_size: int, chunk_size: int):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.num_chunks = max(1, math.ceil(file_size / chunk_size))
+        self.part_path: Path = storage_service.parts_dir / f"{upload_id}.part"
+        # Chunk index -> block digests of that chunk
+        self.digests: Dict[int, List[bytes]] = {}
+        # Chunks being written right now, finalizing waits for none
+        self.writing = 0
+        self.finalizing = False
+        self.created_at = datetime.now()
+        self.updated_at = datetime.now()
+
+    def chunk_length(self, index: int) -> int:
+        """Expected size of a chunk"""
+        if index == self.num_chunks - 1:
+            return self.file_size - index * self.chunk_size
+        return self.chunk_size
+
+    @property
+    def received(self) -> List[int]:
+        return sorted(self.digests)
+
+    @property
+    def missing(self) -> List[int]:
+        return [i for i in range(self.num_chunks) if i not in self.digests]
+
+
+def _preallocate(path: Path, size: int):
+    """Create a sparse file of the full upload size (runs in thread pool)"""
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _write_chunk(path: Path, offset: int, data: bytes) -> List[bytes]:
+    """Write a chunk at its offset and hash it (runs in thread pool)"""
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+    return block_digests(data)
+
+
+class UploadSessionService:
+    """
+    Manages chunked upload sessions
+
+    Sessions are kept in memory, so a client must finish its upload
+    against the same API process.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, UploadSession] = {}
+
+    async def create_session(
+        self,
+        filename: str,
+        file_size: int,
+        chunk_size: Optional[int] = None,
+    ) -> UploadSession:
+        """
+        Start a chunked upload
+
+        Args:
+            filename: Sanitized original filename
+            file_size: Total size in bytes
+            chunk_size: Chunk size, a multiple of 1 MiB (default from settings)
+
+        Returns:
+            The new session
+
+        Raises:
+            HTTPException: If the file size is not allowed
+            ValueError: If the chunk size is invalid
+        """
+        validate_audio_size(file_size)
+
+        chunk_size = chunk_size or settings.upload_chunk_size_mb * 1024 * 1024
+        if chunk_size % HASH_BLOCK_SIZE or chunk_size > settings.max_file_size_bytes:
+            raise ValueError(
+                f"chunk_size must be a multiple of {HASH_BLOCK_SIZE} bytes "
+                f"and at most {settings.max_file_size_mb}MB"
+            )
+
+        session = UploadSession(str(uuid.uuid4()), filename, file_size, chunk_size)
+
+        # Sparse preallocation, chunks fill it in place
+        await executors.run("fs", _preallocate, session.part_path, file_size)
+
+        self.sessions[session.upload_id] = session
+        return session
+
+    def get_session(self, upload_id: str) -> Optional[UploadSession]:
+        """Get a session by ID"""
+        return self.sessions.get(upload_id)
+
+    async def write_chunk(self, upload_id: str, index: int, data: bytes) -> UploadSession:
+        """
+        Store one chunk
+
+        Args:
+            upload_id: Session ID
+            index: Chunk number, starting at 0
+            data: Chunk content
+
+        Returns:
+            The updated session
+
+        Raises:
+            KeyError: If the session does not exist
+            ValueError: If the chunk number or size is wrong
+            HTTPException: If the first chunk is not an MP3
+        """
+        session = self.sessions[upload_id]
+        if session.finalizing:
+            raise ValueError("Upload is being finalized")
+        if not 0 <= index < session.num_chunks:
+            raise ValueError(f"Chunk index must be between 0 and {session.num_chunks - 1}")
+        if len(data) != session.chunk_length(index):
+            raise ValueError(f"Chunk {index} must be {session.chunk_length(index)} bytes, got {len(data)}")
+
+        # Reject non-MP3 content before the rest is transferred
+        if index == 0:
+            validate_audio_header(data[:HEADER_CHECK_SIZE])
+
+        session.writing += 1
+        try:
+            digests = await executors.run(
+                "fs", _write_chunk, session.part_path, index * session.chunk_size, data
+            )
+        finally:
+            session.writing -= 1
+
+        session.digests[index] = digests
+        session.updated_at = datetime.now()
+        return session
+
+    async def finalize(self, upload_id: str) -> Tuple[str, Path, str]:
+        """
+        Move a complete upload into storage
+
+        Args:
+            upload_id: Session ID
+
+        Returns:
+            Tuple of (file_id, file_path, content_hash)
+
+        Raises:
+            KeyError: If the session does not exist
+            ValueError: If chunks are missing, still being written or the
+                upload is already being finalized
+            HTTPException: If the assembled file is not a valid MP3
+        """
+        session = self.sessions[upload_id]
+        if session.finalizing:
+            raise ValueError("Upload is already being finalized")
+        missing = session.missing
+        if missing:
+            raise ValueError(f"Missing chunks: {missing}")
+        if session.writing:
+            raise ValueError("Chunks are still being written")
+
+        # No chunk writes and no second finalize from here on
+        session.finalizing = True
+        try:
+            # Frame structure and truncation, from headers only
+            await executors.run("fs", validate_audio_path, session.part_path)
+
+            digest = combine_digests(chain.from_iterable(
+                session.digests[i] for i in range(session.num_chunks)
+            ))
+
+            file_id, file_path = await storage_service.commit_upload(
+                session.part_path, session.filename, digest
+            )
+        except BaseException:
+            # Chunks can be re-sent and the upload finalized again
+            session.finalizing = False
+            raise
+        self.sessions.pop(upload_id, None)
+        UPLOAD_SIZE_BYTES.observe(session.file_size)
+
+        return file_id, file_path, digest
+
+    async def abort(self, upload_id: str) -> bool:
+        """
+        Abort an upload and delete its data
+
+        Args:
+            upload_id: Session ID
+
+        Returns:
+            True if the session existed
+
+        Raises:
+            ValueError: If the upload is being finalized
+        """
+        session = self.sessions.get(upload_id)
+        if not session:
+            return False
+        if session.finalizing:
+            raise ValueError("Upload is being finalized")
+        del self.sessions[upload_id]
+        await executors.run("fs", session.part_path.unlink, missing_ok=True)
+        return True
+
+    async def cleanup_expired(self, max_age_hours: Optional[int] = None):
+        """
+        Abort sessions that have not received data for a while
+
+        Args:
+            max_age_hours: Inactivity limit (default from settings)
+        """
+        max_age = timedelta(hours=max_age_hours or settings.upload_session_ttl_hours)
+        cutoff = datetime.now() - max_age
+
+        for upload_id, session in list(self.sessions.items()):
+            if session.updated_at < cutoff and not session.finalizing:
+                del self.sessions[upload_id]
+                await executors.run("fs", session.part_path.unlink, missing_ok=True)
+
+
+# Global instance
+upload_session_service = UploadSessionService()
@@ -0,0 +1,199 @@
+"""Deadlines and stall detection for running jobs
+
+Each guarded job gets a deadline that scales with the audio duration.
+The deadline is overhead + duration * real-time factor * safety factor.
+The real-time factor (processing seconds per audio second) is measured
+per preset, e.g. one Demucs model on one device, from jobs that finished.
+The watchdog also fails jobs whose task made no progress for too long.
+Jobs whose input duration is unknown get no deadline, only the stall check.
+An expired job fails with ProcessingTimeoutError and its CancelToken
+fires with the same error. That kills a process worker immediately, or
+stops a thread at its next check.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.config import settings
+from app.core.exceptions import ProcessingTimeoutError
+from app.core.metrics import JOB_REALTIME_FACTOR, JOB_TIMEOUTS
+from app.services.task_manager import task_manager
+
+
+# Jobs that processed less of their input than this, e.g. separations
+# served from the segment cache, are mostly overhead and not measured
+MIN_MEASURED_FRACTION = 0.5
+
+class RealTimeFactors:
+    """Moving average of processing time per audio second, per preset"""
+
+    def __init__(self, default: float, alpha: float = 0.3):
+        self.default = default
+        self.alpha = alpha
+        self._factors: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, preset: str) -> float:
+        """Current estimate for a preset"""
+        with self._lock:
+            return self._factors.get(preset, self.default)
+
+    def observe(self, preset: str, audio_seconds: float, elapsed: float):
+        """Fold a finished job into the estimate"""
+        if audio_seconds <= 0:
+            return
+        factor = elapsed / audio_seconds
+        with self._lock:
+            previous = self._factors.get(preset)
+            if previous is not None:
+                factor = previous + self.alpha * (factor - previous)
+            self._factors[preset] = factor
+        JOB_REALTIME_FACTOR.labels(preset=preset).set(factor)
+
+
+class _Watch:
+    __slots__ = ("task_id", "kind", "deadline", "timeout", "stall_seconds", "started", "processed")
+
+    def __init__(
+        self, task_id: str, kind: str, timeout: Optional[float], stall_seconds: Optional[float]
+    ):
+        self.task_id = task_id
+        self.kind = kind
+        self.timeout = timeout
+        self.stall_seconds = stall_seconds
+        # Armed when a worker picks the job up, queueing does not count
+        self.deadline: Optional[float] = None
+        self.started: Optional[float] = None
+        # Audio seconds actually processed, when less than the input
+        self.processed: Optional[float] = None
+
+    def __call__(self):
+        self.started = time.monotonic()
+        if self.timeout is not None:
+            self.deadline = self.started + self.timeout
+
+    def record(self, audio_seconds: float):
+        """Report how much of the input the job actually processed"""
+        self.processed = audio_seconds
+
+
+class Watchdog:
+    """Fails tasks that overrun their deadline or stop making progress"""
+
+    def __init__(self):
+        self.factors = RealTimeFactors(settings.job_default_realtime_factor)
+        self._watches: Dict[str, _Watch] = {}
+
+    def deadline_for(self, preset: str, audio_seconds: float) -> float:
+        """
+        Time allowed for a job
+
+        Args:
+            preset: Processing preset, e.g. "separate:htdemucs:cpu"
+            audio_seconds: Duration of the input
+
+        Returns:
+            Timeout in seconds
+        """
+        expected = audio_seconds * self.factors.get(preset)
+        timeout = settings.job_deadline_overhead_seconds + expected * settings.job_deadline_factor
+        return min(timeout, settings.job_deadline_max_seconds)
+
+    @asynccontextmanager
+    async def guard(
+        self,
+        task_id: Optional[str],
+        preset: str,
+        audio_seconds: Optional[float],
+        stall_seconds: Optional[float] = None,
+    ):
+        """
+        Watch a task while the block runs, and learn from it if it succeeds
+
+        Yields a callable that starts the clock. Call it (or pass it as the
+        job's on_start) when a worker picks the job up. Jobs that skip part
+        of their input report what they processed with its record(seconds),
+        the real-time factor is measured against that.
+
+        Args:
+            task_id: The task ID, nothing is watched without one
+            preset: Processing preset the real-time factor is tracked for
+            audio_seconds: Duration of the input, None if unknown to only
+                detect stalls
+            stall_seconds: Fail the task after this long without a progress
+                update (None to only enforce the deadline)
+        """
+        timeout = None if audio_seconds is None else self.deadline_for(preset, audio_seconds)
+        watch = _Watch(task_id, preset.split(":", 1)[0], timeout, stall_seconds)
+        if task_id is not None:
+            self._watches[task_id] = watch
+
+        try:
+            yield watch
+        finally:
+            if task_id is not None:
+                self._watches.pop(task_id, None)
+
+        if audio_seconds is None:
+            return
+        processed = audio_seconds if watch.processed is None else watch.processed
+        if watch.started is not None and processed >= audio_seconds * MIN_MEASURED_FRACTION:
+            self.factors.observe(preset, processed, time.monotonic() - watch.started)
+
+    async def check(self) -> Dict[str, ProcessingTimeoutError]:
+        """
+        Find watched tasks that should be failed
+
+        Returns:
+            Mapping of task ID to the timeout error for each expired task
+        """
+        now = time.monotonic()
+        expired = {}
+
+        for task_id, watch in list(self._watches.items()):
+            if watch.started is None:
+                continue
+            if watch.deadline is not None and now > watch.deadline:
+                expired[task_id] = ProcessingTimeoutError(
+                    f"Processing exceeded its deadline of {watch.timeout:.0f}s"
+                )
+                continue
+
+            if watch.stall_seconds is None:
+                continue
+            task = await task_manager.get_task(task_id)
+            if task is None:
+                continue
+            # Measured from the last update, but never from before the start
+            idle = min((datetime.now() - task.updated_at).total_seconds(), now - watch.started)
+            if idle > watch.stall_seconds:
+                expired[task_id] = ProcessingTimeoutError(
+                    f"Processing made no progress for {idle:.0f}s"
+                )
+
+        return expired
+
+    async def expire(self, task_id: str, error: ProcessingTimeoutError):
+        """Fail a task with a timeout and stop its job"""
+        watch = self._watches.pop(task_id, None)
+        if await task_manager.fail_task(task_id, error):
+            JOB_TIMEOUTS.labels(kind=watch.kind if watch else "unknown").inc()
+            print(f"Task {task_id} timed out: {error}")
+
+    async def run(self, interval: float = 1.0):
+        """Check watched tasks periodically"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for task_id, error in (await self.check()).items():
+                    await self.expire(task_id, error)
+            except Exception as e:
+                print(f"Watchdog error: {e}")
+
+
+# Global instance
+watchdog = Watchdog()
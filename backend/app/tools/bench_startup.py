@@ -0,0 +1,75 @@
+"""Startup-time benchmark for the API
+
+Imports app.main in fresh interpreters and reports how long it takes,
+and which heavy modules got imported along the way. Exits with status 1
+if any heavy module is imported eagerly or the median exceeds --budget.
+
+Usage (from the backend directory):
+    python -m app.tools.bench_startup --runs 5 --budget 1.5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+# Modules that must only be imported when actually needed
+HEAVY_MODULES = [
+    "torch",
+    "torchaudio",
+    "demucs",
+    "librosa",
+    "google.generativeai",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "heavy": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_once() -> dict:
+    """Import app.main in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters")
+    parser.add_argument("--budget", type=float, default=None, help="Max median import time (s)")
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    timings = sorted(run["seconds"] for run in runs)
+    heavy = sorted({name for run in runs for name in run["heavy"]})
+
+    print(f"import app.main over {args.runs} runs:")
+    print(f"  min    {timings[0] * 1000:8.1f} ms")
+    print(f"  median {statistics.median(timings) * 1000:8.1f} ms")
+    print(f"  max    {timings[-1] * 1000:8.1f} ms")
+    print(f"  heavy modules imported: {', '.join(heavy) or 'none'}")
+
+    failed = bool(heavy)
+    if args.budget is not None and statistics.median(timings) > args.budget:
+        print(f"FAIL: median import time exceeds budget of {args.budget:.2f} s")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Local stand-in for the Gemini generateContent API
+
+Answers every generateContent request with a fixed description and logs
+the payload size, so the client can be exercised without an API key or
+network access. Point the backend at it with
+GEMINI_API_BASE=http://127.0.0.1:8090 and any GOOGLE_API_KEY.
+
+Usage (from the backend directory):
+    python -m app.tools.gemini_stub --port 8090 --delay 0.5 --fail-rate 0.1
+"""
+
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DESCRIPTION = {
+    "genre": "electronic",
+    "subgenres": ["house"],
+    "mood": ["energetic"],
+    "instruments": ["drums", "bass", "synth"],
+    "vocals": False,
+    "description": "Stub description.",
+}
+
+
+def make_handler(delay: float, fail_rate: float):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+
+            parts = body.get("contents", [{}])[0].get("parts", [])
+            audio = sum(len(p["inline_data"]["data"]) for p in parts if "inline_data" in p)
+            print(f"{self.path.split('?')[0]}: {length} bytes ({audio} base64 audio)")
+
+            time.sleep(delay)
+            if not self.path.split("?")[0].endswith(":generateContent"):
+                self._reply(404, {"error": {"message": "Not found"}})
+            elif random.random() < fail_rate:
+                self._reply(503, {"error": {"message": "Stub overloaded"}})
+            else:
+                self._reply(200, {"candidates": [{"content": {
+                    "role": "model",
+                    "parts": [{"text": json.dumps(DESCRIPTION)}],
+                }}]})
+
+        def _reply(self, status: int, payload: dict):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--delay", type=float, default=0.0, help="Response latency (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of 503 answers")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.delay, args.fail_rate))
+    print(f"Gemini stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Import Demucs models into the local model repository
+
+Fetches each model with demucs (from the network, or from --source-repo,
+a directory of .th/.yaml files copied from a machine with access). Then
+converts it to the memory-mappable repository format and checks that
+the converted weights load back identical. --verify only checks the
+checksums of models already in the repository. Copy the repository to
+air-gapped hosts and set DEMUCS_REPO_DIR (and DEMUCS_REPO_OFFLINE=true).
+
+Usage (from the backend directory):
+    python -m app.tools.import_model htdemucs htdemucs_ft --repo ./models
+    python -m app.tools.import_model htdemucs --repo ./models --source-repo /mnt/demucs
+    python -m app.tools.import_model --verify --repo ./models
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from app.config import settings
+from app.core.exceptions import ModelRepositoryError
+from app.services.model_repository import ModelRepository
+
+
+def import_model(repository: ModelRepository, name: str, source_repo: Optional[Path] = None):
+    """Fetch, convert and round-trip check one model"""
+    import torch
+    from demucs.pretrained import get_model
+
+    start = time.perf_counter()
+    model = get_model(name, repo=source_repo)
+    manifest = repository.save(name, model)
+
+    loaded = repository.load(name)
+    original = model.state_dict()
+    for key, tensor in loaded.state_dict().items():
+        if not torch.equal(tensor, original[key].to(tensor.dtype)):
+            raise ModelRepositoryError(f"Tensor {key} of {name} changed during conversion")
+
+    print(
+        f"{name}: {len(manifest['models'])} model(s), {manifest['size'] / 1024 / 1024:.1f} MB, "
+        f"content hash {manifest['content_hash'][:16]} ({time.perf_counter() - start:.1f} s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("models", nargs="*", help="Model names, e.g. htdemucs")
+    parser.add_argument(
+        "--repo", type=Path, default=settings.demucs_repo_dir,
+        help="Model repository directory (default: DEMUCS_REPO_DIR)",
+    )
+    parser.add_argument(
+        "--source-repo", type=Path, default=None,
+        help="Local directory of demucs .th/.yaml files instead of downloading",
+    )
+    parser.add_argument(
+        "--verify", action="store_true",
+        help="Only check the checksums of the given (default: all) imported models",
+    )
+    args = parser.parse_args()
+
+    if args.repo is None:
+        parser.error("--repo is required when DEMUCS_REPO_DIR is not set")
+    repository = ModelRepository(args.repo)
+
+    failed = False
+    if args.verify:
+        for name in args.models or repository.list():
+            try:
+                repository.verify(name)
+                members, size = repository.describe(name)
+                print(f"{name}: OK ({members} model(s), {size / 1024 / 1024:.1f} MB)")
+            except ModelRepositoryError as e:
+                print(f"{name}: FAILED - {e}")
+                failed = True
+    else:
+        if not args.models:
+            parser.error("Give at least one model to import")
+        for name in args.models:
+            try:
+                import_model(repository, name, args.source_repo)
+            except Exception as e:
+                print(f"{name}: FAILED - {e}")
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+"""Load test for the whole API
+
+Simulated users replay a weighted mix of uploads, separations, task
+polling and stem downloads. Without --url the app runs in this process
+(requests go through httpx's ASGI transport, lifespan included), and
+event-loop lag is measured on the loop the app runs on. Separation is
+replaced by a deterministic stand-in that holds a separation worker for
+--separation-seconds and writes sine-wave stems, so the numbers describe
+the service rather than Demucs. With --url requests go to a running
+server, e.g. one started with the serve subcommand, which installs the
+same stand-in.
+
+Reports p50/p95/p99 latency, error rate and throughput per endpoint.
+Exits with status 1 if an error rate or latency budget is exceeded.
+
+Usage (from the backend directory):
+    python -m app.tools.load_test run --users 20 --duration 30 \\
+        --mix upload=1,separate=1,poll=6,download=2 \\
+        --budget poll:p95=50 --budget upload:p99=500 --max-loop-lag 100
+    python -m app.tools.load_test serve --port 8001 --separation-seconds 2
+    python -m app.tools.load_test run --url http://127.0.0.1:8001
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+ACTIONS = ("upload", "separate", "poll", "download")
+
+# Report label of each action, routes with their path parameters
+ENDPOINTS = {
+    "upload": "POST /api/upload",
+    "separate": "POST /api/audio/separate",
+    "poll": "GET /api/tasks/{task_id}",
+    "download": "GET /api/audio/download/{file_id}",
+}
+
+# MPEG-1 layer III, 128 kbps, 44.1 kHz, stereo, no CRC
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])
+MP3_FRAME_SIZE = 417
+MP3_SIDE_INFO_SIZE = 32
+
+STEM_SAMPLE_RATE = 44100
+STEM_FREQUENCIES = {"drums": 110.0, "bass": 55.0, "other": 440.0, "vocals": 220.0}
+
+
+def synthetic_mp3(seconds: float, tag: bytes) -> bytes:
+    """
+    Build a silent MP3 without an encoder
+
+    Every frame has empty side info, so it decodes to silence, and the tag
+    goes into the ancillary data, so each upload has its own content hash.
+
+    Args:
+        seconds: Duration
+        tag: Unique bytes for this file
+
+    Returns:
+        MP3 bytes
+    """
+    body = bytearray(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    tag = tag[:len(body) - MP3_SIDE_INFO_SIZE]
+    body[MP3_SIDE_INFO_SIZE:MP3_SIDE_INFO_SIZE + len(tag)] = tag
+    frame = MP3_FRAME_HEADER + bytes(body)
+    return frame * max(1, math.ceil(seconds * 44100 / 1152))
+
+
+def install_standin(separation_seconds: float, stem_seconds: float):
+    """
+    Replace Demucs separation with a fast deterministic stand-in
+
+    The stand-in keeps a separation worker busy for separation_seconds,
+    reports progress like the real service and stores sine-wave stems
+    under the usual file IDs, so polling and downloads work unchanged.
+
+    Args:
+        separation_seconds: Time each separation holds a worker
+        stem_seconds: Duration of the generated stems
+    """
+    from app.core.jobs import JobContext
+    from app.services.demucs_service import demucs_service
+    from app.services.stem_store import stem_store
+    from app.services.storage_service import storage_service
+    from app.services.task_manager import task_manager
+
+    t = np.arange(int(stem_seconds * STEM_SAMPLE_RATE), dtype=np.float32) / STEM_SAMPLE_RATE
+    stems = {
+        name: np.tile(0.25 * np.sin(2 * np.pi * freq * t), (2, 1))
+        for name, freq in STEM_FREQUENCIES.items()
+    }
+
+    def separate_sync(job, input_path) -> Dict[str, Any]:
+        job.start()
+        steps = 5
+        for step in range(steps):
+            job.progress(0.3 + 0.5 * step / steps, "Separating sources (stand-in)...")
+            time.sleep(separation_seconds / steps)
+
+        result: Dict[str, Any] = {}
+        for name, source in stems.items():
+            stem_file_id = f"{input_path.stem}_{name}"
+            stem_store.write(stem_file_id, source, STEM_SAMPLE_RATE)
+            result[name] = stem_file_id
+        result.update(skipped_seconds=0.0, reused_seconds=0.0, saved_seconds=0.0)
+        return result
+
+    async def separate_audio(
+        file_id: str,
+        model_name: str = "htdemucs",
+        task_id: Optional[str] = None,
+        job: Optional[JobContext] = None,
+    ) -> Dict[str, Any]:
+        input_path = await storage_service.get_file_path(file_id, directory="upload", fetch=False)
+        if not input_path:
+            raise FileNotFoundError(f"File {file_id} not found")
+
+        job = job or task_manager.job_context(task_id)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(demucs_service.executor, separate_sync, job, input_path)
+
+    demucs_service.separate_audio = separate_audio
+
+
+class Stats:
+    """Latencies and errors per action, plus separation job outcomes"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {action: [] for action in ACTIONS}
+        self.errors: Dict[str, int] = {action: 0 for action in ACTIONS}
+        self.error_samples: Dict[str, str] = {}
+        self.loop_lag: List[float] = []
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.job_seconds: List[float] = []
+
+    def record(self, action: str, seconds: float, error: Optional[str] = None):
+        self.latencies[action].append(seconds)
+        if error is not None:
+            self.errors[action] += 1
+            self.error_samples.setdefault(action, error)
+
+
+class Traffic:
+    """State shared by the simulated users: what exists to act on"""
+
+    def __init__(self):
+        self.uploads: List[str] = []
+        # Task ID -> submission time
+        self.pending: Dict[str, float] = {}
+        self.stems: List[str] = []
+        self.counter = 0
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of values, q in [0, 100]"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+async def timed(stats: Stats, action: str, request) -> Optional[Any]:
+    """Send one request and record its latency and outcome"""
+    started = time.perf_counter()
+    try:
+        response = await request
+    except Exception as e:
+        stats.record(action, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+        return None
+
+    elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        stats.record(action, elapsed, f"HTTP {response.status_code}: {response.text[:200]}")
+        return None
+    stats.record(action, elapsed)
+    return response
+
+
+async def simulate_user(
+    client,
+    traffic: Traffic,
+    stats: Stats,
+    mix: Dict[str, float],
+    stop_at: float,
+    rng: random.Random,
+    args: argparse.Namespace,
+):
+    """One simulated user, acting until the test ends"""
+    actions = list(mix)
+    weights = [mix[action] for action in actions]
+
+    while time.monotonic() < stop_at:
+        action = rng.choices(actions, weights)[0]
+        # Act on what exists, fall back to creating it
+        if action == "download" and not traffic.stems:
+            action = "poll"
+        if action == "poll" and not traffic.pending:
+            action = "separate"
+        if action == "separate" and not traffic.uploads:
+            action = "upload"
+
+        if action == "upload":
+            traffic.counter += 1
+            data = synthetic_mp3(args.upload_seconds, f"load-test-{traffic.counter}".encode())
+            response = await timed(stats, action, client.post(
+                "/api/upload",
+                files={"file": (f"load_{traffic.counter}.mp3", data, "audio/mpeg")},
+            ))
+            if response is not None:
+                traffic.uploads.append(response.json()["file_id"])
+
+        elif action == "separate":
+            response = await timed(stats, action, client.post(
+                "/api/audio/separate",
+                json={"file_id": rng.choice(traffic.uploads)},
+            ))
+            if response is not None:
+                traffic.pending[response.json()["task_id"]] = time.monotonic()
+
+        elif action == "poll":
+            task_id = rng.choice(list(traffic.pending))
+            response = await timed(stats, action, client.get(f"/api/tasks/{task_id}"))
+            if response is not None and task_id in traffic.pending:
+                task = response.json()
+                if task["status"] in ("completed", "failed", "cancelled"):
+                    submitted = traffic.pending.pop(task_id)
+                    if task["status"] == "completed":
+                        stats.jobs_completed += 1
+                        stats.job_seconds.append(time.monotonic() - submitted)
+                        traffic.stems.extend(
+                            v for v in (task["result"] or {}).values() if isinstance(v, str)
+                        )
+                    else:
+                        stats.jobs_failed += 1
+
+        else:
+            file_id = rng.choice(traffic.stems)
+            await timed(stats, action, client.get(
+                f"/api/audio/download/{file_id}", params={"format": args.download_format},
+            ))
+
+        if args.think > 0:
+            await asyncio.sleep(rng.expovariate(1 / args.think))
+
+
+async def measure_loop_lag(stats: Stats, interval: float = 0.05):
+    """Sample how late the event loop wakes up a sleeping coroutine"""
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run_load(args: argparse.Namespace, mix: Dict[str, float]) -> Tuple[Stats, float]:
+    """Run the simulated users against the app and collect statistics"""
+    import httpx
+
+    stats = Stats()
+    traffic = Traffic()
+    timeout = httpx.Timeout(args.timeout)
+
+    if args.url:
+        client = httpx.AsyncClient(
+            base_url=args.url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=args.users),
+        )
+        lifespan = None
+    else:
+        from app.main import app
+
+        if not args.real_separation:
+            install_standin(args.separation_seconds, args.stem_seconds)
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://load-test",
+            timeout=timeout,
+        )
+        lifespan = app.router.lifespan_context(app)
+
+    async with client:
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        monitor = asyncio.ensure_future(measure_loop_lag(stats)) if lifespan is not None else None
+
+        started = time.monotonic()
+        stop_at = started + args.duration
+        try:
+            await asyncio.gather(*(
+                simulate_user(client, traffic, stats, mix, stop_at, random.Random(args.seed + i), args)
+                for i in range(args.users)
+            ))
+            elapsed = time.monotonic() - started
+        finally:
+            if monitor is not None:
+                monitor.cancel()
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    return stats, elapsed
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse "upload=1,poll=6" into action weights"""
+    mix = {}
+    for part in text.split(","):
+        action, _, weight = part.partition("=")
+        action = action.strip()
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown action {action!r}, use {', '.join(ACTIONS)}")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def parse_budget(text: str) -> Tuple[str, float, float]:
+    """Parse "poll:p95=50" into (action, percentile, milliseconds)"""
+    try:
+        action, rest = text.split(":", 1)
+        name, limit = rest.split("=", 1)
+        q = float(name.lstrip("p"))
+        limit_ms = float(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Budget {text!r} is not ACTION:pNN=MS")
+    if action not in ACTIONS:
+        raise argparse.ArgumentTypeError(f"Unknown action {action!r}, use {', '.join(ACTIONS)}")
+    return action, q, limit_ms
+
+
+def report(stats: Stats, elapsed: float) -> Dict[str, Any]:
+    """Summarize the collected statistics"""
+    endpoints = {}
+    for action in ACTIONS:
+        latencies = stats.latencies[action]
+        if not latencies:
+            continue
+        endpoints[ENDPOINTS[action]] = {
+            "requests": len(latencies),
+            "errors": stats.errors[action],
+            "error_rate": stats.errors[action] / len(latencies),
+            "throughput_rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+
+    requests = sum(len(values) for values in stats.latencies.values())
+    errors = sum(stats.errors.values())
+    jobs = stats.jobs_completed + stats.jobs_failed
+    return {
+        "duration_seconds": elapsed,
+        "requests": requests,
+        "errors": errors,
+        "error_rate": errors / requests if requests else 0.0,
+        "throughput_rps": requests / elapsed if elapsed else 0.0,
+        "endpoints": endpoints,
+        "error_samples": stats.error_samples,
+        "loop_lag_ms": {
+            "p50": percentile(stats.loop_lag, 50) * 1000,
+            "p99": percentile(stats.loop_lag, 99) * 1000,
+            "max": max(stats.loop_lag, default=0.0) * 1000,
+        } if stats.loop_lag else None,
+        "separations": {
+            "completed": stats.jobs_completed,
+            "failed": stats.jobs_failed,
+            "failure_rate": stats.jobs_failed / jobs if jobs else 0.0,
+            "p50_seconds": percentile(stats.job_seconds, 50),
+            "p95_seconds": percentile(stats.job_seconds, 95),
+        },
+    }
+
+
+def check_budgets(summary: Dict[str, Any], stats: Stats, args: argparse.Namespace) -> List[str]:
+    """Describe every budget the run exceeded"""
+    failures = []
+    if summary["error_rate"] > args.max_error_rate:
+        failures.append(
+            f"error rate {summary['error_rate']:.2%} exceeds {args.max_error_rate:.2%}"
+        )
+    if summary["separations"]["failure_rate"] > args.max_error_rate:
+        failures.append(
+            f"separation failure rate {summary['separations']['failure_rate']:.2%} "
+            f"exceeds {args.max_error_rate:.2%}"
+        )
+
+    for action, q, limit_ms in args.budget:
+        value = percentile(stats.latencies[action], q) * 1000
+        if value > limit_ms:
+            failures.append(f"{ENDPOINTS[action]} p{q:g} {value:.1f} ms exceeds {limit_ms:g} ms")
+
+    lag = summary["loop_lag_ms"]
+    if args.max_loop_lag is not None and lag is not None and lag["p99"] > args.max_loop_lag:
+        failures.append(f"event loop lag p99 {lag['p99']:.1f} ms exceeds {args.max_loop_lag:g} ms")
+    return failures
+
+
+def print_report(summary: Dict[str, Any]):
+    print(
+        f"{summary['requests']} requests in {summary['duration_seconds']:.1f} s "
+        f"({summary['throughput_rps']:.1f} req/s), {summary['errors']} errors"
+    )
+    print(f"  {'endpoint':36} {'reqs':>6} {'err%':>6} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, row in summary["endpoints"].items():
+        print(
+            f"  {endpoint:36} {row['requests']:6d} {row['error_rate'] * 100:6.1f} "
+            f"{row['throughput_rps']:7.1f} {row['p50_ms']:6.1f}ms {row['p95_ms']:6.1f}ms "
+            f"{row['p99_ms']:6.1f}ms"
+        )
+
+    lag = summary["loop_lag_ms"]
+    if lag is not None:
+        print(f"  event loop lag: p50 {lag['p50']:.1f} ms, p99 {lag['p99']:.1f} ms, max {lag['max']:.1f} ms")
+    jobs = summary["separations"]
+    print(
+        f"  separations: {jobs['completed']} completed, {jobs['failed']} failed, "
+        f"p50 {jobs['p50_seconds']:.1f} s, p95 {jobs['p95_seconds']:.1f} s"
+    )
+    for action, error in summary["error_samples"].items():
+        print(f"  first {action} error: {error}")
+
+
+def serve(args: argparse.Namespace):
+    """Run the API on localhost with the separation stand-in"""
+    import uvicorn
+
+    from app.main import app
+
+    install_standin(args.separation_seconds, args.stem_seconds)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Generate load and report")
+    run.add_argument("--url", default=None, help="Server to test (default: the app in-process)")
+    run.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    run.add_argument("--duration", type=float, default=30.0, help="Test length (s)")
+    run.add_argument(
+        "--mix", type=parse_mix, default="upload=1,separate=1,poll=6,download=2",
+        help="Action weights, e.g. upload=1,separate=1,poll=6,download=2",
+    )
+    run.add_argument("--think", type=float, default=0.1, help="Mean pause between actions (s)")
+    run.add_argument("--upload-seconds", type=float, default=10.0, help="Length of uploaded files (s)")
+    run.add_argument("--download-format", choices=["mp3", "wav", "flac"], default="wav")
+    run.add_argument("--timeout", type=float, default=60.0, help="Request timeout (s)")
+    run.add_argument("--seed", type=int, default=0, help="Seed of the first user")
+    run.add_argument(
+        "--real-separation", action="store_true",
+        help="Run Demucs instead of the stand-in (in-process only)",
+    )
+    run.add_argument(
+        "--budget", type=parse_budget, action="append", default=[],
+        help="Latency budget ACTION:pNN=MS, e.g. poll:p95=50 (repeatable)",
+    )
+    run.add_argument("--max-error-rate", type=float, default=0.0, help="Allowed error rate (0-1)")
+    run.add_argument("--max-loop-lag", type=float, default=None, help="Max p99 event loop lag (ms)")
+    run.add_argument("--json", default=None, help="Also write the report to this file")
+
+    serve_parser = commands.add_parser("serve", help="Run the API with the separation stand-in")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8001)
+
+    for command in (run, serve_parser):
+        command.add_argument(
+            "--separation-seconds", type=float, default=1.0, help="Stand-in separation time (s)",
+        )
+        command.add_argument(
+            "--stem-seconds", type=float, default=5.0, help="Length of stand-in stems (s)",
+        )
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+        return
+
+    stats, elapsed = asyncio.run(run_load(args, args.mix))
+    summary = report(stats, elapsed)
+    print_report(summary)
+
+    failures = check_budgets(summary, stats, args)
+    summary["failures"] = failures
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
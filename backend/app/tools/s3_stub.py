@@ -0,0 +1,231 @@
+"""Local stand-in for an S3-compatible object store
+
+Serves the subset of the S3 API the backend uses, path-style, from a
+local directory: PUT/GET (with Range)/HEAD/DELETE of objects, multipart
+uploads and ListObjectsV2. Buckets are created on first use and any
+credentials are accepted. Point the backend at it with
+STORAGE_BACKEND=s3, S3_ENDPOINT_URL=http://127.0.0.1:9000, S3_BUCKET=audio
+and any S3_ACCESS_KEY/S3_SECRET_KEY. --delay adds latency to every
+request, to see the effect of parallel transfers.
+
+Usage (from the backend directory):
+    python -m app.tools.s3_stub --port 9000 --root ./s3-stub --delay 0.02
+"""
+
+import argparse
+import hashlib
+import re
+import shutil
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+
+# Multipart uploads in progress are kept under this directory of the root
+UPLOADS_DIR = ".multipart"
+
+
+def make_handler(root: Path, delay: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _parse(self):
+            url = urlsplit(self.path)
+            bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+            query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+            return bucket, key, query
+
+        def _object(self, bucket: str, key: str) -> Path:
+            path = (root / bucket / key).resolve()
+            if not path.is_relative_to((root / bucket).resolve()):
+                raise ValueError(f"Invalid key {key}")
+            return path
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if "Content-Length" not in (headers or {}):
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body and self.command != "HEAD":
+                self.wfile.write(body)
+
+        def _error(self, status: int, code: str):
+            body = f"<?xml version=\"1.0\"?><Error><Code>{code}</Code></Error>".encode()
+            self._reply(status, body, {"Content-Type": "application/xml"})
+
+        def _handle(self, method):
+            time.sleep(delay)
+            try:
+                bucket, key, query = self._parse()
+                if not bucket:
+                    self._error(400, "InvalidBucketName")
+                else:
+                    method(bucket, key, query)
+            except (ValueError, KeyError) as e:
+                print(f"{self.command} {self.path}: {e}")
+                self._error(400, "InvalidRequest")
+
+        def do_PUT(self):
+            self._handle(self._put)
+
+        def do_POST(self):
+            self._handle(self._post)
+
+        def do_GET(self):
+            self._handle(self._get)
+
+        def do_HEAD(self):
+            self._handle(self._get)
+
+        def do_DELETE(self):
+            self._handle(self._delete)
+
+        def _put(self, bucket: str, key: str, query: dict):
+            data = self._body()
+            if not key:
+                (root / bucket).mkdir(parents=True, exist_ok=True)
+            elif "uploadId" in query:
+                part_dir = root / UPLOADS_DIR / query["uploadId"]
+                if not part_dir.exists():
+                    return self._error(404, "NoSuchUpload")
+                (part_dir / f"{int(query['partNumber']):05d}").write_bytes(data)
+            else:
+                path = self._object(bucket, key)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+                tmp_path.write_bytes(data)
+                tmp_path.replace(path)
+            self._reply(200, headers={"ETag": f"\"{hashlib.md5(data).hexdigest()}\""})
+
+        def _post(self, bucket: str, key: str, query: dict):
+            body = self._body()
+            if "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                (root / UPLOADS_DIR / upload_id).mkdir(parents=True)
+                self._reply(200, (
+                    f"<?xml version=\"1.0\"?><InitiateMultipartUploadResult>"
+                    f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                    f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+                ).encode(), {"Content-Type": "application/xml"})
+                return
+
+            part_dir = root / UPLOADS_DIR / query["uploadId"]
+            if not part_dir.exists():
+                return self._error(404, "NoSuchUpload")
+            numbers = [int(n) for n in re.findall(r"<PartNumber>(\d+)</PartNumber>", body.decode())]
+            path = self._object(bucket, key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, "wb") as out:
+                for number in numbers:
+                    with open(part_dir / f"{number:05d}", "rb") as part:
+                        shutil.copyfileobj(part, out)
+            tmp_path.replace(path)
+            shutil.rmtree(part_dir, ignore_errors=True)
+            print(f"Completed {bucket}/{key} from {len(numbers)} parts")
+            self._reply(200, (
+                f"<?xml version=\"1.0\"?><CompleteMultipartUploadResult>"
+                f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                f"</CompleteMultipartUploadResult>"
+            ).encode(), {"Content-Type": "application/xml"})
+
+        def _get(self, bucket: str, key: str, query: dict):
+            if not key:
+                return self._list(bucket, query)
+
+            path = self._object(bucket, key)
+            if not path.is_file():
+                return self._error(404, "NoSuchKey")
+            size = path.stat().st_size
+
+            start, end = 0, size - 1
+            match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+            if match:
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                else:
+                    start = max(0, size - int(match.group(2)))
+                if start >= size:
+                    return self._error(416, "InvalidRange")
+
+            headers = {
+                "Content-Type": "application/octet-stream",
+                "Content-Length": str(end - start + 1),
+                "Accept-Ranges": "bytes",
+            }
+            if match:
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            self.send_response(206 if match else 200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command == "HEAD":
+                return
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 256 * 1024))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+        def _list(self, bucket: str, query: dict):
+            prefix = query.get("prefix", "")
+            base = root / bucket
+            keys = sorted(
+                path.relative_to(base).as_posix()
+                for path in base.rglob("*")
+                if path.is_file() and not path.name.endswith(".tmp")
+            ) if base.exists() else []
+            contents = "".join(
+                f"<Contents><Key>{escape(k)}</Key></Contents>" for k in keys if k.startswith(prefix)
+            )
+            self._reply(200, (
+                f"<?xml version=\"1.0\"?><ListBucketResult><Name>{escape(bucket)}</Name>"
+                f"<Prefix>{escape(prefix)}</Prefix><IsTruncated>false</IsTruncated>"
+                f"{contents}</ListBucketResult>"
+            ).encode(), {"Content-Type": "application/xml"})
+
+        def _delete(self, bucket: str, key: str, query: dict):
+            if "uploadId" in query:
+                shutil.rmtree(root / UPLOADS_DIR / query["uploadId"], ignore_errors=True)
+            else:
+                self._object(bucket, key).unlink(missing_ok=True)
+            self._reply(204)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--root", type=Path, default=Path("./s3-stub"), help="Directory holding the buckets")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds added to every request")
+    args = parser.parse_args()
+
+    args.root.mkdir(parents=True, exist_ok=True)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.root, args.delay))
+    print(f"S3 stub listening on http://{args.host}:{args.port}, objects in {args.root}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
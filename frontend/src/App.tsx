@@ -38,7 +38,12 @@ function App() {
 
   const handleProcessingComplete = (result: any) => {
     if (taskType === 'separation' && result) {
-      setSeparatedTracks(result);
+      // Keep the stems, the result also carries numeric statistics
+      setSeparatedTracks(
+        Object.fromEntries(
+          Object.entries(result).filter(([, value]) => typeof value === 'string')
+        ) as Record<string, string>
+      );
     }
     setCurrentTaskId(null);
   };
@@ -2,9 +2,10 @@
  * Processing controls component
  */
 
-import { useState } from 'react';
-import { Scissors, ChevronUp, Gauge } from 'lucide-react';
+import { useEffect, useRef, useState } from 'react';
+import { Scissors, ChevronUp, Gauge, Headphones } from 'lucide-react';
 import { audioService } from '../../services/audioService';
+import { PreviewPlayer } from '../../services/previewService';
 import toast from 'react-hot-toast';
 import './ProcessingControls.css';
 
@@ -22,6 +23,37 @@ export const ProcessingControls: React.FC<ProcessingControlsProps> = ({
   const [isProcessing, setIsProcessing] = useState(false);
   const [pitchSemitones, setPitchSemitones] = useState(0);
   const [tempoFactor, setTempoFactor] = useState(1.0);
+  const [isPreviewing, setIsPreviewing] = useState(false);
+  const playerRef = useRef<PreviewPlayer | null>(null);
+
+  useEffect(() => {
+    const player = new PreviewPlayer(fileId, () => setIsPreviewing(false));
+    playerRef.current = player;
+    return () => {
+      player.stop();
+      setIsPreviewing(false);
+    };
+  }, [fileId]);
+
+  // Slider moves are streamed to the running preview, no render needed
+  useEffect(() => {
+    if (isPreviewing) {
+      playerRef.current?.setParams({ semitones: pitchSemitones, tempo: tempoFactor });
+    }
+  }, [pitchSemitones, tempoFactor, isPreviewing]);
+
+  const handlePreview = () => {
+    const player = playerRef.current;
+    if (!player) return;
+
+    if (isPreviewing) {
+      player.stop();
+      setIsPreviewing(false);
+    } else {
+      player.start(0, { semitones: pitchSemitones, tempo: tempoFactor });
+      setIsPreviewing(true);
+    }
+  };
 
   const handleSeparate = async () => {
     setIsProcessing(true);
@@ -164,6 +196,24 @@ export const ProcessingControls: React.FC<ProcessingControlsProps> = ({
             Apply Tempo
           </button>
         </div>
+
+        {/* Live Preview */}
+        <div className="control-card">
+          <div className="control-header">
+            <Headphones size={24} className="control-icon" />
+            <h4>Live Preview</h4>
+          </div>
+          <p className="control-description">
+            Hear pitch and tempo settings while moving the sliders, apply them once they sound right
+          </p>
+          <button
+            onClick={handlePreview}
+            disabled={disabled}
+            className="control-button secondary"
+          >
+            {isPreviewing ? 'Stop Preview' : 'Start Preview'}
+          </button>
+        </div>
       </div>
     </div>
   );
@@ -0,0 +1,163 @@
+/**
+ * Real-time pitch/tempo preview over WebSocket
+ */
+
+import { apiClient } from './api';
+
+export interface PreviewParams {
+  semitones: number;
+  tempo: number;
+}
+
+interface PreviewFormat {
+  sample_rate: number;
+  channels: number;
+  block_frames: number;
+}
+
+// Block header: float64 track position (s), uint32 seek generation
+const HEADER_BYTES = 12;
+
+// Scheduling margin so the first blocks do not start in the past
+const START_DELAY = 0.05;
+
+/**
+ * Plays the preview stream of an upload and forwards setting changes
+ */
+export class PreviewPlayer {
+  private socket: WebSocket | null = null;
+  private context: AudioContext | null = null;
+  private format: PreviewFormat | null = null;
+  private generation = 0;
+  private nextTime = 0;
+  private sources: AudioBufferSourceNode[] = [];
+
+  constructor(
+    private fileId: string,
+    // Called when the stream stops by itself (end of track, server closed it)
+    private onStop?: () => void,
+  ) {}
+
+  /**
+   * Open the stream at a position with initial settings
+   */
+  start(position: number, params: PreviewParams): void {
+    this.stop();
+
+    const base = (apiClient.defaults.baseURL || window.location.origin).replace(/^http/, 'ws');
+    const query = new URLSearchParams({
+      position: String(position),
+      semitones: String(params.semitones),
+      tempo: String(params.tempo),
+    });
+    const socket = new WebSocket(`${base}/api/audio/preview/${this.fileId}?${query}`);
+    socket.binaryType = 'arraybuffer';
+
+    this.context = new AudioContext();
+    this.generation = 0;
+    this.nextTime = 0;
+
+    socket.onmessage = (event) => {
+      if (typeof event.data === 'string') {
+        this.handleEvent(JSON.parse(event.data));
+      } else {
+        this.playBlock(event.data as ArrayBuffer);
+      }
+    };
+    socket.onclose = () => {
+      if (this.socket === socket) {
+        this.stop();
+        this.onStop?.();
+      }
+    };
+    this.socket = socket;
+  }
+
+  /**
+   * Change pitch and tempo without restarting the stream
+   */
+  setParams(params: PreviewParams): void {
+    this.send({ type: 'params', ...params });
+  }
+
+  /**
+   * Jump to a position in the track
+   */
+  seek(position: number): void {
+    this.generation += 1;
+    this.flush();
+    this.send({ type: 'seek', position });
+  }
+
+  stop(): void {
+    const socket = this.socket;
+    this.socket = null;
+    socket?.close();
+    this.flush();
+    this.context?.close();
+    this.context = null;
+    this.format = null;
+  }
+
+  private send(message: object): void {
+    if (this.socket?.readyState === WebSocket.OPEN) {
+      this.socket.send(JSON.stringify(message));
+    }
+  }
+
+  private flush(): void {
+    this.sources.forEach((source) => source.stop());
+    this.sources = [];
+    this.nextTime = 0;
+  }
+
+  private handleEvent(message: any): void {
+    if (message.type === 'format') {
+      this.format = message;
+    } else if (message.type === 'end' && message.generation === this.generation) {
+      // Let the scheduled blocks play out before closing
+      const socket = this.socket;
+      const remaining = this.context ? this.nextTime - this.context.currentTime : 0;
+      window.setTimeout(() => {
+        if (this.socket === socket && this.generation === message.generation) {
+          this.stop();
+          this.onStop?.();
+        }
+      }, Math.max(0, remaining) * 1000);
+    } else if (message.type === 'error') {
+      console.error('Preview error:', message.detail);
+    }
+  }
+
+  private playBlock(data: ArrayBuffer): void {
+    const context = this.context;
+    const format = this.format;
+    if (!context || !format) return;
+
+    const header = new DataView(data, 0, HEADER_BYTES);
+    // Blocks from before the last seek are still in flight, drop them
+    if (header.getUint32(8, true) !== this.generation) return;
+
+    const samples = new Int16Array(data, HEADER_BYTES);
+    const frames = samples.length / format.channels;
+    const buffer = context.createBuffer(format.channels, frames, format.sample_rate);
+    for (let channel = 0; channel < format.channels; channel++) {
+      const output = buffer.getChannelData(channel);
+      for (let i = 0; i < frames; i++) {
+        output[i] = samples[i * format.channels + channel] / 32768;
+      }
+    }
+
+    const source = context.createBufferSource();
+    source.buffer = buffer;
+    source.connect(context.destination);
+    this.nextTime = Math.max(this.nextTime, context.currentTime + START_DELAY);
+    source.start(this.nextTime);
+    this.nextTime += buffer.duration;
+
+    this.sources.push(source);
+    source.onended = () => {
+      this.sources = this.sources.filter((s) => s !== source);
+    };
+  }
+}